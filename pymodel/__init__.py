@@ -81,8 +81,10 @@ def _install():
 _install()
 
 ROOTOBJECT_TYPES = dict()
+# Folder of every initialized domain, by domain name
+DOMAIN_PATHS = dict()
 
-def init(model_path, model_domain):
+def init(model_path, model_domain, lazy=False):
     '''Initialize the Pymodel library
 
     @param model_path: Folder path containing all root object model modules for domain
@@ -92,31 +94,125 @@ def init(model_path, model_domain):
     @param model_domain: Name of the domain where rootobjects belong to
     @type model_domain: string    
     
+    @param lazy: Only import the module defining a root object type when the
+                 type is first looked up. The types defined by each module
+                 are cached in a manifest file (see
+                 L{pymodel.utils.DomainManifest}), so unchanged modules are
+                 not imported at all
+    @type lazy: bool
     '''
     import logging
     logger = logging.getLogger('pymodel.init')
     
     import pymodel.utils
 
-    types = list(pymodel.utils.find_rootobject_types(model_path, model_domain))
-    
     if not model_domain in ROOTOBJECT_TYPES.keys():
-        ROOTOBJECT_TYPES[model_domain] = {}
-        
+        ROOTOBJECT_TYPES[model_domain] = pymodel.utils.RootObjectTypes()
+
+    registry = ROOTOBJECT_TYPES[model_domain]
+    DOMAIN_PATHS[model_domain] = model_path
+    prefix = 'pymodel.%s._rootobjects.' % model_domain
+
+    def register(name, modname, type_):
+        if name in registry:
+            current = registry.placeholder(name)
+            if current is not None:
+                current_modname = prefix + current.module_name
+            else:
+                current_modname = dict.__getitem__(registry, name).__module__
+            if current_modname != modname:
+                raise RuntimeError('Duplicate root object type %s' % name)
+            # Domain initialized again, keep the loaded type
+            if current is None:
+                return
+        registry[name] = type_
+
+    if lazy:
+        manifest = pymodel.utils.DomainManifest(model_path)
+        found = manifest.scan(model_domain)
+        manifest.save()
+
+        for name, module_name, module_path, info in found:
+            register(name, prefix + module_name,
+                     pymodel.utils.LazyRootObjectType(
+                         model_domain, name, module_name, module_path,
+                         info['type_name']))
+        return
+
+    types = list(pymodel.utils.find_rootobject_types(model_path, model_domain))
 
     for type_ in types:
-        name = type_.__name__
-        if name in ROOTOBJECT_TYPES[model_domain]:
-            raise RuntimeError('Duplicate root object type %s' % name)
-        ROOTOBJECT_TYPES[model_domain][name] = type_
+        register(type_.__name__, type_.__module__, type_)
+
+def reload_domain(model_domain):
+    '''Re-import the model modules of a domain which changed on disk
+
+    Only the changed modules are imported again. Their root object types are
+    replaced in ROOTOBJECT_TYPES, and the caches of all model types defined in
+    them are invalidated. Types of unchanged modules, and the caches of those
+    types, are left alone. Model modules added to the domain folder are
+    loaded as well.
+
+    Note types imported by other model modules are not replaced in those
+    modules.
+
+    @param model_domain: Name of the domain to reload
+    @type model_domain: string
+
+    @return: Names of the modules which were reloaded, added or removed
+    @rtype: list
+    '''
+    import os
+    import sys
+    import pymodel.utils
+
+    model_path = DOMAIN_PATHS[model_domain]
+    registry = ROOTOBJECT_TYPES[model_domain]
+
+    changes = pymodel.utils.reload_model_modules(model_domain, model_path)
+
+    # Load modules which were added since the domain was initialized
+    prefix = 'pymodel.%s._rootobjects.' % model_domain
+    pending = set(placeholder.module_name for placeholder in
+                  (registry.placeholder(name) for name in registry.keys()) if
+                  placeholder is not None)
+    for filename in os.listdir(model_path):
+        module_name = filename[:-3]
+        if not filename.endswith('.py') or module_name in pending or \
+           '%s%s' % (prefix, module_name) in sys.modules:
+            continue
+        changes.append((None, pymodel.utils.load_model_module(
+            model_domain, module_name, os.path.join(model_path, filename))))
+
+    stale = list()
+    for old, new in changes:
+        if old is None:
+            continue
+        for type_ in pymodel.utils.module_rootobject_types(old):
+            if dict.get(registry, type_.__name__) is type_:
+                dict.pop(registry, type_.__name__)
+        stale.extend(pymodel.utils.module_model_types(old))
+
+    for old, new in changes:
+        if new is None:
+            continue
+        for type_ in pymodel.utils.module_rootobject_types(new):
+            name = type_.__name__
+            if name in registry:
+                raise RuntimeError('Duplicate root object type %s' % name)
+            registry[name] = type_
+
+    pymodel.utils.invalidate_type_caches(stale)
+
+    return [(old or new).__name__ for (old, new) in changes]
 
-def init_domain(model_path):
+def init_domain(model_path, lazy=False):
     import os
     for domain in os.listdir(model_path):
         fullpath = os.path.join(model_path, domain)
         if not os.path.isdir(fullpath):
             continue
-        init(fullpath, domain)
+        init(fullpath, domain, lazy)
         
         
 # Set up binding to PyMonkey logging
@@ -0,0 +1,160 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Asynchronous serialization helpers
+
+These helpers build on trollius, the asyncio port for Python 2, and keep
+CPU heavy serialization off the event loop by running it in an executor.
+They also read and write framed object streams on asyncio
+StreamReader/StreamWriter pairs. Every frame is a 4-byte big-endian length
+followed by the serialized object. Writers wait for the transport to drain
+after every frame, which gives backpressure to fast producers.
+
+Model instances can't be pickled, so the executor should be a thread pool.
+When no executor is given, the default executor of the event loop is used.
+
+All coroutines are written in trollius style (C{yield From(...)}) and
+can be scheduled from trollius code, e.g.::
+
+    object_ = yield From(pymodel.aio.read_object(reader, MyType,
+                                                 ThriftSerializer))
+'''
+
+import struct
+import logging
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    asyncio = None
+
+logger = logging.getLogger('pymodel.aio')
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_default_executor = None
+
+
+def _check_support():
+    if asyncio is None:
+        raise RuntimeError('No asyncio support on this system, install '
+                           'trollius')
+
+def _coroutine(func):
+    if asyncio is None:
+        return func
+    return asyncio.coroutine(func)
+
+def set_default_executor(executor):
+    '''Set the executor used when none is given explicitly
+
+    @param executor: Executor to use, or None to use the default executor of
+                     the event loop
+    @type executor: concurrent.futures.Executor
+    '''
+    global _default_executor #pylint: disable-msg=W0603
+    _default_executor = executor
+
+def _run(loop, executor, func, *args):
+    _check_support()
+    loop = loop or asyncio.get_event_loop()
+    if executor is None:
+        executor = _default_executor
+    return loop.run_in_executor(executor, func, *args)
+
+def serialize(serializer, object_, executor=None, loop=None):
+    '''Serialize an object in an executor
+
+    @return: Future resolving to the serialized object
+    @rtype: asyncio.Future
+    '''
+    return _run(loop, executor, serializer.serialize, object_)
+
+def deserialize(type_, serializer, data, executor=None, loop=None):
+    '''Deserialize an object in an executor
+
+    @return: Future resolving to the deserialized object
+    @rtype: asyncio.Future
+    '''
+    return _run(loop, executor, serializer.deserialize, type_, data)
+
+@_coroutine
+def write_object(writer, serializer, object_, executor=None, loop=None):
+    '''Serialize an object and write it as one frame
+
+    @param writer: Stream to write to
+    @type writer: asyncio.StreamWriter
+    '''
+    data = yield From(serialize(serializer, object_, executor, loop))
+    if len(data) > MAX_FRAME_SIZE:
+        raise ValueError('Serialized object too large (%d bytes)' %
+                         len(data))
+
+    writer.write(FRAME_HEADER.pack(len(data)))
+    writer.write(data)
+    yield From(writer.drain())
+
+@_coroutine
+def write_objects(writer, serializer, objects, executor=None, loop=None):
+    '''Write a sequence of objects, one frame per object'''
+    for object_ in objects:
+        yield From(write_object(writer, serializer, object_, executor, loop))
+
+@_coroutine
+def read_object(reader, type_, serializer, executor=None, loop=None):
+    '''Read one frame and deserialize the object it contains
+
+    @param reader: Stream to read from
+    @type reader: asyncio.StreamReader
+
+    @return: The object read, or None if the stream ended
+    @rtype: L{pymodel.model.Model}
+    '''
+    try:
+        header = yield From(reader.readexactly(FRAME_HEADER.size))
+    except asyncio.IncompleteReadError, e:
+        if e.partial:
+            raise
+        raise Return(None)
+
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError('Frame too large (%d bytes)' % size)
+
+    data = yield From(reader.readexactly(size))
+    object_ = yield From(deserialize(type_, serializer, data, executor, loop))
+    raise Return(object_)
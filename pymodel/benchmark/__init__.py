@@ -0,0 +1,57 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Serializer benchmark suite
+
+Measures every serializer registered in
+L{pymodel.serializers.SERIALIZERS} against a set of representative model
+shapes, and writes the results as JSON so runs can be compared. Run it
+using::
+
+    python -m pymodel.benchmark --output results.json
+    python -m pymodel.benchmark --compare old.json --output new.json
+
+The multi-threaded stress benchmark (see L{pymodel.benchmark.stress}) runs
+instead when a number of threads is given::
+
+    python -m pymodel.benchmark --threads 8
+'''
+
+from pymodel.benchmark.runner import run_benchmarks, write_results, \
+        load_results, compare_results
+from pymodel.benchmark.stress import run_stress
+
+__all__ = ['run_benchmarks', 'write_results', 'load_results',
+           'compare_results', 'run_stress', ]
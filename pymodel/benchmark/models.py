@@ -0,0 +1,233 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Representative model shapes used by the benchmarks
+
+Every entry in L{SHAPES} maps a shape name to a function building one
+populated root object of that shape.
+'''
+
+import uuid
+import datetime
+
+import pymodel
+from pymodel.model import ModelMeta
+
+try:
+    from pymonkey.baseclasses import BaseEnumeration
+except ImportError:
+    BaseEnumeration = None
+
+
+if BaseEnumeration is not None:
+    class BenchmarkEnumeration(BaseEnumeration):
+        '''Enumeration used by the benchmark shapes'''
+
+else:
+    class BenchmarkEnumeration(object):
+        '''Minimal stand-in for a PyMonkey enumeration, usable by
+        Enumeration fields of the text serializers only'''
+        _items = dict()
+
+        @classmethod
+        def registerItem(cls, name):
+            item = cls()
+            item._pm_enumeration_name = name
+            cls._items[name] = item
+
+        @classmethod
+        def getByName(cls, name):
+            return cls._items[name]
+
+        def __nonzero__(self):
+            return True
+
+ENUMERATION_NAMES = ('NEW', 'RUNNING', 'HALTED', 'ERROR', 'DELETED', )
+for _name in ENUMERATION_NAMES:
+    BenchmarkEnumeration.registerItem(_name)
+del _name
+
+
+def _new_guid():
+    return str(uuid.uuid4())
+
+def _set_identity(object_):
+    object_.guid = _new_guid()
+    object_.version = _new_guid()
+    object_.creationdate = '2010-01-01 00:00:00'
+    return object_
+
+
+class FlatModel(pymodel.RootObjectModel):
+    name = pymodel.String(thrift_id=1)
+    size = pymodel.Integer(thrift_id=2)
+    ratio = pymodel.Float(thrift_id=3)
+    enabled = pymodel.Boolean(thrift_id=4)
+    owner = pymodel.GUID(thrift_id=5)
+
+def make_flat():
+    return _set_identity(FlatModel(name='flat model', size=42, ratio=0.75,
+                                   enabled=True, owner=_new_guid()))
+
+
+WIDE_FIELD_COUNT = 60
+
+def _wide_attrs():
+    attrs = {'__module__': __name__, }
+    for index in xrange(WIDE_FIELD_COUNT):
+        field_type = (pymodel.String, pymodel.Integer, pymodel.Float,
+                      pymodel.Boolean)[index % 4]
+        attrs['field%02d' % index] = field_type(thrift_id=index + 1)
+    return attrs
+
+WideModel = ModelMeta('WideModel', (pymodel.RootObjectModel, ), _wide_attrs())
+
+def make_wide():
+    object_ = WideModel()
+    values = ('value', 12345, 3.25, False)
+    for index in xrange(WIDE_FIELD_COUNT):
+        setattr(object_, 'field%02d' % index, values[index % 4])
+    return _set_identity(object_)
+
+
+DEEP_LEVELS = 8
+
+def _deep_types():
+    types = list()
+    child = None
+    for level in xrange(DEEP_LEVELS, 0, -1):
+        attrs = {
+            '__module__': __name__,
+            'name': pymodel.String(thrift_id=1),
+            'level': pymodel.Integer(thrift_id=2),
+        }
+        if child is not None:
+            attrs['child'] = pymodel.Object(child, thrift_id=3)
+        base = pymodel.RootObjectModel if level == 1 else pymodel.Model
+        child = ModelMeta('DeepLevel%d' % level, (base, ), attrs)
+        types.insert(0, child)
+    return types
+
+DEEP_TYPES = _deep_types()
+DeepModel = DEEP_TYPES[0]
+
+def make_deep():
+    objects = [type_(name='level %d' % index, level=index) for
+               (index, type_) in enumerate(DEEP_TYPES)]
+    for parent, child in zip(objects, objects[1:]):
+        parent.child = child
+    return _set_identity(objects[0])
+
+
+COLLECTION_SIZE = 1000
+
+class CollectionItem(pymodel.Model):
+    name = pymodel.String(thrift_id=1)
+    size = pymodel.Integer(thrift_id=2)
+
+class CollectionModel(pymodel.RootObjectModel):
+    name = pymodel.String(thrift_id=1)
+    items = pymodel.List(pymodel.Object(CollectionItem), thrift_id=2)
+    tags = pymodel.List(pymodel.String(), thrift_id=3)
+    properties = pymodel.Dict(pymodel.String(), thrift_id=4)
+
+def make_collection():
+    object_ = CollectionModel(name='collection model')
+    for index in xrange(COLLECTION_SIZE):
+        object_.items.append(CollectionItem(name='item %d' % index,
+                                            size=index))
+        object_.tags.append('tag%d' % index)
+        object_.properties['key%d' % index] = 'value %d' % index
+    return _set_identity(object_)
+
+
+class EventItem(pymodel.Model):
+    status = pymodel.Enumeration(BenchmarkEnumeration, thrift_id=1)
+    timestamp = pymodel.DateTime(thrift_id=2)
+
+class EventModel(pymodel.RootObjectModel):
+    status = pymodel.Enumeration(BenchmarkEnumeration, thrift_id=1)
+    started = pymodel.DateTime(thrift_id=2)
+    stopped = pymodel.DateTime(thrift_id=3)
+    events = pymodel.List(pymodel.Object(EventItem), thrift_id=4)
+
+EVENT_COUNT = 200
+
+def make_events():
+    start = datetime.datetime(2010, 1, 1, 12, 0, 0, 500)
+    object_ = EventModel(status=BenchmarkEnumeration.getByName('RUNNING'),
+                         started=start,
+                         stopped=start + datetime.timedelta(hours=1))
+    for index in xrange(EVENT_COUNT):
+        status = ENUMERATION_NAMES[index % len(ENUMERATION_NAMES)]
+        object_.events.append(EventItem(
+            status=BenchmarkEnumeration.getByName(status),
+            timestamp=start + datetime.timedelta(seconds=index)))
+    return _set_identity(object_)
+
+
+SHAPES = {
+    'flat': make_flat,
+    'wide': make_wide,
+    'deep': make_deep,
+    'collection': make_collection,
+    'events': make_events,
+}
+
+# Shapes holding Enumeration fields
+ENUMERATION_SHAPES = ('events', )
+
+def skip_reason(serializer, shape_name):
+    '''Get the reason why a serializer can't be benchmarked on a shape
+
+    The thrift serializers only encode PyMonkey enumerations, so shapes
+    holding Enumeration fields are skipped for them when PyMonkey is not
+    available.
+
+    @return: Reason, or None if the shape can be benchmarked
+    @rtype: string
+    '''
+    if BaseEnumeration is not None or shape_name not in ENUMERATION_SHAPES:
+        return None
+
+    try:
+        from pymodel.serializers._thrift import ThriftSerializer
+    except ImportError:
+        return None
+
+    serializer_class = getattr(serializer, 'load', lambda: serializer)()
+    if issubclass(serializer_class, ThriftSerializer):
+        return 'skipped, enumerations require PyMonkey'
+    return None
@@ -0,0 +1,362 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Benchmark runner
+
+For every (serializer, shape) combination the runner measures serialize
+and deserialize throughput, latency percentiles, payload size and the peak
+memory used by a single call. The peak memory is traced by C{tracemalloc}
+when available. Otherwise (e.g. on Python 2) the call is run in a forked
+process, and the growth of its maximum resident set size is reported, which
+is only accurate up to the page size and the reuse of freed memory.
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import optparse
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from pymodel.conversion import object_to_dict
+from pymodel.benchmark.models import SHAPES, skip_reason
+
+logger = logging.getLogger('pymodel.benchmark') #pylint: disable-msg=C0103
+
+DEFAULT_ITERATIONS = 200
+PERCENTILES = (50, 90, 99, )
+RESULTS_FORMAT_VERSION = 1
+
+
+def _percentile(sorted_timings, percentile):
+    index = int(round((len(sorted_timings) - 1) * percentile / 100.0))
+    return sorted_timings[index]
+
+def _max_rss():
+    '''Get the maximum resident set size of the process, in bytes'''
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, Mac OS X bytes
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return max_rss
+
+def _peak_rss(func, *args):
+    '''Get the growth of the maximum resident set size of a forked process
+    running func once'''
+    if resource is None or not hasattr(os, 'fork'):
+        return None
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # A forked process starts from its current resident set size
+        status = 1
+        try:
+            os.close(read_fd)
+            before = _max_rss()
+            func(*args)
+            os.write(write_fd, str(_max_rss() - before))
+            status = 0
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    try:
+        data = os.read(read_fd, 64)
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+    return int(data) if data else None
+
+def _peak_memory(func, *args):
+    '''Get the peak number of bytes used while running func once'''
+    if tracemalloc is None:
+        return _peak_rss(func, *args)
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.clear_traces()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+def measure(func, args, iterations):
+    '''Time a number of calls to func
+
+    @return: Statistics of the calls
+    @rtype: dict
+    '''
+    timer = timeit.default_timer
+    timings = list()
+
+    for _ in xrange(iterations):
+        start = timer()
+        func(*args)
+        timings.append(timer() - start)
+
+    total = sum(timings)
+    timings.sort()
+
+    stats = {
+        'iterations': iterations,
+        'total_seconds': total,
+        'ops_per_second': iterations / total if total else None,
+        'peak_memory_bytes': _peak_memory(func, *args),
+    }
+    for percentile in PERCENTILES:
+        stats['p%d_usec' % percentile] = \
+                _percentile(timings, percentile) * 1e6
+    stats['max_usec'] = timings[-1] * 1e6
+
+    return stats
+
+def benchmark(serializer, shape_name, iterations=DEFAULT_ITERATIONS):
+    '''Benchmark one serializer on one model shape
+
+    Failures (e.g. a serializer not supporting some field type) are recorded
+    in the result instead of being raised.
+
+    @return: Result record
+    @rtype: dict
+    '''
+    object_ = SHAPES[shape_name]()
+    type_ = type(object_)
+
+    result = {
+        'serializer': serializer.NAME,
+        'shape': shape_name,
+    }
+
+    reason = skip_reason(serializer, shape_name)
+    if reason is not None:
+        logger.info('%s: %s %s' % (serializer.NAME, shape_name, reason))
+        result['skipped'] = reason
+        return result
+
+    try:
+        data = serializer.serialize(object_)
+        copy = serializer.deserialize(type_, data)
+    except Exception, e: #pylint: disable-msg=W0703
+        logger.info('%s does not support %s: %s' % (serializer.NAME,
+                                                      shape_name, e))
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        return result
+
+    result['payload_bytes'] = len(data)
+    result['roundtrip_ok'] = object_to_dict(copy) == object_to_dict(object_)
+
+    result['serialize'] = measure(serializer.serialize, (object_, ),
+                                  iterations)
+    result['deserialize'] = measure(serializer.deserialize, (type_, data),
+                                    iterations)
+
+    for operation in ('serialize', 'deserialize', ):
+        stats = result[operation]
+        if stats['ops_per_second']:
+            stats['bytes_per_second'] = \
+                    stats['ops_per_second'] * len(data)
+
+    return result
+
+def run_benchmarks(serializers=None, shapes=None,
+                   iterations=DEFAULT_ITERATIONS):
+    '''Benchmark serializers on model shapes
+
+    @param serializers: Names of the serializers to benchmark, or None for
+                        every available serializer
+    @type serializers: iterable
+    @param shapes: Names of the shapes to benchmark, or None for all
+    @type shapes: iterable
+    @param iterations: Number of timed calls per operation
+    @type iterations: int
+
+    @return: Benchmark results, including information about the run
+    @rtype: dict
+    '''
+    from pymodel.serializers import SERIALIZERS
+
+    serializers = sorted(serializers or SERIALIZERS.available())
+    shapes = sorted(shapes or SHAPES.keys())
+
+    results = list()
+    for name in serializers:
+        for shape_name in shapes:
+            logger.info('Benchmarking %s on %s' % (name, shape_name))
+            result = benchmark(SERIALIZERS[name], shape_name, iterations)
+            result['serializer'] = name
+            results.append(result)
+
+    return {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'timestamp': time.time(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'iterations': iterations,
+        'results': results,
+    }
+
+def write_results(results, stream):
+    '''Write benchmark results as JSON to a file-like object'''
+    json.dump(results, stream, indent=2, sort_keys=True)
+    stream.write('\n')
+
+def load_results(stream):
+    '''Load benchmark results written by L{write_results}'''
+    return json.load(stream)
+
+def compare_results(old, new, operation_key='ops_per_second'):
+    '''Compare two benchmark runs
+
+    @return: List of (serializer, shape, operation, old, new, ratio) tuples,
+             ratio being new / old
+    @rtype: list
+    '''
+    def index(results):
+        return dict(((result['serializer'], result['shape']), result) for
+                    result in results['results'])
+
+    old_index = index(old)
+    comparison = list()
+
+    for key, result in sorted(index(new).iteritems()):
+        old_result = old_index.get(key)
+        if old_result is None:
+            continue
+
+        for operation in ('serialize', 'deserialize', ):
+            try:
+                old_value = old_result[operation][operation_key]
+                new_value = result[operation][operation_key]
+            except KeyError:
+                continue
+            ratio = new_value / old_value if old_value else None
+            comparison.append(key + (operation, old_value, new_value, ratio))
+
+    return comparison
+
+def _print_results(results, stream):
+    for result in results['results']:
+        if 'error' in result or 'skipped' in result:
+            stream.write('%-16s %-12s %s\n' % (result['serializer'],
+                                               result['shape'],
+                                               result.get('error') or
+                                               result['skipped']))
+            continue
+
+        stream.write('%-16s %-12s %8d bytes  ser %10.1f/s  des %10.1f/s\n' % (
+            result['serializer'], result['shape'], result['payload_bytes'],
+            result['serialize']['ops_per_second'] or 0,
+            result['deserialize']['ops_per_second'] or 0))
+
+def _print_comparison(comparison, stream):
+    for serializer, shape, operation, old, new, ratio in comparison:
+        stream.write('%-16s %-12s %-12s %10.1f -> %10.1f  (x%.2f)\n' % (
+            serializer, shape, operation, old, new, ratio or 0))
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage='%prog [options]',
+        description='Benchmark the registered pymodel serializers')
+    parser.add_option('-o', '--output', help='Write JSON results to OUTPUT')
+    parser.add_option('-c', '--compare',
+                      help='Compare the results with an earlier run')
+    parser.add_option('-n', '--iterations', type='int',
+                      default=DEFAULT_ITERATIONS,
+                      help='Timed calls per operation [default: %default]')
+    parser.add_option('-s', '--serializer', action='append',
+                      dest='serializers', help='Serializer to benchmark '
+                      '(can be given multiple times, default: all)')
+    parser.add_option('-m', '--shape', action='append', dest='shapes',
+                      help='Model shape to benchmark (can be given multiple '
+                      'times, default: all of %s)' % ', '.join(sorted(SHAPES)))
+
+    parser.add_option('-t', '--threads', type='int',
+                      help='Run the multi-threaded stress benchmark using '
+                      'THREADS threads instead')
+
+    options, _ = parser.parse_args(argv)
+
+    if options.threads:
+        from pymodel.benchmark.stress import run_stress, print_stress_results
+        results = run_stress(options.serializers, options.shapes,
+                             options.threads, options.iterations)
+        print_stress_results(results, sys.stdout)
+        if options.output:
+            stream = open(options.output, 'w')
+            try:
+                write_results(results, stream)
+            finally:
+                stream.close()
+        return 1 if any(result.get('failures') for result in
+                        results['results']) else 0
+
+    results = run_benchmarks(options.serializers, options.shapes,
+                             options.iterations)
+    _print_results(results, sys.stdout)
+
+    if options.output:
+        stream = open(options.output, 'w')
+        try:
+            write_results(results, stream)
+        finally:
+            stream.close()
+
+    if options.compare:
+        stream = open(options.compare)
+        try:
+            old = load_results(stream)
+        finally:
+            stream.close()
+        _print_comparison(compare_results(old, results), sys.stdout)
+
+    return 0
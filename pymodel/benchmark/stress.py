@@ -0,0 +1,197 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Multi-threaded serializer stress benchmark
+
+For every (serializer, shape) combination, the per-type caches are dropped
+and a number of threads start serializing and deserializing the same
+object at the same moment, so the caches are compiled concurrently. Every
+encoding is checked against the one produced by a single thread, and the
+aggregate throughput is compared with the single-threaded one.
+'''
+
+import sys
+import time
+import logging
+import platform
+import threading
+import timeit
+
+from pymodel.utils import invalidate_type_caches
+from pymodel.serializers import _reachable_types
+from pymodel.benchmark.models import SHAPES, skip_reason
+
+logger = logging.getLogger('pymodel.benchmark') #pylint: disable-msg=C0103
+
+DEFAULT_THREADS = 8
+DEFAULT_ITERATIONS = 100
+
+
+def _roundtrips(serializer, object_, type_, reference, iterations, failures):
+    for _ in xrange(iterations):
+        data = serializer.serialize(object_)
+        if data != reference:
+            failures.append('Encoding differs from the single-threaded one')
+            return
+        serializer.deserialize(type_, data)
+
+def stress(serializer, shape_name, threads=DEFAULT_THREADS,
+           iterations=DEFAULT_ITERATIONS):
+    '''Stress one serializer on one model shape
+
+    @param threads: Number of concurrent threads
+    @type threads: int
+    @param iterations: Number of round trips per thread
+    @type iterations: int
+
+    @return: Result record
+    @rtype: dict
+    '''
+    object_ = SHAPES[shape_name]()
+    type_ = type(object_)
+
+    result = {
+        'serializer': serializer.NAME,
+        'shape': shape_name,
+        'threads': threads,
+        'iterations': iterations,
+    }
+
+    reason = skip_reason(serializer, shape_name)
+    if reason is not None:
+        logger.info('%s: %s %s' % (serializer.NAME, shape_name, reason))
+        result['skipped'] = reason
+        return result
+
+    try:
+        reference = serializer.serialize(object_)
+        serializer.deserialize(type_, reference)
+    except Exception, e: #pylint: disable-msg=W0703
+        logger.info('%s does not support %s: %s' % (serializer.NAME,
+                                                      shape_name, e))
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        return result
+
+    timer = timeit.default_timer
+    failures = list()
+
+    start = timer()
+    _roundtrips(serializer, object_, type_, reference, iterations, failures)
+    single = timer() - start
+
+    # Make the threads compile the per-type information concurrently
+    invalidate_type_caches(_reachable_types([type_]))
+
+    go = threading.Event()
+    def worker():
+        go.wait()
+        try:
+            _roundtrips(serializer, object_, type_, reference, iterations,
+                        failures)
+        except Exception, e: #pylint: disable-msg=W0703
+            failures.append('%s: %s' % (type(e).__name__, e))
+
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    for thread in workers:
+        thread.start()
+    start = timer()
+    go.set()
+    for thread in workers:
+        thread.join()
+    elapsed = timer() - start
+
+    result['failures'] = len(failures)
+    if failures:
+        result['first_failure'] = failures[0]
+    result['single_thread_ops_per_second'] = \
+            iterations / single if single else None
+    result['ops_per_second'] = \
+            threads * iterations / elapsed if elapsed else None
+    if result['single_thread_ops_per_second'] and result['ops_per_second']:
+        result['scaling'] = result['ops_per_second'] / \
+                result['single_thread_ops_per_second']
+    else:
+        result['scaling'] = None
+
+    return result
+
+def run_stress(serializers=None, shapes=None, threads=DEFAULT_THREADS,
+               iterations=DEFAULT_ITERATIONS):
+    '''Stress serializers on model shapes, see L{stress}
+
+    @return: Stress results, including information about the run
+    @rtype: dict
+    '''
+    from pymodel.serializers import SERIALIZERS
+
+    serializers = sorted(serializers or SERIALIZERS.available())
+    shapes = sorted(shapes or SHAPES.keys())
+
+    results = list()
+    for name in serializers:
+        for shape_name in shapes:
+            logger.info('Stressing %s on %s with %d threads' % (
+                name, shape_name, threads))
+            result = stress(SERIALIZERS[name], shape_name, threads,
+                            iterations)
+            result['serializer'] = name
+            results.append(result)
+
+    return {
+        'timestamp': time.time(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'threads': threads,
+        'iterations': iterations,
+        'results': results,
+    }
+
+def print_stress_results(results, stream):
+    for result in results['results']:
+        if 'error' in result or 'skipped' in result:
+            stream.write('%-16s %-12s %s\n' % (result['serializer'],
+                                               result['shape'],
+                                               result.get('error') or
+                                               result['skipped']))
+            continue
+
+        stream.write('%-16s %-12s %10.1f/s  single %10.1f/s  x%.2f  '
+                     '%d failures\n' % (
+            result['serializer'], result['shape'],
+            result['ops_per_second'] or 0,
+            result['single_thread_ops_per_second'] or 0,
+            result['scaling'] or 0, result['failures']))
+        if result['failures']:
+            stream.write('    %s\n' % result['first_failure'])
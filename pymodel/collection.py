@@ -0,0 +1,521 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Indexed in-memory collections of model instances
+
+A L{ModelCollection} holds instances of one model type and maintains hash
+and sorted indexes on fields, given as attribute paths which can go through
+Object fields, e.g. C{'name'} or C{'owner.address.city'}::
+
+    machines = ModelCollection(Machine, hash_indexes=('status', ),
+                               sorted_indexes=('memory', 'owner.name', ))
+    machines.extend(loaded)
+
+    running = machines.eq('status', MachineStatus.RUNNING)
+    large = machines.range('memory', low=4096)
+    biggest = machines.top('memory', 10)
+
+Enumeration fields are indexed by the enumeration name, queries accept both
+enumeration values and names. Index keys are read straight from the
+instance stores by key functions compiled per path.
+
+Instances in the collection are observed (see L{pymodel.store}), so fields
+set through the field descriptors, including those of nested objects, are
+reflected in the indexes. Queries on paths without an index scan the
+collection.
+
+Collections are not thread-safe.
+'''
+
+import heapq
+import bisect
+import logging
+
+import pymodel
+from pymodel.model import Model
+from pymodel.conversion import select_attributes
+from pymodel.store import observe, unobserve
+
+logger = logging.getLogger('pymodel.collection')
+
+# Field types which can't be used as index key
+UNINDEXABLE_FIELD_TYPES = (pymodel.Object, pymodel.List, pymodel.Dict, )
+
+
+def _normalize(value):
+    '''Get the index key of a query value'''
+    name = getattr(value, '_pm_enumeration_name', None)
+    if name is not None:
+        return name
+    if value == '':
+        return None
+    return value
+
+def compile_path(type_, path):
+    '''Compile a key function reading the value of an attribute path
+
+    @param type_: Model type
+    @type type_: type
+    @param path: Dotted attribute path, all but the last attribute should be
+                 Object fields
+    @type path: string
+
+    @return: Tuple of the key function, and the tuple of attribute names
+    @rtype: tuple
+
+    @raise ValueError: The path can't be used as index key
+    '''
+    names = tuple(path.split('.'))
+    current = type_
+    for position, name in enumerate(names):
+        attr = select_attributes(current, (name, ))[0].attribute
+        last = position == len(names) - 1
+        if last and isinstance(attr, UNINDEXABLE_FIELD_TYPES):
+            raise ValueError('Attribute %s can\'t be indexed' % path)
+        if not last:
+            if not isinstance(attr, pymodel.Object):
+                raise ValueError('Attribute %s of %s is no Object field' % (
+                    name, path))
+            current = attr.type_
+
+    if len(names) == 1:
+        name = names[0]
+        def key(object_):
+            value = object_._pymodel_store.get(name)
+            return None if value == '' else value
+        return key, names
+
+    def key(object_):
+        for name in names:
+            if not isinstance(object_, Model):
+                return None
+            object_ = object_._pymodel_store.get(name)
+        return None if object_ == '' else object_
+    return key, names
+
+
+class _Above(object):
+    '''Bound sorting after every instance id'''
+    def __cmp__(self, other):
+        return 0 if other is self else 1
+
+_ABOVE = _Above()
+
+
+class HashIndex(object):
+    '''Index of instance ids by key, for equality and membership queries'''
+    sorted = False
+
+    def __init__(self):
+        self._ids = dict()
+
+    def add(self, key, id_):
+        try:
+            self._ids[key].add(id_)
+        except KeyError:
+            self._ids[key] = set((id_, ))
+
+    def add_many(self, entries):
+        '''Add a list of (key, id) tuples'''
+        for key, id_ in entries:
+            HashIndex.add(self, key, id_)
+
+    def remove(self, key, id_):
+        ids = self._ids[key]
+        ids.discard(id_)
+        if not ids:
+            del self._ids[key]
+
+    def eq(self, key):
+        return self._ids.get(key, ())
+
+
+class SortedIndex(HashIndex):
+    '''Index of instance ids ordered by key, for range and top-k queries
+
+    Instances with a None key are only found by equality queries. The
+    (key, id) tuples are kept in a single sorted list, ids ordering instances
+    with equal keys, so every entry is found by bisection.
+    '''
+    sorted = True
+
+    def __init__(self):
+        HashIndex.__init__(self)
+        self._entries = list()
+
+    def add(self, key, id_):
+        HashIndex.add(self, key, id_)
+        if key is None:
+            return
+        bisect.insort(self._entries, (key, id_))
+
+    def add_many(self, entries):
+        HashIndex.add_many(self, entries)
+        self._entries.extend(entry for entry in entries if
+                             entry[0] is not None)
+        self._entries.sort()
+
+    def remove(self, key, id_):
+        HashIndex.remove(self, key, id_)
+        if key is None:
+            return
+        position = bisect.bisect_left(self._entries, (key, id_))
+        del self._entries[position]
+
+    def range(self, low, high, include_low, include_high):
+        entries = self._entries
+
+        if low is None:
+            start = 0
+        elif include_low:
+            start = bisect.bisect_left(entries, (low, ))
+        else:
+            start = bisect.bisect_left(entries, (low, _ABOVE))
+
+        if high is None:
+            end = len(entries)
+        elif include_high:
+            end = bisect.bisect_left(entries, (high, _ABOVE))
+        else:
+            end = bisect.bisect_left(entries, (high, ))
+
+        return [id_ for (key, id_) in entries[start:end]]
+
+    def top(self, count, largest):
+        if not count:
+            return []
+        if largest:
+            ids = [id_ for (key, id_) in self._entries[-count:]]
+            ids.reverse()
+            return ids
+        return [id_ for (key, id_) in self._entries[:count]]
+
+
+class ModelCollection(object):
+    '''Collection of model instances with secondary indexes'''
+
+    def __init__(self, type_, objects=None, hash_indexes=(),
+                 sorted_indexes=()):
+        '''Initialize a new collection
+
+        @param type_: Type of the instances in the collection
+        @type type_: type
+        @param objects: Instances to add
+        @type objects: iterable
+        @param hash_indexes: Attribute paths to create hash indexes for
+        @type hash_indexes: iterable
+        @param sorted_indexes: Attribute paths to create sorted indexes for
+        @type sorted_indexes: iterable
+        '''
+        self.type_ = type_
+
+        self._objects = dict()
+        # Index keys and observers by instance id
+        self._keys = dict()
+        self._observers = dict()
+
+        self._indexes = dict()
+        self._key_functions = dict()
+        # Field names to watch by path prefix
+        self._watched = dict()
+
+        for path in hash_indexes:
+            self.add_index(path)
+        for path in sorted_indexes:
+            self.add_index(path, sorted=True)
+
+        if objects is not None:
+            self.extend(objects)
+
+    def add_index(self, path, sorted=False):
+        '''Create an index on an attribute path
+
+        Replaces the existing index on the path, if any.
+
+        @param sorted: Create a sorted index, supporting range and top-k
+                       queries, instead of a hash index
+        @type sorted: bool
+        '''
+        key, names = compile_path(self.type_, path)
+        index = SortedIndex() if sorted else HashIndex()
+        logger.debug('Creating %s index on %s.%s' % (
+            'sorted' if sorted else 'hash', self.type_.__name__, path))
+
+        if path in self._indexes:
+            self.drop_index(path)
+
+        for position, name in enumerate(names):
+            self._watched.setdefault(names[:position], set()).add(name)
+
+        self._indexes[path] = index
+        self._key_functions[path] = key
+
+        entries = list()
+        for id_, object_ in self._objects.iteritems():
+            value = self._keys[id_][path] = key(object_)
+            entries.append((value, id_))
+        index.add_many(entries)
+
+        for id_ in self._objects:
+            self._watch(id_)
+
+    def drop_index(self, path):
+        '''Remove the index on an attribute path'''
+        del self._indexes[path]
+        del self._key_functions[path]
+        for keys in self._keys.itervalues():
+            keys.pop(path, None)
+
+        self._watched = dict()
+        for other in self._indexes:
+            names = tuple(other.split('.'))
+            for position, name in enumerate(names):
+                self._watched.setdefault(names[:position], set()).add(name)
+
+        for id_ in self._objects:
+            self._watch(id_)
+
+    def indexes(self):
+        '''Get the indexed paths, as a dict of path to sortedness'''
+        return dict((path, index.sorted) for (path, index) in
+                    self._indexes.iteritems())
+
+    def add(self, object_):
+        '''Add an instance to the collection'''
+        if not isinstance(object_, self.type_):
+            raise TypeError('Only objects of type %s can be stored' %
+                            self.type_.__name__)
+
+        id_ = id(object_)
+        if id_ in self._objects:
+            return
+
+        self._objects[id_] = object_
+        keys = self._keys[id_] = dict()
+        for path, key in self._key_functions.iteritems():
+            value = keys[path] = key(object_)
+            self._indexes[path].add(value, id_)
+        self._watch(id_)
+
+    def extend(self, objects):
+        '''Add several instances to the collection
+
+        The indexes are updated once for all instances.
+        '''
+        objects = list(objects)
+        for object_ in objects:
+            if not isinstance(object_, self.type_):
+                raise TypeError('Only objects of type %s can be stored' %
+                                self.type_.__name__)
+
+        added = list()
+        for object_ in objects:
+            id_ = id(object_)
+            if id_ in self._objects:
+                continue
+            self._objects[id_] = object_
+            self._keys[id_] = dict()
+            added.append(id_)
+
+        for path, key in self._key_functions.iteritems():
+            entries = list()
+            for id_ in added:
+                value = self._keys[id_][path] = key(self._objects[id_])
+                entries.append((value, id_))
+            self._indexes[path].add_many(entries)
+
+        for id_ in added:
+            self._watch(id_)
+
+    def remove(self, object_):
+        '''Remove an instance from the collection
+
+        @raise KeyError: The instance is not in the collection
+        '''
+        id_ = id(object_)
+        if id_ not in self._objects:
+            raise KeyError(object_)
+
+        self._unwatch(id_)
+        for path, value in self._keys.pop(id_).iteritems():
+            self._indexes[path].remove(value, id_)
+        del self._objects[id_]
+
+    def discard(self, object_):
+        '''Remove an instance from the collection, if present'''
+        if id(object_) in self._objects:
+            self.remove(object_)
+
+    def _watch(self, id_):
+        '''(Re)register observers on the instance and the nested instances
+        holding indexed fields'''
+        self._unwatch(id_)
+        observers = self._observers[id_] = list()
+
+        def watch(object_, prefix):
+            names = self._watched.get(prefix)
+            if not names:
+                return
+
+            def observer(name):
+                if name in names:
+                    self._reindex(id_)
+
+            if observe(object_, observer):
+                observers.append((object_, observer))
+
+            store = object_._pymodel_store
+            for name in names:
+                value = store.get(name)
+                if isinstance(value, Model):
+                    watch(value, prefix + (name, ))
+
+        watch(self._objects[id_], ())
+
+    def _unwatch(self, id_):
+        for object_, observer in self._observers.pop(id_, ()):
+            unobserve(object_, observer)
+
+    def _reindex(self, id_):
+        object_ = self._objects[id_]
+        keys = self._keys[id_]
+        for path, key in self._key_functions.iteritems():
+            value = key(object_)
+            old = keys[path]
+            if value == old and type(value) is type(old):
+                continue
+            index = self._indexes[path]
+            index.remove(old, id_)
+            index.add(value, id_)
+            keys[path] = value
+        # Nested instances might have been replaced
+        self._watch(id_)
+
+    def _scan(self, path, predicate):
+        key = self._key_functions.get(path)
+        if key is None:
+            key = compile_path(self.type_, path)[0]
+        return [object_ for object_ in self._objects.itervalues() if
+                predicate(key(object_))]
+
+    def _resolve(self, ids):
+        objects = self._objects
+        return [objects[id_] for id_ in ids]
+
+    def eq(self, path, value):
+        '''Get the instances of which the attribute at path equals value'''
+        value = _normalize(value)
+        index = self._indexes.get(path)
+        if index is None:
+            return self._scan(path, lambda key: key == value)
+        return self._resolve(index.eq(value))
+
+    def isin(self, path, values):
+        '''Get the instances of which the attribute at path is one of
+        values'''
+        values = set(_normalize(value) for value in values)
+        index = self._indexes.get(path)
+        if index is None:
+            return self._scan(path, lambda key: key in values)
+
+        result = list()
+        for value in values:
+            result.extend(self._resolve(index.eq(value)))
+        return result
+
+    def range(self, path, low=None, high=None, include_low=True,
+              include_high=True):
+        '''Get the instances of which the attribute at path is between low
+        and high, ordered by that attribute when a sorted index is used
+
+        Instances of which the attribute is not set are never returned.
+
+        @param low: Lower bound, unbounded if None
+        @param high: Upper bound, unbounded if None
+        @param include_low: Whether low itself is in range
+        @type include_low: bool
+        @param include_high: Whether high itself is in range
+        @type include_high: bool
+        '''
+        low = _normalize(low)
+        high = _normalize(high)
+        index = self._indexes.get(path)
+        if index is not None and index.sorted:
+            return self._resolve(index.range(low, high, include_low,
+                                             include_high))
+
+        def predicate(key):
+            if key is None:
+                return False
+            if low is not None and (key < low or
+                                    (key == low and not include_low)):
+                return False
+            if high is not None and (key > high or
+                                     (key == high and not include_high)):
+                return False
+            return True
+        return self._scan(path, predicate)
+
+    def top(self, path, count, largest=True):
+        '''Get the count instances with the largest (or smallest) value of
+        the attribute at path
+
+        Instances of which the attribute is not set are never returned.
+        '''
+        index = self._indexes.get(path)
+        if index is not None and index.sorted:
+            return self._resolve(index.top(count, largest))
+
+        key = self._key_functions.get(path)
+        if key is None:
+            key = compile_path(self.type_, path)[0]
+        objects = (object_ for object_ in self._objects.itervalues() if
+                   key(object_) is not None)
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return select(count, objects, key=key)
+
+    def filter(self, predicate):
+        '''Get the instances for which predicate returns True'''
+        return [object_ for object_ in self._objects.itervalues() if
+                predicate(object_)]
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return self._objects.itervalues()
+
+    def __contains__(self, object_):
+        return id(object_) in self._objects
@@ -0,0 +1,201 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Columnar export and import of model instances
+
+L{to_columns} converts instances of a model type to one column per field,
+as a NumPy structured array when NumPy is installed, or as a dict of
+C{array.array} (numeric fields) and list (other fields) columns otherwise.
+L{from_columns} creates instances from such columns::
+
+    table = pymodel.columnar.to_columns(Machine, machines)
+    print table['memory'].sum()
+
+Only scalar fields (String, GUID, Integer, Float, Boolean, Enumeration and
+DateTime) can be exported, Object, List and Dict fields are skipped unless
+requested explicitly, which raises ValueError. Enumeration fields are
+exported by name.
+
+Numeric columns can't hold None, unset Integer, Boolean and Float fields are
+exported as 0, False and NaN. Unset DateTime fields are exported as NaT in
+NumPy arrays.
+'''
+
+import array
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import pymodel
+from pymodel.conversion import select_attributes
+
+logger = logging.getLogger('pymodel.columnar')
+
+# Column types by field type: (NumPy dtype, array.array typecode, fill value)
+# A typecode of None means a list column is used
+COLUMN_TYPES = {
+    pymodel.Integer: ('i8', 'l', 0),
+    pymodel.Float: ('f8', 'd', float('nan')),
+    pymodel.Boolean: ('?', 'b', False),
+    pymodel.DateTime: ('M8[us]', None, None),
+    pymodel.String: ('O', None, None),
+    pymodel.GUID: ('O', None, None),
+    pymodel.Enumeration: ('O', None, None),
+}
+
+# Conversion of column values to stored values, by field type
+FROM_COLUMN_CONVERTERS = {
+    pymodel.Integer: int,
+    pymodel.Boolean: bool,
+}
+
+
+def _select_columns(type_, fields):
+    '''Get (name, column type, field type) tuples for the exported fields'''
+    columns = list()
+    for attribute in select_attributes(type_, fields):
+        field_type = type(attribute.attribute)
+        try:
+            column_type = COLUMN_TYPES[field_type]
+        except KeyError:
+            if fields is not None:
+                raise ValueError('Field %s can\'t be exported to a column' %
+                                 attribute.name)
+            continue
+        columns.append((attribute.name, column_type, field_type))
+    return columns
+
+def _use_numpy(use_numpy):
+    if use_numpy is None:
+        return numpy is not None
+    if use_numpy and numpy is None:
+        raise RuntimeError('NumPy is not available on this system')
+    return use_numpy
+
+def dtype(type_, fields=None):
+    '''Get the NumPy structured dtype of the columns of a model type'''
+    if numpy is None:
+        raise RuntimeError('NumPy is not available on this system')
+    return numpy.dtype([(name, column_type[0]) for (name, column_type, _) in
+                        _select_columns(type_, fields)])
+
+def to_columns(type_, objects, fields=None, use_numpy=None):
+    '''Convert model instances to columns
+
+    @param type_: Model type of the instances
+    @type type_: type
+    @param objects: Model instances
+    @type objects: iterable
+    @param fields: Names of the fields to export, defaults to all scalar
+                   fields
+    @type fields: iterable
+    @param use_numpy: Return a NumPy structured array, defaults to True when
+                      NumPy is installed
+    @type use_numpy: bool
+
+    @return: Structured array, or dict of columns by field name
+    '''
+    columns = _select_columns(type_, fields)
+    plan = tuple((name, column_type[2]) for (name, column_type, _) in
+                 columns)
+
+    rows = list()
+    for object_ in objects:
+        store = object_._pymodel_store
+        row = list()
+        for name, fill in plan:
+            value = store.get(name)
+            row.append(fill if value is None else value)
+        rows.append(tuple(row))
+
+    if _use_numpy(use_numpy):
+        return numpy.array(rows, dtype=numpy.dtype([
+            (name, column_type[0]) for (name, column_type, _) in columns]))
+
+    values = zip(*rows) if rows else [()] * len(columns)
+    result = dict()
+    for (name, column_type, _), column in zip(columns, values):
+        typecode = column_type[1]
+        if typecode is None:
+            result[name] = list(column)
+        else:
+            result[name] = array.array(typecode, column)
+    return result
+
+def from_columns(type_, columns, fields=None):
+    '''Create model instances from columns
+
+    @param type_: Model type of the instances
+    @type type_: type
+    @param columns: Structured array, or dict of columns by field name, as
+                    returned by L{to_columns}
+    @param fields: Names of the fields to import, defaults to all scalar
+                   fields found in columns
+    @type fields: iterable
+
+    @return: New model instances
+    @rtype: list
+    '''
+    if numpy is not None and isinstance(columns, numpy.ndarray):
+        names = columns.dtype.names
+        get_column = lambda name: columns[name].tolist()
+    else:
+        names = columns.keys()
+        get_column = lambda name: columns[name]
+
+    if fields is None:
+        fields = [name for (name, _, _) in _select_columns(type_, None) if
+                  name in names]
+
+    plan = list()
+    values = list()
+    for name, column_type, field_type in _select_columns(type_, fields):
+        plan.append((name, FROM_COLUMN_CONVERTERS.get(field_type)))
+        values.append(get_column(name))
+
+    objects = list()
+    for row in zip(*values):
+        object_ = type_()
+        store = object_._pymodel_store
+        for (name, converter), value in zip(plan, row):
+            if value is None or value != value:
+                continue
+            store[name] = converter(value) if converter else value
+        objects.append(object_)
+
+    return objects
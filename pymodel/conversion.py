@@ -0,0 +1,319 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Conversion of model instances to and from plain dictionaries
+
+The text serializers (YAML, XML, ...) all work on a plain dictionary
+representation of a model instance. The converters in this module are
+compiled once per model type (and optional field selection) and cached, so
+converting an instance only runs the steps its fields actually need.
+'''
+
+import logging
+import datetime
+
+import pymodel
+from pymodel.fields import EmptyObject
+from pymodel.utils import register_cache_invalidator, get_cached
+from pymodel.pool import new_instance
+from pymodel.interning import intern_string, intern_keys, intern_field
+
+logger = logging.getLogger('pymodel.conversion') #pylint: disable-msg=C0103
+
+TO_DICT_CACHE = dict()
+FROM_DICT_CACHE = dict()
+
+@register_cache_invalidator
+def _invalidate_caches(types):
+    for cache in (TO_DICT_CACHE, FROM_DICT_CACHE, ):
+        for key in cache.keys():
+            if key[0] in types:
+                cache.pop(key, None)
+
+
+def _item_to_data(attr):
+    '''Get the conversion function for an item stored in a container field
+
+    @return: Conversion function, or None if items can be used as-is
+    @rtype: callable
+    '''
+    return ITEM_TO_DATA_COMPILERS[type(attr)](attr)
+
+def _list_item_to_data(attr):
+    handler = _item_to_data(attr.type_)
+    if handler is None:
+        return lambda value: list(value._list)
+    return lambda value: [handler(item) for item in value._list]
+
+def _dict_item_to_data(attr):
+    handler = _item_to_data(attr.type_)
+    if handler is None:
+        return lambda value: dict(value._dict)
+    return lambda value: dict((key, handler(item)) for (key, item) in
+                              value._dict.iteritems())
+
+ITEM_TO_DATA_COMPILERS = {
+    pymodel.String: lambda a: None,
+    pymodel.Enumeration: lambda a: None,
+    pymodel.GUID: lambda a: None,
+    pymodel.Integer: lambda a: None,
+    pymodel.Float: lambda a: None,
+    pymodel.Boolean: lambda a: None,
+    pymodel.List: _list_item_to_data,
+    pymodel.Dict: _dict_item_to_data,
+    pymodel.Object: lambda a: object_to_dict,
+    pymodel.DateTime: lambda a: None,
+}
+
+# Every compiler returns a (handler, default) tuple. The handler converts the
+# value found in the model store (None if it can be used as-is), the default
+# is used when the store holds no value for the field.
+TO_DICT_COMPILERS = {
+    pymodel.String: lambda a: (None, None),
+    pymodel.Enumeration: lambda a: (lambda o: o or None, None),
+    pymodel.GUID: lambda a: (None, None),
+    pymodel.Integer: lambda a: (None, None),
+    pymodel.Float: lambda a: (None, None),
+    pymodel.Boolean: lambda a: (None, None),
+    pymodel.List: lambda a: (_list_item_to_data(a), a.listtype()),
+    pymodel.Dict: lambda a: (_dict_item_to_data(a), a.dicttype()),
+    pymodel.Object: lambda a: (object_to_dict, None),
+    pymodel.DateTime: lambda a: (None, None),
+}
+
+
+def _item_from_data(attr):
+    '''Get the loader function for an item stored in a container field
+
+    @return: Loader function, or None if items can be used as-is
+    @rtype: callable
+    '''
+    return ITEM_FROM_DATA_COMPILERS[type(attr)](attr)
+
+def _list_from_data(attr):
+    handler = _item_from_data(attr.type_)
+    if handler is None:
+        return None
+    return lambda data: [handler(item) for item in data]
+
+def _dict_from_data(attr):
+    handler = _item_from_data(attr.type_)
+    if handler is None:
+        return intern_keys
+    return lambda data: dict((intern_string(key), handler(value)) for
+                             (key, value) in data.iteritems())
+
+def _string_from_data(attr):
+    if intern_field(attr):
+        return intern_string
+    return None
+
+def _object_from_data(attr):
+    type_ = attr.type_
+    return lambda data: dict_to_object(new_instance(type_), data)
+
+def datetime_from_data(data):
+    '''Load a DateTime value, parsing it if it was stored as an ISO string'''
+    if not isinstance(data, basestring):
+        return data
+
+    format_ = '%Y-%m-%dT%H:%M:%S.%f' if '.' in data else '%Y-%m-%dT%H:%M:%S'
+    return datetime.datetime.strptime(data.replace(' ', 'T'), format_)
+
+ITEM_FROM_DATA_COMPILERS = {
+    pymodel.String: _string_from_data,
+    pymodel.Enumeration: lambda a: intern_string,
+    pymodel.GUID: lambda a: None,
+    pymodel.Integer: lambda a: None,
+    pymodel.Float: lambda a: None,
+    pymodel.Boolean: lambda a: None,
+    pymodel.List: _list_from_data,
+    pymodel.Dict: _dict_from_data,
+    pymodel.Object: _object_from_data,
+    pymodel.DateTime: lambda a: datetime_from_data,
+}
+
+FROM_DICT_COMPILERS = ITEM_FROM_DATA_COMPILERS
+
+
+def select_attributes(type_, fields):
+    '''Get the model attributes of a type, optionally limited to a subset
+
+    @param type_: Model type
+    @type type_: type
+    @param fields: Names of the fields to select, or None to select all
+    @type fields: iterable
+
+    @return: Selected attributes, in model order
+    @rtype: tuple
+    '''
+    attributes = type_.PYMODEL_MODEL_INFO.attributes
+    if fields is None:
+        return attributes
+
+    names = set(attribute.name for attribute in attributes)
+    for name in fields:
+        if name not in names:
+            raise ValueError('Unknown attribute %s' % name)
+
+    return tuple(attribute for attribute in attributes if
+                 attribute.name in fields)
+
+def _compile_to_dict(type_, fields):
+    logger.info('Compiling dict converter for %s' % type_.__name__)
+
+    steps = list()
+    for attribute in select_attributes(type_, fields):
+        attr = attribute.attribute
+        handler, default = TO_DICT_COMPILERS[type(attr)](attr)
+        steps.append((attribute.name, handler, default))
+    steps = tuple(steps)
+
+    def convert(object_):
+        store = object_._pymodel_store
+        data = dict()
+
+        for name, handler, default in steps:
+            value = store.get(name, default)
+            if value is None:
+                continue
+
+            if handler is not None:
+                value = handler(value)
+                if value is None:
+                    continue
+
+            data[name] = value
+
+        return data
+
+    return convert
+
+def _compile_from_dict(type_, fields):
+    logger.info('Compiling dict loader for %s' % type_.__name__)
+
+    steps = list()
+    for attribute in select_attributes(type_, fields):
+        attr = attribute.attribute
+        loader = FROM_DICT_COMPILERS[type(attr)](attr)
+        steps.append((attribute.name, attr.__set__, loader))
+    steps = tuple(steps)
+
+    def load(object_, data):
+        get = data.get
+
+        for name, setter, loader in steps:
+            value = get(name)
+            if value is None:
+                continue
+
+            if loader is not None:
+                value = loader(value)
+                if value is None:
+                    continue
+
+            setter(object_, value)
+
+        return object_
+
+    return load
+
+def _cache_key(type_, fields):
+    if fields is None:
+        return type_, None
+    return type_, frozenset(fields)
+
+def get_dict_converter(type_, fields=None):
+    '''Get the compiled model-to-dictionary converter for a model type
+
+    @param type_: Model type
+    @type type_: type
+    @param fields: Names of the fields to include, or None to include all
+    @type fields: iterable
+
+    @return: Function converting an instance of type_ into a dictionary
+    @rtype: callable
+    '''
+    key = _cache_key(type_, fields)
+    return get_cached(TO_DICT_CACHE, key, _compile_to_dict, type_, key[1])
+
+def get_dict_loader(type_, fields=None):
+    '''Get the compiled dictionary-to-model loader for a model type
+
+    @param type_: Model type
+    @type type_: type
+    @param fields: Names of the fields to load, or None to load all
+    @type fields: iterable
+
+    @return: Function filling an instance of type_ using a dictionary
+    @rtype: callable
+    '''
+    key = _cache_key(type_, fields)
+    return get_cached(FROM_DICT_CACHE, key, _compile_from_dict, type_,
+                      key[1])
+
+def object_to_dict(object_, fields=None):
+    '''Convert a model instance into a plain dictionary
+
+    Fields without a value are left out. List and Dict fields are always
+    included, even when empty.
+
+    @param object_: Instance to convert
+    @type object_: L{pymodel.model.Model}
+    @param fields: Names of the fields to include, or None to include all
+    @type fields: iterable
+
+    @return: Dictionary representation of object_
+    @rtype: dict
+    '''
+    if isinstance(object_, EmptyObject):
+        return None
+
+    return get_dict_converter(type(object_), fields)(object_)
+
+def dict_to_object(object_, data, fields=None):
+    '''Set the fields of a model instance using a plain dictionary
+
+    @param object_: Instance to fill
+    @type object_: L{pymodel.model.Model}
+    @param data: Dictionary representation, as returned by L{object_to_dict}
+    @type data: dict
+    @param fields: Names of the fields to load, or None to load all
+    @type fields: iterable
+
+    @return: object_
+    @rtype: L{pymodel.model.Model}
+    '''
+    return get_dict_loader(type(object_), fields)(object_, data)
@@ -0,0 +1,450 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Structural diff and three-way merge of model instances
+
+L{diff} walks two instances of a model type field by field and returns the
+list of L{Change}s turning the first one into the second one. Children of
+List fields holding Object fields are matched by guid, so adding, removing
+or modifying a child results in changes of that child only. Changes are
+plain tuples, values are converted the same way as by
+L{pymodel.conversion.object_to_dict}, so change sets can be serialized
+using any text format.
+
+L{apply} performs a change set on an instance, L{merge} computes the
+changes of a locally modified instance which can be applied on top of a
+concurrently stored one, and reports conflicting changes::
+
+    changes, conflicts = pymodel.diff.merge(base, mine, theirs)
+    if not conflicts:
+        pymodel.diff.apply(theirs, changes)
+        theirs._baseversion = theirs.version
+
+Paths are tuples of field names, dict keys and, for children of List
+fields holding objects, child guids.
+
+Child instances which are the same object in both instances are never
+walked. When trust_versions is set, children with equal guid and version
+aren't walked either, which makes the cost of a diff proportional to the
+number of changed children, not to the size of the instances.
+'''
+
+import logging
+from collections import namedtuple
+
+import pymodel
+from pymodel.model import Model
+from pymodel.fields import EmptyObject, WrappedList, WrappedDict
+from pymodel.conversion import ITEM_TO_DATA_COMPILERS, \
+        ITEM_FROM_DATA_COMPILERS
+from pymodel.utils import get_cached
+
+logger = logging.getLogger('pymodel.diff')
+
+# Change operations
+SET = 'set'
+DELETE = 'delete'
+INSERT = 'insert'
+REMOVE = 'remove'
+ORDER = 'order'
+
+class Change(namedtuple('Change', 'op path value')):
+    '''A single change
+
+    * SET: the field or dict item at path is set to value
+    * DELETE: the field or dict item at path is unset, value is None
+    * INSERT: path is the list path followed by the child guid, value is a
+      (position, child data) tuple
+    * REMOVE: path is the list path followed by the child guid
+    * ORDER: value is the list of child guids of the list at path, in order
+    '''
+    __slots__ = tuple()
+
+class ChangeError(ValueError):
+    '''Raised when a change set can't be applied to an instance'''
+
+class MergeError(ValueError):
+    '''Raised when instances don't derive from the given base'''
+
+
+FIELDS_CACHE = dict()
+
+def _fields(type_):
+    '''Get the fields of a model type by name'''
+    return get_cached(FIELDS_CACHE, type_, lambda: dict(
+        (attribute.name, attribute.attribute) for attribute in
+        type_.PYMODEL_MODEL_INFO.attributes))
+
+def _to_data(attr, value):
+    handler = ITEM_TO_DATA_COMPILERS[type(attr)](attr)
+    if handler is None or value is None:
+        return value
+    return handler(value)
+
+def _from_data(attr, data):
+    loader = ITEM_FROM_DATA_COMPILERS[type(attr)](attr)
+    if loader is None or data is None:
+        return data
+    return loader(data)
+
+def _raw(value):
+    '''Get the stored value of a field, unwrapping containers'''
+    if isinstance(value, EmptyObject):
+        return None
+    if isinstance(value, WrappedList):
+        return value._list
+    if isinstance(value, WrappedDict):
+        return value._dict
+    return value
+
+def _is_object_list(attr):
+    return isinstance(attr, pymodel.List) and \
+            isinstance(attr.type_, pymodel.Object)
+
+def _same(old, new, trust_versions):
+    if old is new:
+        return True
+    return trust_versions and old.guid and old.version and \
+            old.guid == new.guid and old.version == new.version
+
+
+def _diff_model(old, new, path, changes, trust_versions):
+    old_store = old._pymodel_store
+    new_store = new._pymodel_store
+
+    for name, attr in _fields(type(new)).iteritems():
+        old_value = _raw(old_store.get(name))
+        new_value = _raw(new_store.get(name))
+        if old_value is new_value:
+            continue
+        _diff_value(attr, old_value, new_value, path + (name, ), changes,
+                    trust_versions)
+
+def _diff_value(attr, old, new, path, changes, trust_versions):
+    if isinstance(attr, pymodel.Object):
+        if old is None or new is None or type(old) is not type(new):
+            if new is None:
+                changes.append(Change(DELETE, path, None))
+            else:
+                changes.append(Change(SET, path, _to_data(attr, new)))
+        elif not _same(old, new, trust_versions):
+            _diff_model(old, new, path, changes, trust_versions)
+
+    elif isinstance(attr, pymodel.List):
+        old = old or []
+        new = new or []
+        if _is_object_list(attr) and _has_guids(old) and _has_guids(new):
+            _diff_object_list(attr, old, new, path, changes, trust_versions)
+        elif old != new:
+            changes.append(Change(SET, path, [_to_data(attr.type_, item) for
+                                              item in new]))
+
+    elif isinstance(attr, pymodel.Dict):
+        _diff_dict(attr, old or {}, new or {}, path, changes, trust_versions)
+
+    elif old != new or type(old) is not type(new):
+        if new is None:
+            changes.append(Change(DELETE, path, None))
+        else:
+            changes.append(Change(SET, path, _to_data(attr, new)))
+
+def _has_guids(children):
+    guids = set(child.guid for child in children)
+    return None not in guids and len(guids) == len(children)
+
+def _diff_object_list(attr, old, new, path, changes, trust_versions):
+    old_children = dict((child.guid, child) for child in old)
+    new_guids = set(child.guid for child in new)
+
+    for guid, child in old_children.iteritems():
+        if guid not in new_guids:
+            changes.append(Change(REMOVE, path + (guid, ), None))
+
+    for position, child in enumerate(new):
+        old_child = old_children.get(child.guid)
+        if old_child is None:
+            changes.append(Change(INSERT, path + (child.guid, ), (
+                position, _to_data(attr.type_, child))))
+        elif not _same(old_child, child, trust_versions):
+            _diff_model(old_child, child, path + (child.guid, ), changes,
+                        trust_versions)
+
+    common = [child.guid for child in old if child.guid in new_guids]
+    kept = [child.guid for child in new if child.guid in old_children]
+    if common != kept:
+        changes.append(Change(ORDER, path, [child.guid for child in new]))
+
+def _diff_dict(attr, old, new, path, changes, trust_versions):
+    for key in old:
+        if key not in new:
+            changes.append(Change(DELETE, path + (key, ), None))
+
+    item_attr = attr.type_
+    for key, value in new.iteritems():
+        try:
+            old_value = old[key]
+        except KeyError:
+            changes.append(Change(SET, path + (key, ),
+                                  _to_data(item_attr, value)))
+            continue
+
+        if isinstance(value, Model) and type(old_value) is type(value):
+            if not _same(old_value, value, trust_versions):
+                _diff_model(old_value, value, path + (key, ), changes,
+                            trust_versions)
+        elif old_value != value or type(old_value) is not type(value):
+            changes.append(Change(SET, path + (key, ),
+                                  _to_data(item_attr, value)))
+
+def diff(old, new, trust_versions=False):
+    '''Compute the changes turning old into new
+
+    @param old: Model instance
+    @type old: L{Model}
+    @param new: Model instance of the same type
+    @type new: L{Model}
+    @param trust_versions: Don't walk children with equal guid and version
+    @type trust_versions: bool
+
+    @return: List of L{Change}s
+    @rtype: list
+    '''
+    if type(old) is not type(new):
+        raise TypeError('Can\'t diff instances of %s and %s' % (
+            type(old).__name__, type(new).__name__))
+
+    changes = list()
+    if old is not new:
+        _diff_model(old, new, (), changes, trust_versions)
+    return changes
+
+
+def _find_child(children, guid, path):
+    for position, child in enumerate(children):
+        if child.guid == guid:
+            return position, child
+    raise ChangeError('No child %s at %s' % (guid, '.'.join(path)))
+
+def _resolve(object_, path):
+    '''Walk path up to its last element
+
+    @return: Tuple of the container (model instance, list or dict), the
+             field holding the last element, the last element and the List
+             or Dict wrapping the container, if any
+    '''
+    current = object_
+    attr = None
+    container_attr = None
+    wrapper = None
+
+    for position, name in enumerate(path):
+        last = position == len(path) - 1
+
+        if isinstance(current, Model):
+            try:
+                attr = _fields(type(current))[name]
+            except KeyError:
+                raise ChangeError('Unknown attribute %s' % name)
+            container_attr = attr
+            if last:
+                return current, attr, name, None
+            # Unset containers are created on access
+            wrapper = getattr(current, name)
+            current = _raw(wrapper)
+            if current is None:
+                raise ChangeError('Attribute %s is not set' % name)
+
+        elif isinstance(current, list):
+            if last:
+                return current, container_attr.type_, name, wrapper
+            current = _find_child(current, name, path)[1]
+
+        elif isinstance(current, dict):
+            if last:
+                return current, container_attr.type_, name, wrapper
+            try:
+                current = current[name]
+            except KeyError:
+                raise ChangeError('No key %s at %s' % (name, '.'.join(path)))
+            container_attr = container_attr.type_
+
+        else:
+            raise ChangeError('Can\'t walk %s' % '.'.join(path))
+
+    raise ChangeError('Empty path')
+
+def _apply_change(object_, change):
+    op, path, value = change
+
+    if op == ORDER:
+        container, attr, name = _resolve(object_, path)[:3]
+        wrapper = getattr(container, name)
+        children = wrapper._list
+        by_guid = dict((child.guid, child) for child in children)
+        ordered = [by_guid.pop(guid) for guid in value if guid in by_guid]
+        # Children unknown to the change keep their relative order at the end
+        ordered.extend(child for child in children if child.guid in by_guid)
+        children[:] = ordered
+        wrapper._changed()
+        return
+
+    container, attr, name, wrapper = _resolve(object_, path)
+
+    if op in (INSERT, REMOVE):
+        if not isinstance(container, list):
+            raise ChangeError('%s is no list' % '.'.join(path[:-1]))
+        if op == INSERT:
+            position, data = value
+            child = _from_data(attr, data)
+            container.insert(min(position, len(container)), child)
+        else:
+            del container[_find_child(container, name, path)[0]]
+
+    elif op == SET:
+        value = _from_data(attr, value)
+        if isinstance(container, Model):
+            attr.__set__(container, value)
+        else:
+            container[name] = value
+
+    elif op == DELETE:
+        if isinstance(container, Model):
+            attr.__set__(container, None)
+        else:
+            container.pop(name, None)
+
+    else:
+        raise ChangeError('Unknown change operation %s' % op)
+
+    if wrapper is not None and not isinstance(container, Model):
+        # The raw list or dict was changed, let observers know
+        wrapper._changed()
+
+def apply(object_, changes):
+    '''Perform a change set on an instance, in place
+
+    @param object_: Model instance
+    @type object_: L{Model}
+    @param changes: Changes as returned by L{diff}
+    @type changes: iterable
+
+    @return: object_
+    @rtype: L{Model}
+
+    @raise ChangeError: A change doesn't fit the instance
+    '''
+    for change in changes:
+        _apply_change(object_, Change(*change))
+    return object_
+
+
+def _prefixes(path):
+    return [path[:length] for length in xrange(1, len(path) + 1)]
+
+def merge(base, mine, theirs, trust_versions=False):
+    '''Three-way merge of two instances derived from the same base
+
+    The changes made in mine which don't touch anything changed in theirs
+    are returned, ready to be applied on theirs. Changes of both sides
+    touching the same path, or one side changing something below a path the
+    other side sets or removes, are conflicts. Identical changes are not.
+
+    @param base: Common base instance
+    @type base: L{Model}
+    @param mine: Locally modified instance
+    @type mine: L{Model}
+    @param theirs: Concurrently stored instance
+    @type theirs: L{Model}
+
+    @return: Tuple of the list of changes to apply on theirs, and the list
+             of conflicting (my change, their changes) tuples
+    @rtype: tuple
+
+    @raise MergeError: mine or theirs has a _baseversion different from the
+                       version of base
+    '''
+    for object_ in (mine, theirs, ):
+        baseversion = object_._baseversion
+        if baseversion and base.version and baseversion != base.version and \
+           object_.version != base.version:
+            raise MergeError('Instance %s does not derive from version %s' %
+                             (object_.guid, base.version))
+
+    my_changes = diff(base, mine, trust_versions)
+    their_changes = diff(base, theirs, trust_versions)
+
+    # Their changes by path, and all paths their changes are below
+    theirs_by_path = dict()
+    for change in their_changes:
+        theirs_by_path.setdefault(change.path, list()).append(change)
+    below = set()
+    for path in theirs_by_path:
+        below.update(_prefixes(path))
+
+    changes = list()
+    conflicts = list()
+    for change in my_changes:
+        if change.op == ORDER:
+            their_orders = [their for their in theirs_by_path.get(
+                change.path, ()) if their.op == ORDER]
+            if not their_orders:
+                changes.append(change)
+            elif their_orders[0].value != change.value:
+                conflicts.append((change, their_orders))
+            continue
+
+        if change in theirs_by_path.get(change.path, ()):
+            # Same change on both sides
+            continue
+
+        touched = list()
+        for prefix in _prefixes(change.path):
+            touched.extend(their for their in theirs_by_path.get(prefix, ())
+                           if their.op != ORDER)
+        if change.path in below:
+            touched.extend(their for (path, theirs_) in
+                           theirs_by_path.iteritems() if
+                           path[:len(change.path)] == change.path and
+                           path != change.path for their in theirs_ if
+                           their.op != ORDER)
+
+        if touched:
+            conflicts.append((change, touched))
+        else:
+            changes.append(change)
+
+    logger.debug('Merged %d changes, %d conflicts' % (len(changes),
+                                                      len(conflicts)))
+    return changes, conflicts
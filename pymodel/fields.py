@@ -176,9 +176,15 @@ class SimpleContainer(Container):
 class WrappedList: pass
 def TypedList(type_):
     class _List(object, WrappedList):
+        # (store, field name) pairs of the observed stores holding the list,
+        # see pymodel.store
+        _pymodel_owners = ()
+
         def __init__(self, sequence=None):
             self._list = list()
+            self._fill(sequence)
 
+        def _fill(self, sequence):
             if sequence:
                 for item in sequence:
                     if isinstance(item, dict):
@@ -198,10 +204,18 @@ def TypedList(type_):
             if hasattr(object_, 'version') and not object_.version:
                 object_.version = str(uuid.uuid4())
             self._list.append(object_)
+            self._changed()
 
         def remove(self, object_):
             if object_ in self._list:
                 self._list.remove(object_)
+                self._changed()
+
+        def _changed(self):
+            # Changed in place, the next assignment replaces the wrapper
+            self._pymodel_recycled = False
+            for store, name in self._pymodel_owners:
+                store._notify(name)
 
         def __getitem__(self, index):
             return self._list[index]
@@ -250,6 +264,15 @@ class List(SimpleContainer, ExposedField):
         return value
 
     def __set__(self, obj, value):
+        current = obj._pymodel_store.get(self.name)
+        if getattr(current, '_pymodel_recycled', False) and \
+           not isinstance(value, WrappedList):
+            # List of a recycled instance, see pymodel.pool
+            current._pymodel_recycled = False
+            del current._list[:]
+            current._fill(value)
+            return
+
         SimpleContainer.__set__(self, obj, self.listtype(value))
 
     VALID_TYPE = property(fget=operator.attrgetter('listtype'))
@@ -261,9 +284,15 @@ class WrappedDict: pass
 
 def TypedDict(type_):
     class _Dict(object, UserDict.DictMixin, WrappedDict):
+        # (store, field name) pairs of the observed stores holding the dict,
+        # see pymodel.store
+        _pymodel_owners = ()
+
         def __init__(self, dict_=None):
             self._dict = dict()
+            self._fill(dict_)
 
+        def _fill(self, dict_):
             if dict_:
                 for key, value in dict_.iteritems():
                     if not isinstance(key, basestring):
@@ -275,6 +304,7 @@ def TypedDict(type_):
                                         'can be stored' % \
                                         type_.VALID_TYPE.__name__)
                     self._dict[key] = value
+                self._changed()
 
         def __getitem__(self, key):
             return self._dict.__getitem__(key)
@@ -287,9 +317,17 @@ def TypedDict(type_):
                                 'can be stored' % \
                                 type_.VALID_TYPE.__name__)
             self._dict.__setitem__(key, value)
+            self._changed()
 
         def __delitem__(self, key):
-            return self._dict.__delitem__(key)
+            self._dict.__delitem__(key)
+            self._changed()
+
+        def _changed(self):
+            # Changed in place, the next assignment replaces the wrapper
+            self._pymodel_recycled = False
+            for store, name in self._pymodel_owners:
+                store._notify(name)
 
         def keys(self):
             return self._dict.keys()
@@ -333,6 +371,15 @@ class Dict(SimpleContainer, ExposedField):
         return value
 
     def __set__(self, obj, value):
+        current = obj._pymodel_store.get(self.name)
+        if getattr(current, '_pymodel_recycled', False) and \
+           isinstance(value, dict):
+            # Dict of a recycled instance, see pymodel.pool
+            current._pymodel_recycled = False
+            current._dict.clear()
+            current._fill(value)
+            return
+
         if isinstance(value, dict) and not isinstance(value, self.dicttype):
             value = self.dicttype(value)
 
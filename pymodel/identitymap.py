@@ -0,0 +1,280 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Identity map of deserialized root objects
+
+An L{IdentityMap} keeps the most recently deserialized instances by
+(type, guid, version). When set as C{PYMODEL_IDENTITY_MAP} on a root object
+type, or on L{RootObjectModel} for all of them, C{deserialize} returns the
+instance decoded earlier for the same guid and version instead of a new
+one::
+
+    RootObjectModel.PYMODEL_IDENTITY_MAP = IdentityMap(max_items=10000)
+
+Serializers providing a C{peek_identity(type_, data)} method (the thrift
+ones do) let the map skip decoding altogether on a hit. For other
+serializers the data is decoded, and the shared instance is returned when
+one is known already.
+
+Since instances are shared, modifying one affects every user. Maps created
+with C{freeze=True} freeze the instances they hold, see L{freeze}.
+'''
+
+import logging
+import threading
+from collections import OrderedDict
+
+from pymodel.model import Model
+from pymodel.fields import WrappedList, WrappedDict
+
+logger = logging.getLogger('pymodel.identitymap')
+
+DEFAULT_MAX_ITEMS = 1000
+
+
+class FrozenError(TypeError):
+    '''Raised when modifying a frozen model instance'''
+    def __init__(self):
+        TypeError.__init__(self, 'Frozen model instances can not be modified')
+
+def _frozen(*args, **kwargs):
+    raise FrozenError()
+
+class FrozenStore(dict):
+    '''Read-only _pymodel_store of a frozen model instance'''
+    __slots__ = tuple()
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+            update = _frozen
+
+class FrozenList(list):
+    '''Read-only list wrapped by the _List of a frozen model instance'''
+    __slots__ = tuple()
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = \
+            __imul__ = append = extend = insert = pop = remove = reverse = \
+            sort = _frozen
+
+class FrozenDict(dict):
+    '''Read-only dict wrapped by the _Dict of a frozen model instance'''
+    __slots__ = tuple()
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+            update = _frozen
+
+def _freeze_value(value):
+    if isinstance(value, Model):
+        freeze(value)
+    elif isinstance(value, WrappedList):
+        for item in value._list:
+            _freeze_value(item)
+        value._list = FrozenList(value._list)
+    elif isinstance(value, WrappedDict):
+        for item in value._dict.itervalues():
+            _freeze_value(item)
+        value._dict = FrozenDict(value._dict)
+
+def freeze(object_):
+    '''Make a model instance, and all values it contains, read-only
+
+    Setting attributes or modifying containers of a frozen instance raises
+    L{FrozenError}.
+    '''
+    if isinstance(object_._pymodel_store, FrozenStore):
+        return object_
+
+    # Unset containers are created on first access, create them now
+    for attribute in object_.PYMODEL_MODEL_INFO.attributes:
+        getattr(object_, attribute.name)
+
+    for value in object_._pymodel_store.itervalues():
+        _freeze_value(value)
+    object_._pymodel_store = FrozenStore(object_._pymodel_store)
+    return object_
+
+def is_frozen(object_):
+    '''Check whether a model instance is frozen'''
+    return isinstance(object_._pymodel_store, FrozenStore)
+
+
+class IdentityMap(object):
+    '''Bounded LRU map of root object instances by type, guid and version'''
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS, max_bytes=None,
+                 freeze=False):
+        '''Initialize a new identity map
+
+        @param max_items: Maximal number of instances kept
+        @type max_items: number
+        @param max_bytes: Maximal total size of the serialized data the
+                          instances were decoded from, unbounded if None
+        @type max_bytes: number
+        @param freeze: Freeze instances added to the map, see L{freeze}
+        @type freeze: bool
+        '''
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.freeze = freeze
+
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, type_, guid, version):
+        '''Get the instance of type_ with the given guid and version, or
+        None'''
+        key = (type_, guid, version)
+        self._lock.acquire()
+        try:
+            try:
+                object_, size = self._items.pop(key)
+            except KeyError:
+                return None
+            # Move to the most recently used end
+            self._items[key] = (object_, size)
+            return object_
+        finally:
+            self._lock.release()
+
+    def add(self, object_, size=0):
+        '''Add an instance to the map
+
+        Instances without guid or version are not added.
+
+        @param size: Size accounted for the instance
+        @type size: number
+
+        @return: The instance known for the same type, guid and version if
+                 any, object_ otherwise
+        @rtype: L{RootObjectModel}
+        '''
+        guid, version = object_.guid, object_.version
+        if not guid or not version:
+            return object_
+
+        key = (type(object_), guid, version)
+        self._lock.acquire()
+        try:
+            try:
+                return self._items[key][0]
+            except KeyError:
+                pass
+
+            if self.freeze:
+                freeze(object_)
+            self._items[key] = (object_, size)
+            self._bytes += size
+            self._evict()
+        finally:
+            self._lock.release()
+
+        return object_
+
+    def _evict(self):
+        while self._items and (len(self._items) > self.max_items or
+                               (self.max_bytes is not None and
+                                self._bytes > self.max_bytes)):
+            key, (object_, size) = self._items.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def deserialize(self, type_, deserializer, data):
+        '''Deserialize data, returning a shared instance when one is known
+
+        @param type_: Root object type
+        @type type_: type
+        @param deserializer: Serializer used to decode data
+        @param data: Serialized object
+        '''
+        size = len(data) if isinstance(data, basestring) else 0
+
+        peek_identity = getattr(deserializer, 'peek_identity', None)
+        if peek_identity is not None:
+            guid, version = peek_identity(type_, data)
+            if guid and version:
+                object_ = self.get(type_, guid, version)
+                if object_ is not None:
+                    self.hits += 1
+                    return object_
+
+        decoded = deserializer.deserialize(type_, data)
+        object_ = self.add(decoded, size)
+        if object_ is decoded:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return object_
+
+    def invalidate(self, type_, guid, version=None):
+        '''Drop the instances of type_ with the given guid, and version if
+        given'''
+        self._lock.acquire()
+        try:
+            for key in self._items.keys():
+                if key[0] is type_ and key[1] == guid and \
+                   (version is None or key[2] == version):
+                    self._bytes -= self._items.pop(key)[1]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''Drop all instances'''
+        self._lock.acquire()
+        try:
+            self._items.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        '''Get the statistics of the map
+
+        @return: Dict with 'hits', 'misses', 'evictions', 'hit_rate',
+                 'items' and 'bytes'
+        @rtype: dict
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else None,
+            'items': len(self._items),
+            'bytes': self._bytes,
+        }
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,320 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Performance counters for serialization
+
+When enabled, every call to L{RootObjectModel.serialize},
+L{RootObjectModel.deserialize} and to the serialize/deserialize methods of
+the entries in L{SERIALIZERS} is timed. Counters are kept per
+(model type, serializer, operation) and hold the number of calls, errors,
+cumulative, minimal and maximal latency, a latency histogram and the number
+of bytes produced or consumed::
+
+    import pymodel.instrumentation
+    pymodel.instrumentation.enable()
+    ...
+    for key, counter in pymodel.instrumentation.snapshot().iteritems():
+        print key, counter['calls'], counter['total']
+
+Nested calls, e.g. a model serialize call going through an instrumented
+registry entry, are only counted once. When disabled the original methods
+are restored, so the instrumentation has no cost at all.
+
+Snapshots can be pushed to sinks, callables receiving the snapshot dict,
+registered using L{add_sink}, by calling L{publish}.
+'''
+
+import time
+import logging
+import threading
+
+from pymodel.model import RootObjectModel
+from pymodel.serializers import SERIALIZERS
+
+logger = logging.getLogger('pymodel.instrumentation')
+
+SERIALIZE = 'serialize'
+DESERIALIZE = 'deserialize'
+
+# Upper bounds of the latency histogram buckets, in seconds. Latencies above
+# the last bound end up in an extra overflow bucket.
+HISTOGRAM_BOUNDS = tuple(2 ** i / 1000000.0 for i in xrange(0, 24))
+
+COUNTERS = dict()
+SINKS = list()
+
+_lock = threading.Lock()
+_state = threading.local()
+_originals = None
+
+
+class Counter(object):
+    '''Statistics of one (model type, serializer, operation) combination'''
+    __slots__ = ('calls', 'errors', 'total', 'min', 'max', 'bytes',
+                 'histogram', )
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.bytes = 0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, duration, size, failed):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        self.bytes += size
+
+        bucket = 0
+        for bound in HISTOGRAM_BOUNDS:
+            if duration <= bound:
+                break
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / self.calls if self.calls else None,
+            'bytes': self.bytes,
+            'histogram': tuple(self.histogram),
+        }
+
+
+def _serializer_name(serializer):
+    name = getattr(serializer, 'NAME', None)
+    if name is None:
+        name = getattr(serializer, '__name__', repr(serializer))
+    return name
+
+def _size(data):
+    if isinstance(data, basestring):
+        return len(data)
+    return 0
+
+def _record(type_, serializer, operation, duration, size, failed):
+    key = (type_.__name__, _serializer_name(serializer), operation)
+    _lock.acquire()
+    try:
+        try:
+            counter = COUNTERS[key]
+        except KeyError:
+            counter = COUNTERS[key] = Counter()
+        counter.add(duration, size, failed)
+    finally:
+        _lock.release()
+
+def _timed(func, type_, serializer, operation, data, args):
+    '''Call func(*args), recording it unless an outer call is recorded'''
+    if getattr(_state, 'active', False):
+        return func(*args)
+
+    _state.active = True
+    failed = True
+    result = None
+    start = time.time()
+    try:
+        result = func(*args)
+        failed = False
+        return result
+    finally:
+        duration = time.time() - start
+        _state.active = False
+        if operation == SERIALIZE:
+            size = _size(result)
+        else:
+            size = _size(data)
+        _record(type_, serializer, operation, duration, size, failed)
+
+
+class InstrumentedSerializer(object):
+    '''Registry entry timing the calls to the serializer it wraps
+
+    All other attribute lookups are forwarded to the wrapped serializer.
+    '''
+    def __init__(self, serializer):
+        self._serializer = serializer
+
+    def serialize(self, object_, *args, **kwargs):
+        return _timed(lambda: self._serializer.serialize(object_, *args,
+                                                         **kwargs),
+                      type(object_), self._serializer, SERIALIZE, None, ())
+
+    def deserialize(self, type_, data, *args, **kwargs):
+        return _timed(lambda: self._serializer.deserialize(type_, data,
+                                                           *args, **kwargs),
+                      type_, self._serializer, DESERIALIZE, data, ())
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    def __repr__(self):
+        return '<InstrumentedSerializer %r>' % self._serializer
+
+
+def _serialize(self, serializer):
+    return _timed(_originals[0], type(self), serializer, SERIALIZE, None,
+                  (self, serializer))
+
+def _deserialize(cls, deserializer, data):
+    return _timed(_originals[1].__func__, cls, deserializer, DESERIALIZE,
+                  data, (cls, deserializer, data))
+
+
+def enabled():
+    '''Check whether the instrumentation is enabled'''
+    return _originals is not None
+
+def enable():
+    '''Start recording serialization calls
+
+    Serializers registered in L{SERIALIZERS} after this call are not
+    instrumented.
+    '''
+    global _originals
+
+    _lock.acquire()
+    try:
+        if _originals is not None:
+            return
+        logger.info('Enabling serialization instrumentation')
+
+        _originals = (RootObjectModel.__dict__['serialize'],
+                      RootObjectModel.__dict__['deserialize'], )
+        RootObjectModel.serialize = _serialize
+        RootObjectModel.deserialize = classmethod(_deserialize)
+
+        for name, serializer in SERIALIZERS.items():
+            if not isinstance(serializer, InstrumentedSerializer):
+                dict.__setitem__(SERIALIZERS, name,
+                                 InstrumentedSerializer(serializer))
+    finally:
+        _lock.release()
+
+def disable():
+    '''Stop recording serialization calls, recorded counters are kept'''
+    global _originals
+
+    _lock.acquire()
+    try:
+        if _originals is None:
+            return
+        logger.info('Disabling serialization instrumentation')
+
+        RootObjectModel.serialize, RootObjectModel.deserialize = _originals
+        _originals = None
+
+        for name, serializer in SERIALIZERS.items():
+            if isinstance(serializer, InstrumentedSerializer):
+                dict.__setitem__(SERIALIZERS, name, serializer._serializer)
+    finally:
+        _lock.release()
+
+def reset():
+    '''Drop all recorded counters'''
+    _lock.acquire()
+    try:
+        COUNTERS.clear()
+    finally:
+        _lock.release()
+
+def snapshot(reset=False):
+    '''Get the recorded counters
+
+    @param reset: Drop the counters once they are copied
+    @type reset: bool
+
+    @return: Counter dicts by (type name, serializer name, operation)
+    @rtype: dict
+    '''
+    _lock.acquire()
+    try:
+        result = dict((key, counter.to_dict()) for (key, counter) in
+                      COUNTERS.iteritems())
+        if reset:
+            COUNTERS.clear()
+    finally:
+        _lock.release()
+    return result
+
+def add_sink(sink):
+    '''Register a callable receiving the snapshots passed to L{publish}'''
+    SINKS.append(sink)
+    return sink
+
+def remove_sink(sink):
+    '''Unregister a sink'''
+    SINKS.remove(sink)
+
+def publish(reset=False):
+    '''Take a snapshot and pass it to all registered sinks
+
+    Errors raised by a sink are logged and don't prevent other sinks from
+    receiving the snapshot.
+
+    @param reset: Drop the counters once they are copied
+    @type reset: bool
+    '''
+    data = snapshot(reset)
+    for sink in tuple(SINKS):
+        try:
+            sink(data)
+        except Exception:
+            logger.exception('Instrumentation sink %r failed' % sink)
+    return data
+
+def log_sink(data):
+    '''Sink writing a summary line per counter to the instrumentation
+    logger'''
+    for (type_name, serializer_name, operation), counter in \
+            sorted(data.iteritems()):
+        logger.info('%s %s %s: %d calls, %d errors, %.6fs total, '
+                    '%.6fs mean, %.6fs max, %d bytes' % (
+                        type_name, serializer_name, operation,
+                        counter['calls'], counter['errors'], counter['total'],
+                        counter['mean'] or 0.0, counter['max'],
+                        counter['bytes']))
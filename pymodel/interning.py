@@ -0,0 +1,171 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''String interning during deserialization
+
+Decoded instances each hold their own copy of strings which repeat across
+many of them: enumeration names, dictionary keys, creation dates,... Once
+interning is enabled, the thrift, YAML, XML and JSON deserializers look
+those strings up in a bounded L{InternTable}, so equal strings decoded for
+different instances share one object::
+
+    pymodel.interning.enable(max_items=100000)
+
+Enumeration names and the keys of Dict fields are always interned. Values
+of String fields are only interned when the field asks for it::
+
+    class Machine(pymodel.RootObjectModel):
+        vendor = pymodel.String(thrift_id=1, intern=True)
+
+The creationdate field of root objects is interned as well. Instances
+decoded by the C-accelerated thrift decoder are not interned.
+'''
+
+import logging
+
+from pymodel.fields import String, Enumeration
+
+logger = logging.getLogger('pymodel.interning')
+
+DEFAULT_MAX_ITEMS = 64 * 1024
+# Longer strings are unlikely to repeat, they are never interned
+DEFAULT_MAX_LENGTH = 128
+
+
+class InternTable(object):
+    '''Bounded table of shared strings
+
+    Once the table holds max_items strings, new strings are no longer added,
+    the ones found to repeat so far keep being shared.
+    '''
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS,
+                 max_length=DEFAULT_MAX_LENGTH):
+        '''Initialize a new intern table
+
+        @param max_items: Maximal number of strings kept
+        @type max_items: number
+        @param max_length: Maximal length of the strings interned
+        @type max_length: number
+        '''
+        self.max_items = max_items
+        self.max_length = max_length
+        self._strings = dict()
+
+    def intern(self, value):
+        '''Get the shared string equal to value
+
+        @return: The string kept in the table, or value itself
+        @rtype: basestring
+        '''
+        shared = self._strings.get(value)
+        # str and unicode strings compare equal, don't hand out the other one
+        if shared is not None and type(shared) is type(value):
+            return shared
+
+        if shared is None and len(value) <= self.max_length and \
+           len(self._strings) < self.max_items:
+            return self._strings.setdefault(value, value)
+
+        return value
+
+    def clear(self):
+        '''Drop all strings'''
+        self._strings.clear()
+
+    def stats(self):
+        '''Get the number of strings kept and the total size of their
+        characters'''
+        return {
+            'items': len(self._strings),
+            'max_items': self.max_items,
+            'characters': sum(len(value) for value in self._strings),
+        }
+
+    def __len__(self):
+        return len(self._strings)
+
+
+# Table used by the deserializers, None when interning is disabled
+TABLE = None
+
+def enable(max_items=DEFAULT_MAX_ITEMS, max_length=DEFAULT_MAX_LENGTH):
+    '''Enable interning using a new table
+
+    @return: The intern table
+    @rtype: L{InternTable}
+    '''
+    global TABLE
+    logger.info('Enabling string interning, max %d items' % max_items)
+    TABLE = InternTable(max_items=max_items, max_length=max_length)
+    return TABLE
+
+def disable():
+    '''Disable interning, dropping the table'''
+    global TABLE
+    TABLE = None
+
+def enabled():
+    '''Check whether interning is enabled'''
+    return TABLE is not None
+
+def intern_string(value):
+    '''Intern a string when interning is enabled'''
+    table = TABLE
+    if table is None or value is None:
+        return value
+    return table.intern(value)
+
+def intern_keys(dict_):
+    '''Intern the keys of a dictionary when interning is enabled
+
+    @return: dict_ itself if interning is disabled, a new dictionary
+             otherwise
+    @rtype: dict
+    '''
+    table = TABLE
+    if table is None:
+        return dict_
+    intern = table.intern
+    return dict((intern(key), value) for (key, value) in dict_.iteritems())
+
+def intern_field(attr):
+    '''Check whether the values of a field should be interned
+
+    @param attr: Model field
+    @type attr: L{pymodel.fields.Field}
+    '''
+    return isinstance(attr, Enumeration) or (
+        isinstance(attr, String) and attr.kwargs.get('intern', False))
@@ -0,0 +1,317 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Memory accounting of model instances
+
+L{measure} walks model instances, either the ones given or all live
+instances tracked by the garbage collector, and reports per model type the
+number of instances and the number of bytes they use. Sizes are computed
+using C{sys.getsizeof} and include the instance itself, its
+C{_pymodel_store} dict, the stored values and the C{_List}/C{_Dict} wrappers
+of container fields. Nested model instances are accounted to their own
+type. Model instances and containers are counted once even when they are
+shared, while shared immutable values (e.g. strings) are counted for every
+reference so reports don't depend on what else is alive.
+
+The classes generated for every Object, List and Dict field (the
+C{_ObjectHelper} helpers and the typed list and dict classes) are reported
+per model type as well.
+
+Reports are plain dicts, which can be written to and loaded from JSON files
+and compared between runs or releases::
+
+    import pymodel.memory
+    report = pymodel.memory.measure()
+    pymodel.memory.write_report(report, open('memory.json', 'w'))
+    ...
+    for row in pymodel.memory.compare_reports(old, report):
+        print row
+
+When running on an interpreter providing C{tracemalloc}, L{trace} can be
+used to sample the allocations done by pymodel and the model modules while
+calling a function.
+'''
+
+import gc
+import os
+import sys
+import json
+import time
+import logging
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import pymodel
+from pymodel.model import Model
+from pymodel.fields import WrappedList, WrappedDict
+
+logger = logging.getLogger('pymodel.memory')
+
+REPORT_VERSION = 1
+
+# Values which are walked, and only counted once when shared
+CONTAINER_TYPES = (WrappedList, WrappedDict, list, tuple, dict, )
+
+
+def type_name(type_):
+    '''Get the name used for a model type in reports'''
+    return '%s.%s' % (type_.__module__, type_.__name__)
+
+def _value_size(value, seen, models):
+    '''Size of a stored value, nested models are added to models instead'''
+    if value is None or value is True or value is False:
+        return 0
+
+    if isinstance(value, Model):
+        models.append(value)
+        return 0
+
+    if not isinstance(value, CONTAINER_TYPES):
+        return sys.getsizeof(value)
+
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+
+    if isinstance(value, WrappedList):
+        size += _value_size(value._list, seen, models)
+    elif isinstance(value, WrappedDict):
+        size += _value_size(value._dict, seen, models)
+    elif isinstance(value, (list, tuple, )):
+        for item in value:
+            size += _value_size(item, seen, models)
+    elif isinstance(value, dict):
+        for key, item in value.iteritems():
+            size += _value_size(key, seen, models)
+            size += _value_size(item, seen, models)
+
+    return size
+
+def instance_size(object_, seen=None, models=None):
+    '''Get the number of bytes used by a model instance, excluding the nested
+    model instances
+
+    @param object_: Model instance
+    @type object_: L{Model}
+    @param seen: Ids of the objects accounted for already
+    @type seen: set
+    @param models: List the nested model instances are appended to
+    @type models: list
+
+    @return: Size in bytes
+    @rtype: number
+    '''
+    if seen is None:
+        seen = set()
+    if models is None:
+        models = list()
+
+    if id(object_) in seen:
+        return 0
+    seen.add(id(object_))
+
+    size = sys.getsizeof(object_)
+    store = getattr(object_, '_pymodel_store', None)
+    if store is not None:
+        seen.add(id(store))
+        size += sys.getsizeof(store)
+        for name, value in store.iteritems():
+            size += _value_size(name, seen, models)
+            size += _value_size(value, seen, models)
+
+    return size
+
+def deep_size(object_):
+    '''Get the number of bytes used by a model instance, including all nested
+    model instances'''
+    seen = set()
+    models = [object_]
+    size = 0
+    while models:
+        size += instance_size(models.pop(), seen, models)
+    return size
+
+def class_size(type_):
+    '''Get the number of bytes used by the classes and helpers generated for
+    the fields of a model type'''
+    size = 0
+    seen = set()
+    for attribute in type_.PYMODEL_MODEL_INFO.attributes:
+        attr = attribute.attribute
+        generated = list()
+        if isinstance(attr, pymodel.Object):
+            generated.append(attr.helper)
+            generated.append(type(attr.helper))
+        elif isinstance(attr, pymodel.List):
+            generated.append(attr.listtype)
+        elif isinstance(attr, pymodel.Dict):
+            generated.append(attr.dicttype)
+
+        for object_ in generated:
+            if id(object_) in seen:
+                continue
+            seen.add(id(object_))
+            size += sys.getsizeof(object_)
+            if isinstance(object_, type):
+                size += sys.getsizeof(object_.__dict__)
+    return size
+
+def live_instances():
+    '''Get all model instances tracked by the garbage collector'''
+    return [object_ for object_ in gc.get_objects() if
+            isinstance(object_, Model)]
+
+def measure(objects=None):
+    '''Account the memory used by model instances per type
+
+    @param objects: Model instances to walk, nested instances are walked as
+                    well. Defaults to all live model instances.
+    @type objects: iterable
+
+    @return: Report dict, with a 'types' dict containing 'count', 'bytes'
+             and 'class_bytes' per model type name
+    @rtype: dict
+    '''
+    if objects is None:
+        objects = live_instances()
+
+    types = dict()
+    seen = set()
+    models = list(objects)
+
+    while models:
+        object_ = models.pop()
+        if id(object_) in seen:
+            continue
+
+        size = instance_size(object_, seen, models)
+        type_ = type(object_)
+        name = type_name(type_)
+        try:
+            info = types[name]
+        except KeyError:
+            info = types[name] = {
+                'count': 0,
+                'bytes': 0,
+                'class_bytes': class_size(type_),
+            }
+        info['count'] += 1
+        info['bytes'] += size
+
+    logger.info('Accounted %d model instances of %d types' % (
+        sum(info['count'] for info in types.itervalues()), len(types)))
+
+    return {
+        'version': REPORT_VERSION,
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'types': types,
+    }
+
+def write_report(report, stream):
+    '''Write a report as JSON to a file-like object'''
+    json.dump(report, stream, indent=2, sort_keys=True)
+    stream.write('\n')
+
+def load_report(stream):
+    '''Load a report written by L{write_report}'''
+    return json.load(stream)
+
+def compare_reports(old, new, key='bytes'):
+    '''Compare two reports
+
+    Types only found in one of both reports are included with a value of 0
+    for the other one.
+
+    @param key: Value to compare, 'bytes', 'count' or 'class_bytes'
+    @type key: string
+
+    @return: List of (type name, old, new, difference) tuples, largest
+             difference first
+    @rtype: list
+    '''
+    old_types = old['types']
+    new_types = new['types']
+
+    comparison = list()
+    for name in set(old_types).union(new_types):
+        old_value = old_types.get(name, {}).get(key, 0)
+        new_value = new_types.get(name, {}).get(key, 0)
+        comparison.append((name, old_value, new_value, new_value - old_value))
+
+    comparison.sort(key=lambda row: (-abs(row[3]), row[0]))
+    return comparison
+
+def trace(func, *args, **kwargs):
+    '''Sample the allocations done by pymodel and the model modules while
+    calling func
+
+    Requires tracemalloc, which is not part of the standard library before
+    Python 3.4.
+
+    @return: Tuple of the result of func, and a list of (location, bytes,
+             count) tuples for the allocations still alive when func
+             returned, largest first
+    @rtype: tuple
+    '''
+    if tracemalloc is None:
+        raise RuntimeError('tracemalloc is not available on this system')
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func(*args, **kwargs)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    filters = [tracemalloc.Filter(True, os.path.join(
+        os.path.dirname(pymodel.__file__), '*')), ]
+    filters.extend(tracemalloc.Filter(True, os.path.join(path, '*')) for
+                   path in pymodel.DOMAIN_PATHS.itervalues())
+    after = after.filter_traces(filters)
+    before = before.filter_traces(filters)
+
+    statistics = [(str(stat.traceback), stat.size_diff, stat.count_diff) for
+                  stat in after.compare_to(before, 'lineno') if
+                  stat.size_diff > 0]
+    return result, statistics
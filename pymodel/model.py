@@ -10,7 +10,7 @@ GUIDField = GUID()
 GUIDField.name = 'guid'
 VersionField = GUID()
 VersionField.name = 'version'
-CreationDateField = String()
+CreationDateField = String(intern=True)
 CreationDateField.name = 'creationdate'
 BaseVersionField = GUID()
 BaseVersionField.name = '_baseversion'
@@ -110,6 +110,8 @@ class Model(object):
 
     # Make PyLint happy, set by metaclass
     PYMODEL_MODEL_INFO = None
+    # pymodel.pool.InstancePool deserializers take instances from, if any
+    PYMODEL_INSTANCE_POOL = None
 
     def __init__(self, **kwargs):
         self._pymodel_store = dict()
@@ -155,9 +157,28 @@ class Model(object):
 class RootObjectModel(Model):
     __slots__ = tuple()
 
+    # pymodel.identitymap.IdentityMap consulted by deserialize, if any
+    PYMODEL_IDENTITY_MAP = None
+    # pymodel.serializationcache.SerializationCache consulted by serialize,
+    # if any
+    PYMODEL_SERIALIZATION_CACHE = None
+
     def serialize(self, serializer):
+        cache = self.PYMODEL_SERIALIZATION_CACHE
+        if cache is not None:
+            return cache.serialize(self, serializer)
         return serializer.serialize(self)
 
+    def release(self):
+        '''Give the instance back to the pool of its type, if any, see
+        pymodel.pool'''
+        pool = self.PYMODEL_INSTANCE_POOL
+        if pool is not None:
+            pool.release(self)
+
     @classmethod
     def deserialize(cls, deserializer, data):
+        identity_map = cls.PYMODEL_IDENTITY_MAP
+        if identity_map is not None:
+            return identity_map.deserialize(cls, deserializer, data)
         return deserializer.deserialize(cls, data)
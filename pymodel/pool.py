@@ -0,0 +1,222 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Instance pools for high-rate deserialization
+
+An L{InstancePool} keeps released instances of one model type, reset in
+place, to hand them out again instead of allocating new ones. When a pool
+is set as C{PYMODEL_INSTANCE_POOL} on a model type (see L{enable_pool}),
+all serializers take the instances they decode from it, and callers give
+them back once done::
+
+    pymodel.pool.enable_pool(Event, max_size=1000)
+
+    event = Event.deserialize(ThriftSerializer, data)
+    handle(event)
+    event.release()
+
+Resetting an instance empties its C{_pymodel_store} dict and the lists and
+dicts wrapped by its List and Dict fields, but keeps the dict and the
+C{_List}/C{_Dict} wrappers, which are refilled when the instance is decoded
+again. Nested instances found in the fields are released to the pool of
+their own type, if any.
+
+Only release instances nothing else refers to anymore: any reference kept
+to a released instance, or to one of its containers or nested instances,
+will see it being reused. Observed instances (see L{pymodel.store}) and
+frozen ones (see L{pymodel.identitymap.freeze}) are shared by design and
+can't be released; nested ones are left out of the pools.
+'''
+
+import logging
+import threading
+
+from pymodel.model import Model
+from pymodel.fields import EmptyObject, WrappedList, WrappedDict
+
+logger = logging.getLogger('pymodel.pool')
+
+DEFAULT_MAX_SIZE = 1024
+
+
+def new_instance(type_):
+    '''Get an empty instance of a model type, from its pool if it has one'''
+    pool = type_.PYMODEL_INSTANCE_POOL
+    if pool is None:
+        return type_()
+    return pool.acquire()
+
+def release(object_):
+    '''Give an instance back to the pool of its type, if any'''
+    pool = type(object_).PYMODEL_INSTANCE_POOL
+    if pool is not None:
+        pool.release(object_)
+
+def _release_nested(value):
+    if isinstance(value, Model) and type(value._pymodel_store) is dict:
+        release(value)
+
+def enable_pool(type_, max_size=DEFAULT_MAX_SIZE):
+    '''Create a pool for a model type, and set it on the type'''
+    pool = type_.PYMODEL_INSTANCE_POOL = InstancePool(type_, max_size)
+    return pool
+
+def disable_pool(type_):
+    '''Stop pooling instances of a model type'''
+    type_.PYMODEL_INSTANCE_POOL = None
+
+
+class InstancePool(object):
+    '''Pool of reset instances of one model type'''
+
+    def __init__(self, type_, max_size=DEFAULT_MAX_SIZE):
+        '''Initialize a new instance pool
+
+        @param type_: Model type of the pooled instances
+        @type type_: type
+        @param max_size: Maximal number of instances kept, instances
+                         released when the pool is full are dropped
+        @type max_size: number
+        '''
+        self.type_ = type_
+        self.max_size = max_size
+
+        self._instances = list()
+        # Ids of the pooled instances, to detect double releases
+        self._ids = set()
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+        self.dropped = 0
+
+    def acquire(self):
+        '''Get an empty instance'''
+        self._lock.acquire()
+        try:
+            try:
+                object_ = self._instances.pop()
+            except IndexError:
+                self.created += 1
+                object_ = None
+            else:
+                self._ids.discard(id(object_))
+                self.reused += 1
+        finally:
+            self._lock.release()
+
+        if object_ is None:
+            object_ = self.type_()
+        return object_
+
+    def release(self, object_):
+        '''Reset an instance and keep it for reuse
+
+        @raise TypeError: object_ is not an instance of the pooled type
+        @raise ValueError: object_ is in the pool already, or is observed
+                           or frozen
+        '''
+        if type(object_) is not self.type_:
+            raise TypeError('Only objects of type %s can be pooled' %
+                            self.type_.__name__)
+        if id(object_) in self._ids:
+            raise ValueError('Instance released twice')
+
+        self.reset(object_)
+
+        self._lock.acquire()
+        try:
+            self.released += 1
+            if len(self._instances) >= self.max_size:
+                self.dropped += 1
+                return
+            self._instances.append(object_)
+            self._ids.add(id(object_))
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def reset(object_):
+        '''Empty an instance in place, keeping its store and containers
+
+        @raise ValueError: object_ is observed or frozen
+        '''
+        store = object_._pymodel_store
+        if type(store) is not dict:
+            # Observers and identity maps still refer to the instance
+            raise ValueError('Observed or frozen instances can\'t be reset')
+
+        for name, value in store.items():
+            if isinstance(value, WrappedList):
+                for item in value._list:
+                    _release_nested(item)
+                if type(value._list) is list:
+                    del value._list[:]
+                else:
+                    value._list = list()
+                value._pymodel_recycled = True
+            elif isinstance(value, WrappedDict):
+                for item in value._dict.itervalues():
+                    _release_nested(item)
+                if type(value._dict) is dict:
+                    value._dict.clear()
+                else:
+                    value._dict = dict()
+                value._pymodel_recycled = True
+            elif isinstance(value, EmptyObject):
+                # Unset Object field marker, shared by all instances
+                continue
+            else:
+                _release_nested(value)
+                del store[name]
+
+    def stats(self):
+        '''Get the statistics of the pool
+
+        @return: Dict with 'created', 'reused', 'released', 'dropped' and
+                 'size'
+        @rtype: dict
+        '''
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'released': self.released,
+            'dropped': self.dropped,
+            'size': len(self._instances),
+        }
+
+    def __len__(self):
+        return len(self._instances)
@@ -0,0 +1,259 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Cache of serialized root objects
+
+A L{SerializationCache} keeps the data produced by serializers by
+(type, guid, version, serializer name), evicting the least recently used
+entries when its memory budget is exceeded. When set as
+C{PYMODEL_SERIALIZATION_CACHE} on a root object type, or on
+L{RootObjectModel} for all of them, C{serialize} returns the cached data
+instead of encoding the instance again::
+
+    RootObjectModel.PYMODEL_SERIALIZATION_CACHE = SerializationCache(
+        max_bytes=64 * 1024 * 1024)
+
+An instance only uses cached data once it went through the cache: the first
+time an instance is serialized it is encoded, and it is observed from then
+on (see L{pymodel.store}), together with the model instances nested in it.
+Setting any field of these instances, or adding items to and removing items
+from their List and Dict fields, drops the entries of its guid and version,
+so modified instances are never served stale data, even when their version
+is not changed. Instances of which the encoding differs from the cached data
+for the same guid and version replace the entry. Frozen instances (see
+L{pymodel.identitymap.freeze}) can't change and are trusted once their
+encoding matched.
+'''
+
+import logging
+import threading
+from collections import OrderedDict
+
+from pymodel.model import Model
+from pymodel.fields import WrappedList, WrappedDict
+from pymodel.store import ObservedStore, observe
+
+logger = logging.getLogger('pymodel.serializationcache')
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Bytes accounted per entry on top of the size of the data
+ENTRY_OVERHEAD = 256
+
+
+class _Entry(object):
+    '''Cached data, registered as observer of the instances using it'''
+    __slots__ = ('cache', 'key', 'data', 'size', 'alive', 'frozen_stores', )
+
+    def __init__(self, cache, key, data):
+        self.cache = cache
+        self.key = key
+        self.data = data
+        self.size = (len(data) if isinstance(data, basestring) else 0) + \
+                ENTRY_OVERHEAD
+        self.alive = True
+        # Unobservable stores known to match data, kept alive so their ids
+        # can't be reused
+        self.frozen_stores = list()
+
+    def __call__(self, name):
+        # A field of an instance using the entry was set
+        self.cache._invalidate_entry(self)
+
+    def trusts(self, store):
+        if isinstance(store, ObservedStore):
+            return any(observer is self for observer in store.observers)
+        return any(frozen is store for frozen in self.frozen_stores)
+
+
+def _models(object_):
+    '''Iterate over object_ and the model instances nested in it'''
+    pending = [object_]
+    while pending:
+        current = pending.pop()
+        yield current
+        for value in current._pymodel_store.itervalues():
+            if isinstance(value, WrappedList):
+                pending.extend(item for item in value._list
+                               if isinstance(item, Model))
+            elif isinstance(value, WrappedDict):
+                pending.extend(item for item in value._dict.itervalues()
+                               if isinstance(item, Model))
+            elif isinstance(value, Model):
+                pending.append(value)
+
+
+class SerializationCache(object):
+    '''LRU cache of serialized data under a memory budget'''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        '''Initialize a new serialization cache
+
+        @param max_bytes: Maximal total size of the cached data
+        @type max_bytes: number
+        '''
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def serialize(self, object_, serializer):
+        '''Serialize an instance, using the cached data when possible
+
+        @param object_: Root object instance
+        @type object_: L{RootObjectModel}
+        @param serializer: Serializer used to encode object_
+        '''
+        name = getattr(serializer, 'NAME', None)
+        guid, version = object_.guid, object_.version
+        if name is None or not guid or not version:
+            return serializer.serialize(object_)
+
+        key = (type(object_), guid, version, name)
+
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None and entry.trusts(object_._pymodel_store):
+                del self._entries[key]
+                self._entries[key] = entry
+                self.hits += 1
+                return entry.data
+        finally:
+            self._lock.release()
+
+        data = serializer.serialize(object_)
+
+        self._lock.acquire()
+        try:
+            self.misses += 1
+            entry = self._entries.get(key)
+            if entry is None or entry.data != data:
+                if entry is not None:
+                    self._drop(key)
+                entry = _Entry(self, key, data)
+                self._entries[key] = entry
+                self._bytes += entry.size
+            self._attach(entry, object_)
+            self._evict()
+        finally:
+            self._lock.release()
+
+        return data
+
+    def _attach(self, entry, object_):
+        for nested in _models(object_):
+            store = nested._pymodel_store
+            if isinstance(store, ObservedStore):
+                # Forget entries of this cache which were dropped meanwhile
+                store.observers[:] = [observer for observer in
+                                      store.observers if
+                                      not isinstance(observer, _Entry) or
+                                      observer.alive]
+                if any(observer is entry for observer in store.observers):
+                    continue
+            if not observe(nested, entry) and nested is object_:
+                entry.frozen_stores.append(store)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        entry.alive = False
+        self._bytes -= entry.size
+
+    def _evict(self):
+        while self._entries and self._bytes > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            entry.alive = False
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def _invalidate_entry(self, entry):
+        self._lock.acquire()
+        try:
+            if self._entries.get(entry.key) is entry:
+                self._drop(entry.key)
+                self.invalidations += 1
+        finally:
+            self._lock.release()
+
+    def invalidate(self, type_, guid, version=None):
+        '''Drop the entries of type_ with the given guid, and version if
+        given'''
+        self._lock.acquire()
+        try:
+            for key in self._entries.keys():
+                if key[0] is type_ and key[1] == guid and \
+                   (version is None or key[2] == version):
+                    self._drop(key)
+                    self.invalidations += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''Drop all entries'''
+        self._lock.acquire()
+        try:
+            for entry in self._entries.itervalues():
+                entry.alive = False
+            self._entries.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        '''Get the statistics of the cache
+
+        @return: Dict with 'hits', 'misses', 'evictions', 'invalidations',
+                 'hit_rate', 'items' and 'bytes'
+        @rtype: dict
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': float(self.hits) / lookups if lookups else None,
+            'items': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,246 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+import logging
+from json.encoder import encode_basestring_ascii
+
+logger = logging.getLogger('pymodel.json')
+
+# Decoding is delegated to the fastest JSON backend available, encoding is
+# done by the compiled encoders below
+try:
+    import ujson
+    _loads = lambda data: ujson.loads(data, precise_float=True)
+    logger.info('Using ujson JSON backend')
+except ImportError:
+    try:
+        import simplejson
+        _loads = simplejson.loads
+        logger.info('Using simplejson JSON backend')
+    except ImportError:
+        import json
+        _loads = json.loads
+
+import pymodel
+from pymodel.fields import EmptyObject
+from pymodel.conversion import dict_to_object, select_attributes, \
+        get_dict_loader
+from pymodel.utils import register_cache_invalidator, get_cached
+from pymodel.pool import new_instance
+
+ENCODER_CACHE = dict()
+
+@register_cache_invalidator
+def _invalidate_cache(types):
+    for key in ENCODER_CACHE.keys():
+        if key[0] in types:
+            ENCODER_CACHE.pop(key, None)
+
+def _encode_float(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return 'Infinity'
+    if value == float('-inf'):
+        return '-Infinity'
+    return repr(value)
+
+def _encode_bool(value):
+    return 'true' if value else 'false'
+
+def _encode_datetime(value):
+    return encode_basestring_ascii(value.isoformat())
+
+def _encode_object(value):
+    if isinstance(value, EmptyObject):
+        return None
+    return get_encoder(type(value))(value)
+
+def _list_encoder(attr):
+    encoder = ITEM_ENCODERS[type(attr.type_)](attr.type_)
+    return lambda value: '[%s]' % ','.join([encoder(item) for item in
+                                            value._list])
+
+def _dict_encoder(attr):
+    encoder = ITEM_ENCODERS[type(attr.type_)](attr.type_)
+    return lambda value: '{%s}' % ','.join([
+        '%s:%s' % (encode_basestring_ascii(key), encoder(item)) for
+        (key, item) in value._dict.iteritems()])
+
+ITEM_ENCODERS = {
+    pymodel.String: lambda a: encode_basestring_ascii,
+    pymodel.Enumeration: lambda a: encode_basestring_ascii,
+    pymodel.GUID: lambda a: encode_basestring_ascii,
+    pymodel.Integer: lambda a: '%d'.__mod__,
+    pymodel.Float: lambda a: _encode_float,
+    pymodel.Boolean: lambda a: _encode_bool,
+    pymodel.List: _list_encoder,
+    pymodel.Dict: _dict_encoder,
+    pymodel.Object: lambda a: _encode_object,
+    pymodel.DateTime: lambda a: _encode_datetime,
+}
+
+# Every compiler returns an (encoder, default) tuple, the default is used
+# when the model store holds no value for the field
+FIELD_ENCODERS = {
+    pymodel.String: lambda a: (encode_basestring_ascii, None),
+    pymodel.Enumeration: lambda a: (
+        lambda o: encode_basestring_ascii(o) if o else None, None),
+    pymodel.GUID: lambda a: (encode_basestring_ascii, None),
+    pymodel.Integer: lambda a: ('%d'.__mod__, None),
+    pymodel.Float: lambda a: (_encode_float, None),
+    pymodel.Boolean: lambda a: (_encode_bool, None),
+    pymodel.List: lambda a: (_list_encoder(a), a.listtype()),
+    pymodel.Dict: lambda a: (_dict_encoder(a), a.dicttype()),
+    pymodel.Object: lambda a: (_encode_object, None),
+    pymodel.DateTime: lambda a: (_encode_datetime, None),
+}
+
+def _compile_encoder(type_, fields):
+    logger.info('Compiling JSON encoder for %s' % type_.__name__)
+
+    steps = list()
+    for attribute in select_attributes(type_, fields):
+        attr = attribute.attribute
+        encoder, default = FIELD_ENCODERS[type(attr)](attr)
+        steps.append((attribute.name, '%s:' % encode_basestring_ascii(
+            attribute.name), encoder, default))
+    steps = tuple(steps)
+
+    def encode(object_):
+        store = object_._pymodel_store
+        parts = list()
+
+        for name, prefix, encoder, default in steps:
+            value = store.get(name, default)
+            if value is None:
+                continue
+
+            value = encoder(value)
+            if value is None:
+                continue
+
+            parts.append(prefix + value)
+
+        return '{%s}' % ','.join(parts)
+
+    return encode
+
+def get_encoder(type_, fields=None):
+    '''Get the compiled JSON encoder for a model type
+
+    @param type_: Model type
+    @type type_: type
+    @param fields: Names of the fields to include, or None to include all
+    @type fields: iterable
+
+    @return: Function encoding an instance of type_ into a JSON string
+    @rtype: callable
+    '''
+    key = (type_, frozenset(fields) if fields is not None else None)
+    return get_cached(ENCODER_CACHE, key, _compile_encoder, type_, key[1])
+
+
+class JSONSerializer(object):
+    NAME = 'json'
+
+    @staticmethod
+    def serialize(object_, fields=None):
+        return get_encoder(type(object_), fields)(object_)
+
+    @staticmethod
+    def deserialize(type_, data):
+        return dict_to_object(new_instance(type_), _loads(data))
+
+    @staticmethod
+    def prepare(type_):
+        '''Compile the cached encoder and loader of a type'''
+        get_encoder(type_)
+        get_dict_loader(type_)
+
+    @staticmethod
+    def serialize_many(objects, stream=None, fields=None):
+        '''Serialize a sequence of objects as JSON Lines
+
+        Every object is encoded on a line of its own. If a stream is given,
+        lines are written to it as soon as they are encoded.
+
+        @param objects: Objects to serialize
+        @type objects: iterable
+        @param stream: File-like object to write to
+        @type stream: file
+        @param fields: Names of the fields to include, or None to include all
+        @type fields: iterable
+
+        @return: The JSON Lines data if no stream was given, None otherwise
+        @rtype: string
+        '''
+        type_, encoder = None, None
+        lines = list() if stream is None else None
+
+        for object_ in objects:
+            if type(object_) is not type_:
+                type_ = type(object_)
+                encoder = get_encoder(type_, fields)
+            line = encoder(object_) + '\n'
+
+            if stream is not None:
+                stream.write(line)
+            else:
+                lines.append(line)
+
+        if lines is not None:
+            return ''.join(lines)
+
+    @staticmethod
+    def deserialize_iter(type_, data):
+        '''Deserialize all objects in a JSON Lines stream
+
+        @param type_: Type of the objects in the stream
+        @type type_: type
+        @param data: JSON Lines data, as a string or a file-like object
+        @type data: string
+
+        @return: Generator yielding one object per line
+        @rtype: generator
+        '''
+        if isinstance(data, basestring):
+            data = data.splitlines()
+
+        for line in data:
+            line = line.strip()
+            if not line:
+                continue
+            yield dict_to_object(new_instance(type_), _loads(line))
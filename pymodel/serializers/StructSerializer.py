@@ -0,0 +1,246 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Fixed-layout binary serializer for flat models
+
+Models holding only scalar fields (integers, floats, booleans, GUIDs,
+enumerations and short strings) are packed into a single C{struct.Struct}
+compiled once per model type. The layout is::
+
+    presence bitmap | fixed-size field values | string data
+
+The bitmap has one bit per field, in field name order. Numbers are stored
+in place, strings by their length in the fixed part and their UTF-8 bytes
+in the variable-length tail.
+'''
+
+import struct
+import logging
+
+logger = logging.getLogger('pymodel.struct')
+
+import pymodel
+from pymodel.utils import register_cache_invalidator, get_cached
+from pymodel.pool import new_instance
+
+LAYOUT_CACHE = dict()
+
+@register_cache_invalidator
+def _invalidate_cache(types):
+    for type_ in types:
+        LAYOUT_CACHE.pop(type_, None)
+
+MAX_STRING_LENGTH = 0xffff
+
+_COUNT = struct.Struct('<I')
+
+# Struct format code, default value and string flag per supported field type
+FLAT_FIELD_TYPES = {
+    pymodel.Integer: ('q', 0, False),
+    pymodel.Float: ('d', 0.0, False),
+    pymodel.Boolean: ('?', False, False),
+    pymodel.String: ('H', 0, True),
+    pymodel.GUID: ('H', 0, True),
+    pymodel.Enumeration: ('H', 0, True),
+}
+
+
+class StructLayout(object):
+    '''Compiled binary layout of a flat model type'''
+
+    def __init__(self, type_):
+        logger.info('Compiling struct layout for %s' % type_.__name__)
+
+        self.type_ = type_
+
+        attributes = sorted(type_.PYMODEL_MODEL_INFO.attributes,
+                            key=lambda attribute: attribute.name)
+
+        fields = list()
+        codes = list()
+        for attribute in attributes:
+            attr = attribute.attribute
+            try:
+                code, default, is_string = FLAT_FIELD_TYPES[type(attr)]
+            except KeyError:
+                raise TypeError('%s is not a flat model, field %s is of type '
+                                '%s' % (type_.__name__, attribute.name,
+                                        type(attr).__name__))
+
+            fields.append((attribute.name, default, is_string))
+            codes.append(code)
+
+        self.fields = tuple(fields)
+        self.words = max(1, (len(fields) + 63) // 64)
+        self.struct = struct.Struct('<%s%s' % ('Q' * self.words,
+                                               ''.join(codes)))
+
+    def pack(self, object_):
+        '''Pack an instance into a string'''
+        store = object_._pymodel_store
+        bitmap = 0
+        values = list()
+        tail = list()
+
+        for index, (name, default, is_string) in enumerate(self.fields):
+            value = store.get(name)
+            if value is None or (is_string and not value):
+                values.append(default)
+                continue
+
+            bitmap |= 1 << index
+
+            if is_string:
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                if len(value) > MAX_STRING_LENGTH:
+                    raise ValueError('Value of %s too long for struct '
+                                     'serialization' % name)
+                tail.append(value)
+                value = len(value)
+
+            values.append(value)
+
+        words = [(bitmap >> (64 * word)) & 0xffffffffffffffff for word in
+                 xrange(self.words)]
+
+        return self.struct.pack(*(words + values)) + ''.join(tail)
+
+    def unpack(self, data, offset=0):
+        '''Unpack an instance from a string
+
+        @return: Tuple of the instance and the offset right after it
+        @rtype: tuple
+        '''
+        values = self.struct.unpack_from(data, offset)
+        offset += self.struct.size
+
+        bitmap = 0
+        for word in xrange(self.words):
+            bitmap |= values[word] << (64 * word)
+
+        object_ = new_instance(self.type_)
+        store = object_._pymodel_store
+
+        for index, (name, default, is_string) in enumerate(self.fields):
+            if not bitmap & (1 << index):
+                continue
+
+            value = values[self.words + index]
+            if is_string:
+                end = offset + value
+                value = data[offset:end]
+                offset = end
+
+            store[name] = value
+
+        return object_, offset
+
+
+def get_layout(type_):
+    '''Get the compiled struct layout of a flat model type
+
+    @raise TypeError: type_ contains fields which can't be packed
+    '''
+    return get_cached(LAYOUT_CACHE, type_, StructLayout, type_)
+
+
+class StructSerializer(object):
+    NAME = 'struct'
+
+    @staticmethod
+    def serialize(object_):
+        return get_layout(type(object_)).pack(object_)
+
+    @staticmethod
+    def deserialize(type_, data):
+        return get_layout(type_).unpack(data)[0]
+
+    @staticmethod
+    def prepare(type_):
+        '''Compile the cached layout of a type, if it is flat'''
+        try:
+            get_layout(type_)
+        except TypeError:
+            pass
+
+    @staticmethod
+    def serialize_many(objects):
+        '''Pack a list of instances of one type into one contiguous buffer
+
+        @param objects: Instances to pack, all of the same type
+        @type objects: list
+
+        @return: Packed instances, prefixed by their count
+        @rtype: string
+        '''
+        if not objects:
+            return _COUNT.pack(0)
+
+        type_ = type(objects[0])
+        layout = get_layout(type_)
+
+        parts = [_COUNT.pack(len(objects))]
+        for object_ in objects:
+            if type(object_) is not type_:
+                raise TypeError('All objects should be of type %s' %
+                                type_.__name__)
+            parts.append(layout.pack(object_))
+
+        return ''.join(parts)
+
+    @staticmethod
+    def deserialize_many(type_, data):
+        '''Unpack a buffer created by L{serialize_many}
+
+        @param type_: Type of the packed instances
+        @type type_: type
+        @param data: Packed instances
+        @type data: string
+
+        @return: Unpacked instances
+        @rtype: list
+        '''
+        layout = get_layout(type_)
+
+        count, = _COUNT.unpack_from(data, 0)
+        offset = _COUNT.size
+
+        objects = list()
+        for _ in xrange(count):
+            object_, offset = layout.unpack(data, offset)
+            objects.append(object_)
+
+        return objects
@@ -34,7 +34,7 @@
 # </License>
 
 import base64
-from pymodel.serializers import ThriftSerializer
+from pymodel.serializers._thrift import ThriftSerializer
 
 class ThriftBase64Serializer(ThriftSerializer):
     
@@ -49,3 +49,8 @@ class ThriftBase64Serializer(ThriftSerializer):
     def deserialize(cls, type_, data):
         data = base64.decodestring(data)
         return ThriftSerializer.deserialize(type_, data)
+
+    @classmethod
+    def peek_identity(cls, type_, data):
+        return ThriftSerializer.peek_identity(type_,
+                                              base64.decodestring(data))
@@ -33,222 +33,200 @@
 # 
 # </License>
     
-import xml.dom.minidom as dom
-import pymodel.model
-from pymodel.fields import EmptyObject
-from pymonkey.baseclasses.BaseEnumeration import BaseEnumeration
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+from cStringIO import StringIO
+from xml.sax.saxutils import escape
+
+import pymodel
+from pymodel.model import Model
+from pymodel.fields import WrappedList, WrappedDict
+from pymodel.conversion import dict_to_object, datetime_from_data, \
+        select_attributes, get_dict_loader
+from pymodel.utils import register_cache_invalidator, get_cached
+from pymodel.pool import new_instance
+
+# Size of the chunks yielded by iterpickle
+CHUNK_SIZE = 64 * 1024
+
+PICKLE_STEPS_CACHE = dict()
+
+@register_cache_invalidator
+def _invalidatePickleSteps(types):
+    for key in PICKLE_STEPS_CACHE.keys():
+        if key[0] in types:
+            PICKLE_STEPS_CACHE.pop(key, None)
 
 class XMLUnpicklingException:
     pass
 
-def getType(obj):
-    """ generates string representation of class of obj 
-        discarding decoration """
-    return str(obj.__class__).split("'")[1].split(".")[-1]
-
-def handle_list(attr, value):
-    data = list()
-    type_handler = TYPE_HANDLERS[type(attr.type_)]
-    for item in value:
-        data.append(type_handler(None, item))
-
-    return data
-
-def handle_dict(attr, value):
-    data = dict()
-    type_handler = TYPE_HANDLERS[type(attr.type_)]
-    for k, v in value.iteritems():
-        data[k] = type_handler(None, v)
-
-    return data
-
-
-def enum_to_string(obj):
-    if isinstance(obj, BaseEnumeration):
-        #TODO Get rid of protected lookup
-        return getattr(obj, '_pm_enumeration_name')
-
-
-TYPE_HANDLERS = {
-    pymodel.String: lambda a, o: o,
-    pymodel.Enumeration: lambda a, o: enum_to_string(o),
-    pymodel.GUID: lambda a, o: o,
-    pymodel.Integer: lambda a, o: o,
-    pymodel.Float: lambda a, o: o,
-    pymodel.Boolean: lambda a, o: o,
-    pymodel.List: handle_list,
-    pymodel.Dict: handle_dict,
-    pymodel.Object: lambda a, o: object_to_dict(o),
-    pymodel.DateTime: lambda a, o: o,
+# Constructors for the leaf value types found in the 'type' attribute
+UNPICKLE_TYPES = {
+    'str': lambda text: text,
+    'unicode': unicode,
+    'int': int,
+    'long': long,
+    'float': float,
+    'bool': lambda text: text == 'True',
+    'NoneType': lambda text: None,
+    'datetime': datetime_from_data,
 }
 
-
-def object_to_dict(object_):
-    if isinstance(object_, EmptyObject):
-        return None
-
-    data = dict()
-    spec = type(object_).PYMODEL_MODEL_INFO
-
-    for attribute in spec.attributes:
+def _unpickleValue(typeName, text):
+    try:
+        constructor = UNPICKLE_TYPES[typeName]
+    except KeyError:
+        raise XMLUnpicklingException()
+    return constructor(text)
+
+def _pickleLeaf(elementName, value):
+    """ returns the XML representation of a leaf value """
+    if isinstance(value, unicode):
+        text = value
+    elif isinstance(value, float):
+        text = repr(value)
+    else:
+        text = str(value)
+    return '<%s type="%s">%s</%s>' % (elementName, type(value).__name__,
+                                      escape(text), elementName)
+
+def _getPickleSteps(type_, fields):
+    """ returns (name, default, skipEmpty) tuples for the fields of type_ """
+    key = (type_, frozenset(fields) if fields is not None else None)
+    return get_cached(PICKLE_STEPS_CACHE, key, _compilePickleSteps, type_,
+                      key[1])
+
+def _compilePickleSteps(type_, fields):
+    steps = list()
+    for attribute in select_attributes(type_, fields):
         attr = attribute.attribute
-
-        try:
-            value = getattr(object_, attr.name)
-        except AttributeError:
-            value = None
-
-        if value is None:
-            continue
-
-        handler = TYPE_HANDLERS[type(attr)]
-
-        value = handler(attr, value)
-        if value is None:
+        if isinstance(attr, pymodel.List):
+            default = attr.listtype()
+        elif isinstance(attr, pymodel.Dict):
+            default = attr.dicttype()
+        else:
+            default = None
+        skipEmpty = isinstance(attr, (pymodel.Enumeration, pymodel.Object))
+        steps.append((attribute.name, default, skipEmpty))
+
+    return tuple(steps)
+
+def _iterpickleModel(object_, fields=None):
+    """ yields the XML representation of the items of a model instance """
+    store = object_._pymodel_store
+    for name, default, skipEmpty in _getPickleSteps(type(object_), fields):
+        value = store.get(name, default)
+        if value is None or (skipEmpty and not value):
             continue
+        yield '<item>%s' % _pickleLeaf("key", name)
+        for chunk in _iterpickleValue(value):
+            yield chunk
+        yield '</item>'
+
+def _iterpickleValue(value):
+    """ yields the XML representation of a value element """
+    if isinstance(value, Model):
+        yield '<value type="dict">'
+        for chunk in _iterpickleModel(value):
+            yield chunk
+        yield '</value>'
+    elif isinstance(value, WrappedList):
+        yield '<value type="list">'
+        for item in value._list:
+            yield '<item>'
+            for chunk in _iterpickleValue(item):
+                yield chunk
+            yield '</item>'
+        yield '</value>'
+    elif isinstance(value, WrappedDict):
+        yield '<value type="dict">'
+        for key, item in value._dict.iteritems():
+            yield '<item>%s' % _pickleLeaf("key", key)
+            for chunk in _iterpickleValue(item):
+                yield chunk
+            yield '</item>'
+        yield '</value>'
+    else:
+        yield _pickleLeaf("value", value)
+
+def iterpickle(object_, fields=None):
+    """ yields the XML representation of a model instance in chunks
+
+    The model is walked once, chunks of about CHUNK_SIZE characters are
+    yielded as soon as they are complete. Every field is an <item> holding a
+    <key> and a <value> element, both typed by their 'type' attribute. """
+    buffer = ['<root>']
+    size = 0
+    for chunk in _iterpickleModel(object_, fields):
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = list()
+            size = 0
+    buffer.append('</root>')
+    yield ''.join(buffer)
+
+def iterunpickle(source):
+    """ unpickles the root dictionary of an XML document while it is parsed
+
+    Elements are released as soon as their value has been consumed, so only
+    the values built so far and the elements currently open are kept in
+    memory. """
+
+    # Open elements as (element, typeName) tuples
+    elements = list()
+    # Open containers as [container, key, value] lists
+    containers = list()
+
+    for event, element in etree.iterparse(source, events=("start", "end")):
+        tag = element.tag
+
+        if event == "start":
+            if not elements:
+                typeName = "dict"
+            else:
+                typeName = element.get("type")
 
-        data[attr.name] = value
-
-    return data
-
-
-def load_dict(attr, data):
-    result = dict()
-    type_ = attr.type_
-    handler = TYPE_SET_HANDLERS[type(type_)]
-
-    for key, value in data.iteritems():
-        result[key] = handler(type_, value)
-
-    return result
-
-def load_list(attr, data):
-    result = list()
-    type_ = attr.type_
-    handler = TYPE_SET_HANDLERS[type(type_)]
-
-    for item in data:
-        result.append(handler(type_, item))
-
-    return result
-
-TYPE_SET_HANDLERS = {
-    pymodel.String: lambda a, o: o,
-    pymodel.Enumeration: lambda a, o: o,
-    pymodel.GUID: lambda a, o: o,
-    pymodel.Integer: lambda a, o: o,
-    pymodel.Float: lambda a, o: o,
-    pymodel.Boolean: lambda a, o: o,
-    pymodel.Dict: load_dict,
-    pymodel.Object: lambda a, o: dict_to_object(a.type_(), o),
-    pymodel.List: load_list,
-    pymodel.DateTime: lambda a, o:o,
-}
-
-def dict_to_object(object_, data):
-    spec = type(object_).PYMODEL_MODEL_INFO
-
-    for attribute in spec.attributes:
-        attr = attribute.attribute
-
-        try:
-            value = data[attr.name]
-        except KeyError:
+            if typeName == "dict":
+                containers.append([dict(), None, None])
+            elif typeName == "list":
+                containers.append([list(), None, None])
+            elements.append((element, typeName))
             continue
 
-        if value is None:
-            continue
+        typeName = elements.pop()[1]
 
-        handler = TYPE_SET_HANDLERS[type(attr)]
+        if not elements:
+            return containers.pop()[0]
 
-        value = handler(attr, value)
-        if value is None:
+        if tag == "item":
+            frame = containers[-1]
+            if isinstance(frame[0], dict):
+                frame[0][frame[1]] = frame[2]
+            frame[1] = frame[2] = None
+            elements[-1][0].clear()
             continue
 
-        setattr(object_, attr.name, value)
-
-    return object_
-
-def pickle(root, fabric, elementName="root"):
-
-    node = fabric.createElement(elementName)
-    typeStr = getType(root)
-    node.attributes["type"]=typeStr
-    if isinstance(root, (list,dict)):
-        if len(root) == 0:
-            node.appendChild(fabric.createTextNode(""))
+        if typeName in ("dict", "list"):
+            value = containers.pop()[0]
         else:
-            if isinstance(root, dict):
-                pickleDictItems(root, node, fabric)
+            value = _unpickleValue(typeName, (element.text or "").strip())
+
+        frame = containers[-1]
+        if tag == "key":
+            frame[1] = value
+        elif tag == "value":
+            if isinstance(frame[0], list):
+                frame[0].append(value)
             else:
-                pickleList(root, node, fabric)
-    else:
-        node.appendChild(fabric.createTextNode(str(root)))
-
-    return node
-
-def pickleList(root, parentnode, fabric):
-    for value in root:
-        tempnode = fabric.createElement("item")
-        tempnode.appendChild(pickle(value, fabric, "value"))
-        parentnode.appendChild(tempnode)
-
-def pickleDictItems(root, parentnode, fabric):
-    for key, value in root.items():
-        tempnode = fabric.createElement("item")
-        tempnode.appendChild(pickle(key, fabric, "key"))
-        tempnode.appendChild(pickle(value, fabric, "value"))
-        parentnode.appendChild(tempnode)
-
-def _getElementChilds(node, doLower = 1):
-    """ returns list of (tagname, element) for all element childs of node """
-
-    dolow = doLower and (lambda x:x.lower()) or (lambda x:x)
-    return [ (dolow(no.tagName), no) for no in node.childNodes if no.nodeType != no.TEXT_NODE ]
-
-def _getText(nodelist):
-    """ returns collected and stripped text of textnodes among nodes in nodelist """
-    rc = ""
-    for node in nodelist:
-        if node.nodeType == node.TEXT_NODE:
-            rc = rc + node.data
-    return rc.strip()
-
-def unpickleList(nodes):
-    l = list()
-    for node in nodes:
-        for name, element in _getElementChilds(node):
-            if name != "value":
-                raise XMLUnpicklingException()
-            l.append(unpickle(element))
-    return l
-
-def unpickle(node):
-    typeName= node.attributes["type"].value
-    print typeName
-    if typeName == "list":
-        return unpickleList(node.childNodes)
-    elif typeName == "dict":
-        return unpickleDict(node)
-    initValue = _getText(node.childNodes)
-    value = eval("%s(%r)" % (typeName, initValue))
-    return value
-
-def unpickleDict(node):
-    dd = dict()
-    for name, element in _getElementChilds(node):
-        if name != "item":
-            raise XMLUnpicklingException()
-        childList = _getElementChilds(element)
-        if len(childList) != 2:
+                frame[2] = value
+        else:
             raise XMLUnpicklingException()
-        for name, element in childList:
-            if name=="key":
-                key = unpickle(element)
-            elif name=="value":
-                value = unpickle(element)
-        dd[key]=value
-    return dd 
+
+    raise XMLUnpicklingException()
 
 
 
@@ -258,17 +236,32 @@ class XMLSerializer(object):
     NAME = 'xml'
     
     @classmethod
-    def serialize(cls, data):    
-        data = object_to_dict(data)
-        fabric = dom.Document()
-        node = fabric.createElement("root")
-        pickleDictItems(data, node, fabric)
-        return  node.toxml()
+    def serialize(cls, data, fields=None):
+        return ''.join(iterpickle(data, fields))
+
+    @classmethod
+    def serialize_to(cls, data, stream, fields=None):
+        """ writes the XML representation of data to a file-like object
+
+        Unicode chunks are written UTF-8 encoded. """
+        for chunk in iterpickle(data, fields):
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            stream.write(chunk)
             
     @classmethod
-    def deserialize(cls, type_, data):   
-        object_ = type_()     
-        data = dom.parseString(data).firstChild
-        data = unpickleDict(data)
+    def prepare(cls, type_):
+        """ compiles the cached pickle steps and loader of a type """
+        _getPickleSteps(type_, None)
+        get_dict_loader(type_)
+
+    @classmethod
+    def deserialize(cls, type_, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if isinstance(data, str):
+            data = StringIO(data)
+        object_ = new_instance(type_)
+        data = iterunpickle(data)
         dict_to_object(object_, data)
         return object_
@@ -33,68 +33,289 @@
 #
 # </License>
 
+'''Serializer registry
+
+Concurrent use
+==============
+
+All serializers can be used from several threads at the same time. The
+per-type information they compile on first use (thrift specs, encoders,
+converters, layouts) is cached without locking on lookup; compiling it is
+serialized by L{pymodel.utils.CACHE_LOCK}, so threads using a new type at
+the same time wait for one complete compilation instead of racing.
+
+Thread-pool servers should call L{warm_caches} at startup, after the model
+domains were initialized. All information is compiled up front, and request
+threads never take the compilation lock.
+
+Thread pools mainly help to overlap serialization with I/O: both the pure
+Python and the C-accelerated (fastbinary) thrift codecs hold the GIL while
+encoding or decoding, so CPU-bound serialization doesn't run in parallel on
+threads. Use the process pool functions in L{pymodel.serializers.parallel}
+to spread bulk serialization over several cores. The stress benchmark
+(C{python -m pymodel.benchmark --threads 8}) verifies thread safety and
+shows the scaling of every serializer.
+'''
+
+import sys
+import types
 import logging
 logger = logging.getLogger('pymodel.serializers')
 
-# Dictionary containing all known serializers
+# Entry point group scanned for serializers provided by other packages
+PLUGIN_ENTRY_POINT_GROUP = 'pymodel.serializers'
+
+
+class LazySerializer(object):
+    '''Registry entry which imports its serializer on first use
+
+    Attribute lookups are forwarded to the serializer class, so an entry can
+    be used wherever the class itself is expected, e.g.
+    C{SERIALIZERS['thrift'].serialize(obj)}.
+    '''
+    def __init__(self, target):
+        '''Initialize a new lazy serializer entry
+
+        @param target: Location of the serializer class, as
+                       'package.module:ClassName'
+        @type target: string
+        '''
+        self._target = target
+        self._serializer = None
+
+    def load(self):
+        '''Import the serializer class
+
+        @raise ImportError: The serializer is not available on this system
+        '''
+        if self._serializer is not None:
+            return self._serializer
+
+        module_name, _, class_name = self._target.partition(':')
+        logger.info('Loading serializer %s' % self._target)
+
+        module = __import__(module_name, fromlist=[class_name])
+        try:
+            serializer = getattr(module, class_name)
+        except AttributeError:
+            raise ImportError('%s not available' % self._target)
+
+        self._serializer = serializer
+        return serializer
+
+    def available(self):
+        '''Check whether the serializer can be loaded'''
+        try:
+            self.load()
+        except ImportError, e:
+            logger.info('Unable to load serializer %s: %s' % (self._target,
+                                                               e))
+            return False
+        return True
+
+    def __getattr__(self, name):
+        value = getattr(self.load(), name)
+        # Cache the attribute, next lookups won't hit __getattr__ again
+        setattr(self, name, value)
+        return value
+
+    def __repr__(self):
+        return '<LazySerializer %s>' % self._target
+
+
+class SerializerRegistry(dict):
+    '''Dictionary of serializers by name
+
+    Values are serializer classes or L{LazySerializer} entries. When an
+    unknown name is looked up, serializers registered by other packages
+    through the 'pymodel.serializers' entry point group are loaded first.
+
+    Entries are registered whether or not their serializer can be imported
+    on this system (e.g. '_ThriftOptimized' requires fastbinary): using an
+    entry which can't be loaded raises ImportError. Use L{available} to get
+    the names of the usable serializers instead of iterating the registry.
+    '''
+    def __init__(self):
+        dict.__init__(self)
+        self._plugins_loaded = False
+
+    def register(self, name, target):
+        '''Register a serializer
+
+        @param name: Name of the serializer
+        @type name: string
+        @param target: Serializer class, or its location as
+                       'package.module:ClassName' to import it lazily
+        @type target: object
+        '''
+        if isinstance(target, basestring):
+            target = LazySerializer(target)
+        self[name] = target
+        return target
+
+    def load_plugins(self):
+        '''Register all serializers provided through entry points'''
+        if self._plugins_loaded:
+            return
+        self._plugins_loaded = True
+
+        try:
+            import pkg_resources
+        except ImportError:
+            logger.info('No entry point support, not loading plugins')
+            return
+
+        for entry_point in pkg_resources.iter_entry_points(
+                PLUGIN_ENTRY_POINT_GROUP):
+            logger.info('Registering serializer plugin %s' % entry_point.name)
+            self.setdefault(entry_point.name, LazySerializer('%s:%s' % (
+                entry_point.module_name, '.'.join(entry_point.attrs))))
+
+    def available(self):
+        '''Get the names of all serializers which can be loaded'''
+        self.load_plugins()
+        return [name for (name, serializer) in self.iteritems() if
+                not isinstance(serializer, LazySerializer) or
+                serializer.available()]
+
+    def __missing__(self, name):
+        if not self._plugins_loaded:
+            self.load_plugins()
+            if dict.__contains__(self, name):
+                return self[name]
+        raise KeyError(name)
+
+
+# Dictionary containing all known serializers, see SerializerRegistry.available
+# for the ones which can be used on this system.
 # Keys starting with an underscore are considered to be testing serializers
-SERIALIZERS = dict()
-
-__all__ = ['SERIALIZERS', ]
-
-try:
-    from ._thrift import ThriftSerializer
-    logger.info('Loaded Thrift serializer')
-    __all__.append('ThriftSerializer')
-    SERIALIZERS[ThriftSerializer.NAME] = ThriftSerializer
-except ImportError, e:
-    logger.info('Unable to load Thrift serializer: %s' % e)
-else:
-    # Thrift is supported, let's try to load the test implementations
-    # Thrift is a special case since we got 2 serializers to test:
-    #
-    # * An optimized one (using fastbinary.so)
-    # * A native Python one
-    try:
-        from ._thrift import OptimizedSerializer
-        logger.debug('Loaded optimized Thrift serializer')
-        SERIALIZERS[OptimizedSerializer.NAME] = OptimizedSerializer
-    except ImportError, e:
-        logger.debug('Unable to load optimized Thrift serializer: %s' % e)
-
-    try:
-        from ._thrift import NativeSerializer
-        logger.debug('Loaded native Thrift serializer')
-        SERIALIZERS[NativeSerializer.NAME] = NativeSerializer
-    except ImportError, e:
-        logger.debug('Unable to load native Thrift serializer: %s' % e)
-
-
-try:
-    from .pymodelyaml import YamlSerializer
-    logger.info('Loaded YAML serializer')
-    __all__.append('YamlSerializer')
-    SERIALIZERS[YamlSerializer.NAME] = YamlSerializer
-    SERIALIZERS['_%s' % YamlSerializer.NAME] = YamlSerializer
-except ImportError, e:
-    logger.info('Unable to load YAML serializer: %s' % e)
-
-
-try:
-    from .XMLSerializer import XMLSerializer
-    logger.info('Loaded XML serializer')
-    __all__.append('XMLSerializer')
-    SERIALIZERS[XMLSerializer.NAME] = XMLSerializer
-    SERIALIZERS['_%s' % XMLSerializer.NAME] = XMLSerializer
-except ImportError, e:
-    logger.info('Unable to load XML serializer: %s' % e)
-    
-    
-try:
-    from .ThriftBase64Serializer import ThriftBase64Serializer
-    logger.info('Loaded thriftbase64 serializer')
-    __all__.append('ThriftBase64Serializer')
-    SERIALIZERS[ThriftBase64Serializer.NAME] = ThriftBase64Serializer
-    SERIALIZERS['_%s' % ThriftBase64Serializer.NAME] = ThriftBase64Serializer
-except ImportError, e:
-    logger.info('Unable to load thriftbase64 serializer: %s' % e)
\ No newline at end of file
+SERIALIZERS = SerializerRegistry()
+
+def register_serializer(name, target):
+    '''Register a serializer in L{SERIALIZERS}, see
+    L{SerializerRegistry.register}'''
+    return SERIALIZERS.register(name, target)
+
+__all__ = ['SERIALIZERS', 'register_serializer', ]
+
+# Module level names of the shipped serializer classes, see _alias_property
+_ALIASES = dict()
+
+# Serializers shipped with pymodel. Thrift is a special case since we got 2
+# serializers to test:
+#
+# * An optimized one (using fastbinary.so)
+# * A native Python one
+for _name, _target, _alias in (
+        ('thrift', '_thrift:ThriftSerializer', 'ThriftSerializer'),
+        ('_ThriftOptimized', '_thrift:OptimizedSerializer', None),
+        ('_ThriftNative', '_thrift:NativeSerializer', None),
+        ('thriftfp', '_thrift:FingerprintSerializer',
+         'FingerprintSerializer'),
+        ('yaml', 'pymodelyaml:YamlSerializer', 'YamlSerializer'),
+        ('_yaml', 'pymodelyaml:YamlSerializer', None),
+        ('json', 'JSONSerializer:JSONSerializer', 'JSONSerializer'),
+        ('_json', 'JSONSerializer:JSONSerializer', None),
+        ('struct', 'StructSerializer:StructSerializer', 'StructSerializer'),
+        ('xml', 'XMLSerializer:XMLSerializer', 'XMLSerializer'),
+        ('_xml', 'XMLSerializer:XMLSerializer', None),
+        ('thriftbase64', 'ThriftBase64Serializer:ThriftBase64Serializer',
+         'ThriftBase64Serializer'),
+        ('_thriftbase64', 'ThriftBase64Serializer:ThriftBase64Serializer',
+         None),
+    ):
+    _entry = register_serializer(_name, '%s.%s' % (__name__, _target))
+    if _alias:
+        _ALIASES[_alias] = _entry
+        __all__.append(_alias)
+
+del _name, _target, _alias, _entry
+
+
+def _reachable_types(types):
+    '''Get the given model types and all types nested in them'''
+    import pymodel
+
+    def field_types(attr):
+        if isinstance(attr, pymodel.Object):
+            yield attr.type_
+        elif isinstance(attr, (pymodel.List, pymodel.Dict, )):
+            for type_ in field_types(attr.type_):
+                yield type_
+
+    found = list()
+    pending = list(types)
+    while pending:
+        type_ = pending.pop()
+        if type_ in found:
+            continue
+        found.append(type_)
+        for attribute in type_.PYMODEL_MODEL_INFO.attributes:
+            pending.extend(field_types(attribute.attribute))
+    return found
+
+def warm_caches(types=None, serializers=None):
+    '''Compile the cached per-type information of serializers up front
+
+    Serializers providing a C{prepare(type_)} method are asked to compile
+    everything they need for every type. Types nested in the given types
+    are prepared as well.
+
+    @param types: Model types, defaults to the root object types of all
+                  initialized domains (importing lazily loaded ones)
+    @type types: iterable
+    @param serializers: Names of the serializers to prepare, defaults to
+                        all available ones
+    @type serializers: iterable
+
+    @return: Number of prepared types
+    @rtype: int
+    '''
+    if types is None:
+        import pymodel
+        types = list()
+        for domain_types in pymodel.ROOTOBJECT_TYPES.itervalues():
+            types.extend(domain_types.values())
+
+    types = _reachable_types(types)
+
+    for name in serializers or SERIALIZERS.available():
+        prepare = getattr(SERIALIZERS[name], 'prepare', None)
+        if prepare is None:
+            continue
+        logger.info('Preparing serializer %s for %d types' % (name,
+                                                              len(types)))
+        for type_ in types:
+            prepare(type_)
+
+    return len(types)
+
+__all__.append('warm_caches')
+
+
+def _alias_property(alias):
+    '''Module attribute giving the serializer class of an alias, importing
+    it on first access'''
+    def get(module):
+        value = module.__dict__.get(alias)
+        # Importing a submodule binds it on the package, under the same name
+        # as its serializer class for most of them
+        if value is None or isinstance(value, types.ModuleType):
+            value = _ALIASES[alias].load()
+        return value
+
+    def set_(module, value):
+        module.__dict__[alias] = value
+
+    return property(get, set_)
+
+# Modules can't have properties, replace this module by an instance of a
+# module type which has them. The original module is kept alive, since its
+# globals are used by everything defined above.
+_SerializersModule = type('_SerializersModule', (types.ModuleType, ), dict(
+    (alias, _alias_property(alias)) for alias in _ALIASES))
+
+_module = _SerializersModule(__name__, __doc__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
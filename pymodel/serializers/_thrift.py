@@ -33,6 +33,8 @@
 #
 # </License>
 
+import struct
+import hashlib
 import logging
 
 from thrift.Thrift import TType
@@ -51,10 +53,21 @@ except ImportError:
     logger.info('No PyMonkey Enumeration support')
     BaseEnumeration = None
 
-from pymodel.model import DEFAULT_FIELDS
+from pymodel.model import DEFAULT_FIELDS, GUIDField, VersionField
+from pymodel.utils import register_cache_invalidator, get_cached
+from pymodel.pool import new_instance
+from pymodel.interning import intern_string, intern_field
 import pymodel
 
 TYPE_SPEC_CACHE = dict()
+FINGERPRINT_CACHE = dict()
+READ_PLAN_CACHE = dict()
+
+@register_cache_invalidator
+def _invalidate_spec_cache(types):
+    for type_ in types:
+        for cache in (TYPE_SPEC_CACHE, FINGERPRINT_CACHE, READ_PLAN_CACHE):
+            cache.pop(type_.PYMODEL_MODEL_INFO, None)
 
 # DATETIME type. Note that the value below needs to be modified keeping in mind the values ( for other types ) given in
 # 'thrift_python' q-package.( TType module ). The value below should not match any of the existing Thrift types.
@@ -101,36 +114,40 @@ FIELD_TYPE_THRIFT_TYPE_MAP = {
     pymodel.DateTime:lambda o: LocTType.DATETIME,
 }
 
+# Thrift ids of model fields are shifted to leave room for the DEFAULT_FIELDS
+THRIFT_ID_OFFSET = 10
+
+def thrift_id(attr):
+    '''Get the thrift id of a model field
+
+    The default fields use ids 1 to 4, the thrift_id given to other fields
+    is shifted by THRIFT_ID_OFFSET. Field kwargs are never modified.
+    '''
+    if attr in DEFAULT_FIELDS:
+        return list(DEFAULT_FIELDS).index(attr) + 1
+    return attr.kwargs['thrift_id'] + THRIFT_ID_OFFSET
+
 def generate_thrift_spec(typeinfo):
-    try:
-        return TYPE_SPEC_CACHE[typeinfo]
-    except KeyError:
-        pass
+    return get_cached(TYPE_SPEC_CACHE, typeinfo, _compile_thrift_spec,
+                      typeinfo)
 
+def _compile_thrift_spec(typeinfo):
     logger.info('Generating thrift spec for %s' % typeinfo.name)
 
     spec = [None, ]
     id_ = len(spec)
 
-    def get_thrift_id(field):
-        if field.attribute in DEFAULT_FIELDS:
-            field.attribute.kwargs['thrift_id'] = \
-                    list(DEFAULT_FIELDS).index(field.attribute) + 1
-        else:
-            field.attribute.kwargs['thrift_id'] += 10
-
-        return field.attribute.kwargs['thrift_id']
-
     attributes = sorted(typeinfo.attributes,
-                        key=get_thrift_id)
+                        key=lambda attribute: thrift_id(attribute.attribute))
 
     for attribute in attributes:
         name = attribute.name
         attr = attribute.attribute
-        aid = attr.kwargs['thrift_id']
+        aid = thrift_id(attr)
 
         if aid < id_:
-            raise RuntimeError
+            raise RuntimeError('Duplicate thrift id %d in %s' % (
+                aid, typeinfo.name))
 
         while aid > id_:
             spec.append(None)
@@ -143,8 +160,50 @@ def generate_thrift_spec(typeinfo):
 
         id_ = len(spec)
 
-    ret = TYPE_SPEC_CACHE[typeinfo] = tuple(spec)
-    return ret
+    return tuple(spec)
+
+
+# Thrift id of the optional schema fingerprint field. It's written as the
+# first field of the payload, readers not knowing it simply skip it.
+FINGERPRINT_THRIFT_ID = 0
+
+_FINGERPRINT_FIELD = struct.Struct('>bhq')
+
+def _args_signature(thrift_type, args):
+    if thrift_type == TType.STRUCT:
+        return _spec_signature(args[1])
+    if thrift_type == TType.LIST:
+        return '<%d%s>' % (args[0], _args_signature(args[0], args[1]))
+    if thrift_type == TType.MAP:
+        return '<%d,%d%s>' % (args[0], args[2],
+                              _args_signature(args[2], args[3]))
+    return ''
+
+def _spec_signature(spec):
+    return '(%s)' % ','.join('%d:%d:%s%s' % (fid, ftype, name,
+                                             _args_signature(ftype, args))
+                             for (fid, ftype, name, args, default) in
+                             (field for field in spec if field))
+
+def schema_fingerprint(typeinfo):
+    '''Get the schema fingerprint of a model type
+
+    The fingerprint is derived from the thrift spec of the type, including
+    the specs of all nested types: it changes whenever a field id, type or
+    name changes anywhere in the encoded structure.
+
+    @param typeinfo: Model info of the type, i.e. its PYMODEL_MODEL_INFO
+    @type typeinfo: L{pymodel.model.ModelInfo}
+
+    @return: Signed 64 bit fingerprint
+    @rtype: int
+    '''
+    return get_cached(FINGERPRINT_CACHE, typeinfo, _compile_fingerprint,
+                      typeinfo)
+
+def _compile_fingerprint(typeinfo):
+    signature = _spec_signature(generate_thrift_spec(typeinfo))
+    return struct.unpack('>q', hashlib.md5(signature).digest()[:8])[0]
 
 
 
@@ -202,10 +261,14 @@ def _write_struct(data, prot, info):
     prot.writeFieldStop()
     prot.writeStructEnd()
 
-def thrift_write(obj, spec, _force_native=False):
+def thrift_write(obj, spec, _force_native=False, fingerprint=None):
     transport = TTransport.TMemoryBuffer()
     protocol = TBinaryProtocol.TBinaryProtocolAccelerated(transport)
     transport.open()
+    if fingerprint is not None:
+        transport.write(_FINGERPRINT_FIELD.pack(TType.I64,
+                                                FINGERPRINT_THRIFT_ID,
+                                                fingerprint))
     if protocol.__class__ == TBinaryProtocol.TBinaryProtocolAccelerated and \
        spec is not None and \
        fastbinary is not None and \
@@ -253,7 +316,7 @@ def _read_map(prot, info):
     assert ktype == TType.STRING, 'Only string keys are supported'
 
     for i in xrange(size):
-        key = prot.readString()
+        key = intern_string(prot.readString())
         value = READ_TYPE_HANDLERS[vtype](prot, info[3])
         obj[key] = value
 
@@ -275,44 +338,97 @@ def _read_list(prot, info):
     return obj
 
 
-def _read_struct(protocol, spec, obj=None):
-    obj = obj or spec[0]()
-
-    struct_info = spec[1]
+def get_read_plan(typeinfo):
+    '''Get the read plan of a model type
+
+    The plan maps thrift ids to (thrift type, field name, read handler,
+    handler info) tuples, so fields are found without scanning the spec.
+    '''
+    return get_cached(READ_PLAN_CACHE, typeinfo, _compile_read_plan,
+                      typeinfo)
+
+def _read_interned_string(prot, info):
+    return intern_string(prot.readString())
+
+def _compile_read_plan(typeinfo):
+    attrs = dict((attribute.name, attribute.attribute) for attribute in
+                 typeinfo.attributes)
+
+    plan = dict()
+    for field in generate_thrift_spec(typeinfo):
+        if field:
+            fid, ftype, fname, finfo, fdefault = field
+            handler = READ_TYPE_HANDLERS[ftype]
+            if intern_field(attrs[fname]):
+                handler = _read_interned_string
+            plan[fid] = (ftype, fname, handler, finfo)
+    return plan
+
+def _read_struct(protocol, spec, obj=None, fingerprint=None):
+    '''Read a struct into a model instance
+
+    If the payload starts with a schema fingerprint equal to the given one,
+    it was written using the same schema and fields are read without any
+    checks. If the fingerprints differ, the payload was written by another
+    version of the model: unknown fields and fields of another type are
+    skipped. Without a fingerprint unknown fields are skipped, fields of
+    another type are considered to be corruption.
+    '''
+    obj = obj or new_instance(spec[0])
+    plan = get_read_plan(type(obj).PYMODEL_MODEL_INFO)
 
     protocol.readStructBegin()
 
-    while True:
+    strict = True
+    fname, ftype, fid = protocol.readFieldBegin()
+    if fid == FINGERPRINT_THRIFT_ID and ftype == TType.I64:
+        payload_fingerprint = protocol.readI64()
+        protocol.readFieldEnd()
+        if fingerprint is not None and payload_fingerprint == fingerprint:
+            return _read_trusted_fields(protocol, plan, obj)
+        strict = False
         fname, ftype, fid = protocol.readFieldBegin()
-        if ftype == TType.STOP:
-            break
 
-        field_info = None
-        for item in struct_info:
-            if item and item[0] == fid:
-                field_info = item
+    skipped = 0
+    while ftype != TType.STOP:
+        field = plan.get(fid)
 
-        if not field_info:
-            logger.info('Unknown field %s (id %d)' % (fname, fid))
-            # Unknown field
+        if field is None or field[0] != ftype:
+            if field is not None and strict:
+                raise RuntimeError('Field of invalid type, corrupted?')
             protocol.skip(ftype)
-            protocol.readFieldEnd()
-            continue
+            skipped += 1
+        else:
+            setattr(obj, field[1], field[2](protocol, field[3]))
+
+        protocol.readFieldEnd()
+        fname, ftype, fid = protocol.readFieldBegin()
+
+    protocol.readStructEnd()
+
+    if skipped:
+        logger.debug('Skipped %d unknown fields reading %s' % (
+            skipped, type(obj).__name__))
 
-        if not ftype == field_info[1]:
-            raise RuntimeError('Field of invalid type, corrupted?')
+    return obj
+
+def _read_trusted_fields(protocol, plan, obj):
+    while True:
+        fname, ftype, fid = protocol.readFieldBegin()
+        if ftype == TType.STOP:
+            break
 
-        handler = READ_TYPE_HANDLERS[ftype]
-        value = handler(protocol, field_info[3])
-        setattr(obj, field_info[2], value)
+        ftype, fname, handler, finfo = plan[fid]
+        setattr(obj, fname, handler(protocol, finfo))
 
         protocol.readFieldEnd()
+
     protocol.readStructEnd()
 
     return obj
 
 
-def thrift_read(obj, spec, data, _force_native=False):
+def thrift_read(obj, spec, data, _force_native=False, fingerprint=None):
     transport = TTransport.TMemoryBuffer(data)
     transport = TTransport.TBufferedTransport(transport)
     protocol = TBinaryProtocol.TBinaryProtocolAccelerated(transport)
@@ -326,7 +442,7 @@ def thrift_read(obj, spec, data, _force_native=False):
                                  (obj.__class__, spec))
         return
 
-    _read_struct(protocol, (None, spec, ), obj)
+    _read_struct(protocol, (None, spec, ), obj, fingerprint)
 
 
 def _native_type(obj):
@@ -354,6 +470,38 @@ def _native_type(obj):
     return obj
 
 
+# Thrift ids of the guid and version fields, see generate_thrift_spec
+GUID_THRIFT_ID = thrift_id(GUIDField)
+VERSION_THRIFT_ID = thrift_id(VersionField)
+
+_FIELD_HEADER = struct.Struct('>bh')
+_STRING_SIZE = struct.Struct('>i')
+
+def peek_identity(data):
+    '''Get the guid and version of a binary thrift encoded object'''
+    identity = {GUID_THRIFT_ID: None, VERSION_THRIFT_ID: None}
+    offset = 0
+
+    try:
+        ftype, fid = _FIELD_HEADER.unpack_from(data, offset)
+        if ftype == TType.I64 and fid == FINGERPRINT_THRIFT_ID:
+            offset += _FINGERPRINT_FIELD.size
+
+        while True:
+            ftype, fid = _FIELD_HEADER.unpack_from(data, offset)
+            if ftype != TType.STRING or fid not in identity:
+                break
+            offset += _FIELD_HEADER.size
+            size, = _STRING_SIZE.unpack_from(data, offset)
+            offset += _STRING_SIZE.size
+            identity[fid] = data[offset:offset + size]
+            offset += size
+    except struct.error:
+        pass
+
+    return identity[GUID_THRIFT_ID], identity[VERSION_THRIFT_ID]
+
+
 class ThriftObjectWrapper(object):
     def __init__(self, object_):
         self._object = object_
@@ -367,24 +515,53 @@ class ThriftObjectWrapper(object):
 class ThriftSerializer(object):
     NAME = 'thrift'
     FORCE_NATIVE = True
+    # Write the schema fingerprint of the type in front of the payload
+    EMBED_FINGERPRINT = False
 
     @classmethod
     def serialize(cls, object_):
         object_type = type(object_)
         model_info = object_type.PYMODEL_MODEL_INFO
         spec = generate_thrift_spec(model_info)
+        fingerprint = None
+        if cls.EMBED_FINGERPRINT:
+            fingerprint = schema_fingerprint(model_info)
         wrapped = ThriftObjectWrapper(object_)
-        data = thrift_write(wrapped, spec, _force_native=cls.FORCE_NATIVE)
+        data = thrift_write(wrapped, spec, _force_native=cls.FORCE_NATIVE,
+                            fingerprint=fingerprint)
         return data
 
     @classmethod
     def deserialize(cls, type_, data):
         model_info = type_.PYMODEL_MODEL_INFO
         spec = generate_thrift_spec(model_info)
-        object_ = type_()
-        thrift_read(object_, spec, data, _force_native=cls.FORCE_NATIVE)
+        object_ = new_instance(type_)
+        thrift_read(object_, spec, data, _force_native=cls.FORCE_NATIVE,
+                    fingerprint=schema_fingerprint(model_info))
         return object_
 
+    @classmethod
+    def prepare(cls, type_):
+        '''Compile the cached thrift spec, fingerprint and read plan of a
+        type'''
+        model_info = type_.PYMODEL_MODEL_INFO
+        generate_thrift_spec(model_info)
+        schema_fingerprint(model_info)
+        get_read_plan(model_info)
+
+    @classmethod
+    def peek_identity(cls, type_, data):
+        '''Read the guid and version of a serialized object without
+        decoding it
+
+        Both are the first fields written, so only the start of the data is
+        parsed.
+
+        @return: Tuple of guid and version, None when not set
+        @rtype: tuple
+        '''
+        return peek_identity(data)
+
 
 if fastbinary:
     class OptimizedSerializer(ThriftSerializer):
@@ -394,3 +571,12 @@ if fastbinary:
 class NativeSerializer(ThriftSerializer):
     NAME = '_ThriftNative'
     FORCE_NATIVE = True
+
+class FingerprintSerializer(ThriftSerializer):
+    '''Thrift serializer embedding the schema fingerprint of the type
+
+    Readers using the same schema decode the payload without any field
+    checks, other readers skip the fingerprint field.
+    '''
+    NAME = 'thriftfp'
+    EMBED_FINGERPRINT = True
@@ -0,0 +1,292 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Bulk serialization using a pool of worker processes
+
+Serializing a large batch of objects is CPU bound and runs on a single core
+because of the GIL. L{serialize_many} and L{deserialize_many} split a batch
+in chunks which are handled by worker processes.
+
+Model instances are not picklable, so objects travel between the processes
+encoded using a Thrift serializer (the 'wire'). For serialize_many the
+parent encodes every object using the wire serializer, and the workers
+decode it and encode it using the requested serializer. For
+deserialize_many the workers decode the payloads and send them back
+encoded using the wire serializer. Using the C-accelerated Thrift
+serializer as wire keeps the work left in the parent process small. With the
+pure Python one, the parent does about as much work as a serial run, a
+warning is logged when it is used.
+
+Since the parent always encodes or decodes every object using the wire
+serializer, only serializers more expensive than the wire (e.g. YAML, XML or
+JSON) gain anything from the workers. When the requested serializer is the
+wire serializer itself, the batch is handled in the calling process.
+
+Model types are sent to the workers by reference. Root object types of a
+domain initialized by L{pymodel.init} are sent as their domain and name, and
+looked up in C{pymodel.ROOTOBJECT_TYPES} by the workers, which initialize
+the domain when required (see L{init_worker}). Other types are pickled, so
+they need to be importable by the workers. Types which can't be sent are
+refused with a TypeError before any work is dispatched.
+'''
+
+import pickle
+import logging
+import itertools
+import multiprocessing
+
+import pymodel
+from pymodel.serializers import SERIALIZERS
+
+logger = logging.getLogger('pymodel.serializers.parallel')
+
+DEFAULT_CHUNK_SIZE = 200
+
+# Wire serializers, in order of preference
+WIRE_SERIALIZERS = ('_ThriftOptimized', 'thrift', )
+
+
+def default_wire():
+    '''Get the name of the preferred wire serializer available'''
+    for name in WIRE_SERIALIZERS:
+        if SERIALIZERS[name].available():
+            return name
+    raise RuntimeError('No Thrift serializer available')
+
+def _check_wire(wire):
+    if getattr(SERIALIZERS[wire], 'FORCE_NATIVE', True):
+        logger.warning('Using the pure Python %s serializer as wire, the '
+                       'parent process does about as much work as a serial '
+                       'run' % wire)
+
+def _serializer_name(serializer):
+    if isinstance(serializer, basestring):
+        return serializer
+    return serializer.NAME
+
+def _domain_of(type_):
+    '''Get the domain of a type defined in a model module loaded by
+    L{pymodel.init}, or None'''
+    parts = type_.__module__.split('.')
+    if len(parts) == 4 and parts[0] == 'pymodel' and \
+       parts[2] == '_rootobjects':
+        return parts[1]
+    return None
+
+def _type_reference(type_):
+    '''Get a picklable reference to a model type
+
+    @raise TypeError: The type can't be sent to worker processes
+    '''
+    domain = _domain_of(type_)
+    if domain is not None:
+        try:
+            path = pymodel.DOMAIN_PATHS[domain]
+            registered = pymodel.ROOTOBJECT_TYPES[domain].get(type_.__name__)
+        except KeyError:
+            registered = None
+        if registered is not type_:
+            raise TypeError('%s is not a root object type of the %s domain' %
+                            (type_.__name__, domain))
+        reference = ('domain', (domain, path, type_.__name__))
+    else:
+        reference = ('type', type_)
+
+    try:
+        pickle.dumps(reference, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError), e:
+        raise TypeError('%s can not be sent to worker processes: %s' % (
+            type_.__name__, e))
+
+    return reference
+
+def _worker_domains(reference):
+    kind, value = reference
+    if kind != 'domain':
+        return ()
+    return (value[:2], )
+
+def init_worker(domains):
+    '''Initialize the given domains in a worker process, if not done yet
+
+    Used as initializer of the process pools created by this module. Pools
+    given by callers don't need it, domains are also initialized on first
+    use.
+
+    @param domains: (domain name, model path) tuples
+    @type domains: iterable
+    '''
+    for domain, path in domains:
+        if domain not in pymodel.ROOTOBJECT_TYPES:
+            logger.info('Initializing domain %s in worker' % domain)
+            pymodel.init(path, domain, lazy=True)
+
+def _resolve_type(reference):
+    kind, value = reference
+    if kind != 'domain':
+        return value
+
+    init_worker((value[:2], ))
+    return pymodel.ROOTOBJECT_TYPES[value[0]][value[2]]
+
+def _serialize_chunk(args):
+    reference, serializer_name, wire_name, chunk = args
+    type_ = _resolve_type(reference)
+    serializer = SERIALIZERS[serializer_name]
+    wire = SERIALIZERS[wire_name]
+
+    return [serializer.serialize(wire.deserialize(type_, data)) for data in
+            chunk]
+
+def _deserialize_chunk(args):
+    reference, serializer_name, wire_name, chunk = args
+    type_ = _resolve_type(reference)
+    serializer = SERIALIZERS[serializer_name]
+    wire = SERIALIZERS[wire_name]
+
+    return [wire.serialize(serializer.deserialize(type_, data)) for data in
+            chunk]
+
+def _chunks(items, chunk_size):
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def _run(worker, reference, serializer, items, chunk_size, executor,
+         workers, wire):
+    jobs = ((reference, _serializer_name(serializer), wire, chunk) for chunk
+            in _chunks(items, chunk_size))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = multiprocessing.Pool(workers, initializer=init_worker,
+                                        initargs=(_worker_domains(reference),
+                                                  ))
+
+    try:
+        results = list()
+        for chunk in executor.map(worker, jobs):
+            results.extend(chunk)
+        return results
+    finally:
+        if own_executor:
+            if hasattr(executor, 'shutdown'):
+                executor.shutdown()
+            else:
+                executor.close()
+                executor.join()
+
+def serialize_many(objects, serializer, chunk_size=DEFAULT_CHUNK_SIZE,
+                   executor=None, workers=None, wire=None):
+    '''Serialize a batch of root objects using worker processes
+
+    Objects serialized using the wire serializer itself are encoded in the
+    calling process, see the module documentation.
+
+    @param objects: Objects to serialize, all of the same type
+    @type objects: list
+    @param serializer: Serializer to use, or its name in
+                       L{pymodel.serializers.SERIALIZERS}
+    @type serializer: object
+    @param chunk_size: Number of objects handed to a worker at once
+    @type chunk_size: int
+    @param executor: Process pool to use (a ProcessPoolExecutor or a
+                     multiprocessing Pool). If None, a multiprocessing Pool
+                     is created for this call
+    @type executor: object
+    @param workers: Number of worker processes of the pool created if no
+                    executor is given, defaults to the number of CPUs
+    @type workers: int
+    @param wire: Name of the Thrift serializer used to send objects to the
+                 workers, defaults to the fastest one available
+    @type wire: string
+
+    @return: Serialized objects, in the order of objects
+    @rtype: list
+
+    @raise TypeError: The type of the objects can't be sent to the workers
+    '''
+    if not objects:
+        return list()
+
+    wire = wire or default_wire()
+    if _serializer_name(serializer) == wire:
+        # The workers would only redo the work of the parent
+        wire_serializer = SERIALIZERS[wire]
+        return [wire_serializer.serialize(object_) for object_ in objects]
+
+    _check_wire(wire)
+    type_ = type(objects[0])
+    reference = _type_reference(type_)
+    wire_serializer = SERIALIZERS[wire]
+
+    logger.info('Serializing %d objects in chunks of %d' % (len(objects),
+                                                           chunk_size))
+    encoded = [wire_serializer.serialize(object_) for object_ in objects]
+
+    return _run(_serialize_chunk, reference, serializer, encoded, chunk_size,
+                executor, workers, wire)
+
+def deserialize_many(type_, serializer, datas, chunk_size=DEFAULT_CHUNK_SIZE,
+                     executor=None, workers=None, wire=None):
+    '''Deserialize a batch of root objects using worker processes
+
+    See L{serialize_many} for the meaning of the arguments.
+
+    @param type_: Type of the serialized objects
+    @type type_: type
+    @param datas: Serialized objects
+    @type datas: iterable
+
+    @return: Deserialized objects, in the order of datas
+    @rtype: list
+
+    @raise TypeError: type_ can't be sent to the workers
+    '''
+    wire = wire or default_wire()
+    wire_serializer = SERIALIZERS[wire]
+    if _serializer_name(serializer) == wire:
+        return [wire_serializer.deserialize(type_, data) for data in datas]
+
+    _check_wire(wire)
+    reference = _type_reference(type_)
+
+    encoded = _run(_deserialize_chunk, reference, serializer, datas,
+                   chunk_size, executor, workers, wire)
+
+    return [wire_serializer.deserialize(type_, data) for data in encoded]
@@ -35,145 +35,87 @@
 
 import yaml
 
-import pymodel
-from pymodel.fields import EmptyObject
-from pymonkey.baseclasses.BaseEnumeration import BaseEnumeration
+try:
+    from yaml import CSafeLoader as _SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader, SafeDumper
 
 
-def handle_list(attr, value):
-    data = list()
-    type_handler = TYPE_HANDLERS[type(attr.type_)]
-    for item in value:
-        data.append(type_handler(None, item))
+class SafeLoader(_SafeLoader):
+    '''Safe loader also reading the string tags the non-safe dumper used to
+    emit, so data written by older versions keeps loading'''
 
-    return data
+def _construct_python_unicode(loader, node):
+    return unicode(loader.construct_scalar(node))
 
-def handle_dict(attr, value):
-    data = dict()
-    type_handler = TYPE_HANDLERS[type(attr.type_)]
-    for k, v in value.iteritems():
-        data[k] = type_handler(None, v)
+def _construct_python_str(loader, node):
+    return loader.construct_yaml_str(node)
 
-    return data
+SafeLoader.add_constructor(u'tag:yaml.org,2002:python/unicode',
+                           _construct_python_unicode)
+SafeLoader.add_constructor(u'tag:yaml.org,2002:python/str',
+                           _construct_python_str)
 
+from pymodel.conversion import object_to_dict, dict_to_object, \
+        get_dict_converter, get_dict_loader
+from pymodel.pool import new_instance
 
-def enum_to_string(obj):
-    if isinstance(obj, BaseEnumeration):
-        #TODO Get rid of protected lookup
-        return getattr(obj, '_pm_enumeration_name')
-
-
-TYPE_HANDLERS = {
-    pymodel.String: lambda a, o: o,
-    pymodel.Enumeration: lambda a, o: enum_to_string(o),
-    pymodel.GUID: lambda a, o: o,
-    pymodel.Integer: lambda a, o: o,
-    pymodel.Float: lambda a, o: o,
-    pymodel.Boolean: lambda a, o: o,
-    pymodel.List: handle_list,
-    pymodel.Dict: handle_dict,
-    pymodel.Object: lambda a, o: object_to_dict(o),
-    pymodel.DateTime: lambda a, o: o,
-}
-
-
-def object_to_dict(object_):
-    if isinstance(object_, EmptyObject):
-        return None
-
-    data = dict()
-    spec = type(object_).PYMODEL_MODEL_INFO
-
-    for attribute in spec.attributes:
-        attr = attribute.attribute
-
-        try:
-            value = getattr(object_, attr.name)
-        except AttributeError:
-            value = None
-
-        if value is None:
-            continue
-
-        handler = TYPE_HANDLERS[type(attr)]
-
-        value = handler(attr, value)
-        if value is None:
-            continue
-
-        data[attr.name] = value
-
-    return data
-
-
-def load_dict(attr, data):
-    result = dict()
-    type_ = attr.type_
-    handler = TYPE_SET_HANDLERS[type(type_)]
-
-    for key, value in data.iteritems():
-        result[key] = handler(type_, value)
-
-    return result
-
-def load_list(attr, data):
-    result = list()
-    type_ = attr.type_
-    handler = TYPE_SET_HANDLERS[type(type_)]
-
-    for item in data:
-        result.append(handler(type_, item))
-
-    return result
-
-TYPE_SET_HANDLERS = {
-    pymodel.String: lambda a, o: o,
-    pymodel.Enumeration: lambda a, o: o,
-    pymodel.GUID: lambda a, o: o,
-    pymodel.Integer: lambda a, o: o,
-    pymodel.Float: lambda a, o: o,
-    pymodel.Boolean: lambda a, o: o,
-    pymodel.Dict: load_dict,
-    pymodel.Object: lambda a, o: dict_to_object(a.type_(), o),
-    pymodel.List: load_list,
-    pymodel.DateTime: lambda a, o:o,
-}
-
-def dict_to_object(object_, data):
-    spec = type(object_).PYMODEL_MODEL_INFO
-
-    for attribute in spec.attributes:
-        attr = attribute.attribute
-
-        try:
-            value = data[attr.name]
-        except KeyError:
-            continue
-
-        if value is None:
-            continue
-
-        handler = TYPE_SET_HANDLERS[type(attr)]
-
-        value = handler(attr, value)
-        if value is None:
-            continue
-
-        setattr(object_, attr.name, value)
-
-    return object_
 
 class YamlSerializer(object):
     NAME = 'yaml'
 
     @staticmethod
-    def serialize(object_):
-        data = object_to_dict(object_)
-        return yaml.dump(data, default_flow_style=False)
+    def serialize(object_, fields=None):
+        data = object_to_dict(object_, fields)
+        return yaml.dump(data, Dumper=SafeDumper, default_flow_style=False)
 
     @staticmethod
     def deserialize(type_, data):
-        object_ = type_()
-        data = yaml.load(data)
+        object_ = new_instance(type_)
+        data = yaml.load(data, Loader=SafeLoader)
         dict_to_object(object_, data)
         return object_
+
+    @staticmethod
+    def prepare(type_):
+        '''Compile the cached dict converter and loader of a type'''
+        get_dict_converter(type_)
+        get_dict_loader(type_)
+
+    @staticmethod
+    def serialize_many(objects, stream=None, fields=None):
+        '''Serialize a sequence of objects into a multi-document YAML stream
+
+        Objects are converted one by one while the documents are emitted, so
+        the whole sequence is never held in memory as dictionaries.
+
+        @param objects: Objects to serialize
+        @type objects: iterable
+        @param stream: File-like object to write to
+        @type stream: file
+        @param fields: Names of the fields to include, or None to include all
+        @type fields: iterable
+
+        @return: The YAML stream if no stream was given, None otherwise
+        @rtype: string
+        '''
+        documents = (object_to_dict(object_, fields) for object_ in objects)
+        return yaml.dump_all(documents, stream, Dumper=SafeDumper,
+                             default_flow_style=False, explicit_start=True)
+
+    @staticmethod
+    def deserialize_iter(type_, data):
+        '''Deserialize all documents in a multi-document YAML stream
+
+        @param type_: Type of the objects in the stream
+        @type type_: type
+        @param data: YAML stream, as a string or a file-like object
+        @type data: string
+
+        @return: Generator yielding one object per document
+        @rtype: generator
+        '''
+        for document in yaml.load_all(data, Loader=SafeLoader):
+            if document is None:
+                continue
+            yield dict_to_object(new_instance(type_), document)
@@ -0,0 +1,352 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Cache of serialized root objects shared by processes
+
+A L{SharedCache} lives in a file mapped in memory by every process using
+it, preferably on a memory file system like /dev/shm. Processes publish
+root objects into it, encoded by the fingerprinting thrift serializer and
+keyed by type, guid and version. Every other process finds them without
+locking and decodes them on demand, straight from the shared memory::
+
+    cache = SharedCache('/dev/shm/pymodel-machines')
+    cache.publish(machine)
+    ...
+    machine = cache.get(Machine, guid, version)
+
+Decoding goes through C{deserialize} of the type, so a process keeping an
+identity map (see L{pymodel.identitymap}) decodes every object only once.
+
+The file holds a header, a hash table of slots and a data area. Publishers
+take an exclusive flock on the file, opened again by every process since
+forked processes would share the lock of their parent, and a thread lock
+shared by the threads of the process. They append the key and data of an entry to
+the data area and fill its slot. Readers never lock: a slot carries a
+sequence number which is odd while the slot is written, readers retry when
+it was odd or changed while they read the slot (a seqlock).
+
+Entries are never removed one by one. L{SharedCache.invalidate} increments
+the generation counter in the header, which empties the cache for all
+processes at once. Readers check the generation again after decoding, and
+drop what they decoded when the data was reclaimed meanwhile. Publishing
+into a full cache starts a new generation as well.
+'''
+
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger('pymodel.sharedcache')
+
+DEFAULT_DATA_SIZE = 64 * 1024 * 1024
+DEFAULT_SLOTS = 16 * 1024
+# Part of the slots used before a new generation is started
+MAX_LOAD = 0.75
+# Attempts to read a slot being written before considering it a miss
+READ_RETRIES = 100
+
+MAGIC = 'PYMSHC01'
+
+# magic, number of slots, data area size, generation, used data size,
+# number of entries
+_HEADER = struct.Struct('<8sIQQQQ')
+_GENERATION_OFFSET = 20
+_GENERATION = struct.Struct('<Q')
+
+# sequence, generation, key hash, data offset, key size, data size
+_SLOT = struct.Struct('<QQQQII')
+_SEQUENCE = struct.Struct('<Q')
+
+
+def _key(type_, guid, version, serializer):
+    key = '%s.%s\0%s\0%s\0%s' % (type_.__module__, type_.__name__, guid,
+                                 version or '', serializer.NAME)
+    # Decoded objects have unicode guids, keys are stored next to the data
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return key
+
+def _hash(key):
+    # 0 marks empty slots
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0] or 1
+
+
+class SharedCache(object):
+    '''Cache of serialized root objects in a memory mapped file'''
+
+    def __init__(self, path, data_size=DEFAULT_DATA_SIZE, slots=DEFAULT_SLOTS,
+                 serializer=None):
+        '''Open a shared cache, creating its file if it doesn't exist
+
+        The size of an existing cache is kept, data_size and slots are only
+        used when the file is created.
+
+        @param path: Path of the cache file
+        @type path: string
+        @param data_size: Size of the data area in bytes
+        @type data_size: number
+        @param slots: Number of slots in the hash table
+        @type slots: number
+        @param serializer: Serializer used to encode objects, defaults to the
+                           fingerprinting thrift serializer
+        @type serializer: object
+        '''
+        if serializer is None:
+            from pymodel.serializers import SERIALIZERS
+            serializer = SERIALIZERS['thriftfp']
+        self._serializer = serializer
+        self._path = path
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size == 0:
+                logger.info('Creating shared cache %s' % path)
+                size = _HEADER.size + slots * _SLOT.size + data_size
+                os.ftruncate(fd, size)
+                os.write(fd, _HEADER.pack(MAGIC, slots, data_size, 1, 0, 0))
+
+            self._map = mmap.mmap(fd, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        # Descriptor locked by publishers, and the process which opened it
+        self._lock_fd = fd
+        self._lock_pid = os.getpid()
+        self._thread_lock = threading.Lock()
+
+        magic, self._slots, self._data_size, _, _, _ = \
+                _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a shared cache' % path)
+
+        self._data_offset = _HEADER.size + self._slots * _SLOT.size
+
+    def _lock(self):
+        '''Take the thread lock and the flock of the process'''
+        pid = os.getpid()
+        if self._lock_pid != pid:
+            # Forked: the descriptor and the thread lock are copies of those
+            # of the parent, which may have been held while forking
+            os.close(self._lock_fd)
+            self._lock_fd = os.open(self._path, os.O_RDWR)
+            self._lock_pid = pid
+            self._thread_lock = threading.Lock()
+
+        self._thread_lock.acquire()
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        except:
+            self._thread_lock.release()
+            raise
+
+    def _unlock(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def _generation(self):
+        return _GENERATION.unpack_from(self._map, _GENERATION_OFFSET)[0]
+
+    def _slot_offset(self, index):
+        return _HEADER.size + index * _SLOT.size
+
+    def _read_slot(self, index):
+        '''Read a consistent copy of a slot, None if it is being written'''
+        offset = self._slot_offset(index)
+        for _ in xrange(READ_RETRIES):
+            slot = _SLOT.unpack_from(self._map, offset)
+            if slot[0] & 1:
+                continue
+            if _SEQUENCE.unpack_from(self._map, offset)[0] == slot[0]:
+                return slot
+        return None
+
+    def _find(self, key):
+        '''Get the data offset and size of the entry of a key'''
+        hash_ = _hash(key)
+        generation = self._generation()
+        index = hash_ % self._slots
+
+        for _ in xrange(self._slots):
+            slot = self._read_slot(index)
+            if slot is None:
+                return None
+            sequence, slot_generation, slot_hash, offset, key_size, size = \
+                    slot
+            if slot_generation != generation:
+                return None
+            if slot_hash == hash_ and \
+               self._map[offset:offset + key_size] == key:
+                return offset + key_size, size, generation
+            index = (index + 1) % self._slots
+
+        return None
+
+    def get_data(self, type_, guid, version):
+        '''Get the serialized data of an object
+
+        The data is not copied: the returned buffer refers to the shared
+        memory, and is only valid as long as the generation didn't change.
+
+        @return: Buffer holding the data, None when not cached
+        @rtype: buffer
+        '''
+        found = self._find(_key(type_, guid, version, self._serializer))
+        if found is None:
+            return None
+        offset, size, _ = found
+        return buffer(self._map, offset, size)
+
+    def get(self, type_, guid, version):
+        '''Get an object, decoded from the shared data
+
+        @return: The object, None when not cached
+        @rtype: L{pymodel.RootObjectModel}
+        '''
+        found = self._find(_key(type_, guid, version, self._serializer))
+        if found is None:
+            return None
+        offset, size, generation = found
+
+        try:
+            object_ = type_.deserialize(self._serializer,
+                                        buffer(self._map, offset, size))
+        except Exception:
+            if self._generation() != generation:
+                return None
+            raise
+
+        if self._generation() != generation:
+            return None
+        return object_
+
+    def publish(self, object_):
+        '''Encode an object and publish it to all processes
+
+        @return: Size of the published data
+        @rtype: number
+        '''
+        if not object_.guid:
+            raise ValueError('Only objects with a guid can be published')
+
+        key = _key(type(object_), object_.guid, object_.version,
+                   self._serializer)
+        data = self._serializer.serialize(object_)
+        size = len(key) + len(data)
+
+        if size > self._data_size:
+            raise ValueError('Object too large for the shared cache')
+
+        self._lock()
+        try:
+            magic, slots, data_size, generation, used, count = \
+                    _HEADER.unpack_from(self._map, 0)
+
+            if used + size > data_size or count + 1 > slots * MAX_LOAD:
+                logger.info('Shared cache full, starting a new generation')
+                generation += 1
+                used = count = 0
+                # Readers have to notice before the data is overwritten
+                _GENERATION.pack_into(self._map, _GENERATION_OFFSET,
+                                      generation)
+
+            hash_ = _hash(key)
+            index = hash_ % slots
+            while True:
+                slot = _SLOT.unpack_from(self._map, self._slot_offset(index))
+                if slot[1] != generation:
+                    count += 1
+                    break
+                if slot[2] == hash_:
+                    offset, key_size = slot[3], slot[4]
+                    if self._map[offset:offset + key_size] == key:
+                        # Keep the entry if the data didn't change
+                        if slot[5] == len(data) and self._map[
+                                offset + key_size:offset + size] == data:
+                            return len(data)
+                        break
+                index = (index + 1) % slots
+
+            offset = self._data_offset + used
+            self._map[offset:offset + size] = key + data
+            used += size
+
+            slot_offset = self._slot_offset(index)
+            sequence = slot[0] + 1
+            _SEQUENCE.pack_into(self._map, slot_offset, sequence)
+            _SLOT.pack_into(self._map, slot_offset, sequence, generation,
+                            hash_, offset, len(key), len(data))
+            _SEQUENCE.pack_into(self._map, slot_offset, sequence + 1)
+
+            _HEADER.pack_into(self._map, 0, magic, slots, data_size,
+                              generation, used, count)
+        finally:
+            self._unlock()
+
+        return len(data)
+
+    def invalidate(self):
+        '''Drop all entries, for all processes'''
+        self._lock()
+        try:
+            magic, slots, data_size, generation, used, count = \
+                    _HEADER.unpack_from(self._map, 0)
+            _HEADER.pack_into(self._map, 0, magic, slots, data_size,
+                              generation + 1, 0, 0)
+        finally:
+            self._unlock()
+
+    def stats(self):
+        '''Get the generation, number of entries and data usage of the
+        cache'''
+        magic, slots, data_size, generation, used, count = \
+                _HEADER.unpack_from(self._map, 0)
+        return {
+            'generation': generation,
+            'entries': count,
+            'slots': slots,
+            'bytes': used,
+            'max_bytes': data_size,
+        }
+
+    def close(self):
+        '''Unmap the cache file'''
+        self._map.close()
+        os.close(self._lock_fd)
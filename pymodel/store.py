@@ -0,0 +1,134 @@
+# <License type="Aserver BSD" version="2.0">
+#
+# Copyright (c) 2005-2009, Aserver NV.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+# * Redistributions of source code must retain the above copyright
+#   notice, this list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in
+#   the documentation and/or other materials provided with the
+#   distribution.
+#
+# * Neither the name Aserver nor the names of other contributors
+#   may be used to endorse or promote products derived from this
+#   software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ASERVER "AS IS" AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL ASERVER BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# </License>
+
+'''Observable model instance stores
+
+Model fields keep their values in the C{_pymodel_store} dict of the
+instance. L{observe} replaces that dict by an L{ObservedStore}, which calls
+the registered observers with the name of every field set or deleted, so
+other structures can follow changes made through the field descriptors.
+Instances which are not observed keep their plain dict and pay nothing.
+
+List and Dict fields held by an observed store report items added or removed
+in place as a change of the field as well.
+'''
+
+from pymodel.fields import WrappedList, WrappedDict
+
+def _own(store, name, value):
+    '''Have a container report its in-place changes to store'''
+    if isinstance(value, (WrappedList, WrappedDict)):
+        owners = value._pymodel_owners
+        if not any(owner is store and owner_name == name
+                   for owner, owner_name in owners):
+            value._pymodel_owners = owners + ((store, name), )
+
+class ObservedStore(dict):
+    '''_pymodel_store dict notifying observers of changed fields'''
+    __slots__ = ('observers', )
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.observers = list()
+        for name, value in self.iteritems():
+            _own(self, name, value)
+
+    def _notify(self, name):
+        for observer in tuple(self.observers):
+            observer(name)
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name, value)
+        _own(self, name, value)
+        self._notify(name)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self._notify(name)
+
+    def setdefault(self, name, default=None):
+        if name in self:
+            return self[name]
+        self[name] = default
+        return default
+
+    def pop(self, name, *args):
+        present = name in self
+        value = dict.pop(self, name, *args)
+        if present:
+            self._notify(name)
+        return value
+
+    def popitem(self):
+        name, value = dict.popitem(self)
+        self._notify(name)
+        return name, value
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).iteritems():
+            self[name] = value
+
+    def clear(self):
+        names = self.keys()
+        dict.clear(self)
+        for name in names:
+            self._notify(name)
+
+
+def observe(object_, observer):
+    '''Register a callable called with the field name whenever a field of
+    object_ is set or deleted
+
+    @return: False if the store of object_ can't be observed (e.g. it is a
+             frozen instance), True otherwise
+    @rtype: bool
+    '''
+    store = object_._pymodel_store
+    if not isinstance(store, ObservedStore):
+        if type(store) is not dict:
+            return False
+        store = object_._pymodel_store = ObservedStore(store)
+
+    store.observers.append(observer)
+    return True
+
+def unobserve(object_, observer):
+    '''Unregister an observer registered using L{observe}'''
+    store = object_._pymodel_store
+    if isinstance(store, ObservedStore):
+        try:
+            store.observers.remove(observer)
+        except ValueError:
+            pass
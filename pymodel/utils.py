@@ -42,11 +42,210 @@ import imp
 import new
 import logging
 import inspect
+import threading
 
-from pymodel.model import RootObjectModel #pylint: disable-msg=E0611
+from pymodel.model import Model, RootObjectModel #pylint: disable-msg=E0611
 
 logger = logging.getLogger('pymodel.utils') #pylint: disable-msg=C0103
 
+MANIFEST_FILENAME = '.pymodel-manifest'
+MANIFEST_VERSION = 1
+# Folder the domain manifests are stored in by default
+MANIFEST_CACHE_DIR = os.environ.get('PYMODEL_CACHE_DIR') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'pymodel')
+
+# Modification time and size of model module files at the time they were
+# loaded, by module name
+MODULE_STATS = dict()
+
+# Callbacks dropping cached information about model types, see
+# register_cache_invalidator
+CACHE_INVALIDATORS = list()
+
+# Lock serializing the compilation of cached per-type information. It is
+# reentrant since compiling the information of a type often requires the
+# information of the types it contains.
+CACHE_LOCK = threading.RLock()
+
+def get_cached(cache, key, compiler, *args):
+    '''Get a value from a per-type cache, compiling it on first use
+
+    Lookups of cached values don't lock. On a miss the lock is taken and the
+    cache is checked again, so every value is compiled once, even when
+    several threads need it at the same time, and only complete values are
+    ever stored in the cache.
+
+    @param cache: Cache dict
+    @type cache: dict
+    @param key: Cache key
+    @param compiler: Callable computing the value, called with args
+
+    @return: Cached value
+    '''
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+
+    CACHE_LOCK.acquire()
+    try:
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+
+        value = compiler(*args)
+        cache[key] = value
+        return value
+    finally:
+        CACHE_LOCK.release()
+
+def register_cache_invalidator(invalidator):
+    '''Register a callback dropping cached information about model types
+
+    Modules caching compiled information per model type (serializer specs,
+    converters,...) register a callback, which is called with a set of model
+    types whenever those types are replaced, e.g. by L{reload_model_modules}.
+
+    @param invalidator: Callable accepting a set of model types
+    @type invalidator: callable
+    '''
+    CACHE_INVALIDATORS.append(invalidator)
+    return invalidator
+
+def invalidate_type_caches(types):
+    '''Drop all cached information about some model types
+
+    @param types: Model types
+    @type types: iterable
+    '''
+    types = set(types)
+    if not types:
+        return
+
+    logger.info('Invalidating caches for %s' % \
+                ', '.join(sorted(type_.__name__ for type_ in types)))
+    CACHE_LOCK.acquire()
+    try:
+        for invalidator in CACHE_INVALIDATORS:
+            invalidator(types)
+    finally:
+        CACHE_LOCK.release()
+
+def _file_stats(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+def _rootobjects_module_name(domain):
+    '''Get the name of the fake package holding the model modules of a
+    domain, creating it if required'''
+    pymodel_module_name = 'pymodel.%s._rootobjects' % domain
+    if pymodel_module_name not in sys.modules:
+        logger.debug('Creating fake %s module' % pymodel_module_name)
+        mod = new.module(pymodel_module_name)
+        sys.modules[pymodel_module_name] = mod
+
+    return pymodel_module_name
+
+def load_model_module(domain, module_name, module_path):
+    '''Load a model module of a domain
+
+    If the module was loaded before, the loaded module is returned.
+
+    @param domain: Name of the domain the module belongs to
+    @type domain: string
+    @param module_name: Name of the module, without package
+    @type module_name: string
+    @param module_path: Path of the module source file
+    @type module_path: string
+
+    @return: The module
+    @rtype: module
+    '''
+    modname = '%s.%s' % (_rootobjects_module_name(domain), module_name)
+    try:
+        return sys.modules[modname]
+    except KeyError:
+        pass
+
+    logger.debug('Loading %s' % module_path)
+    stats = _file_stats(module_path)
+    module = imp.load_source(modname, module_path)
+    MODULE_STATS[modname] = stats
+    return module
+
+def module_model_types(module):
+    '''Find all model types (root object or not) defined in a module
+
+    @return: Generator yielding all L{Model} subtypes found
+    @rtype: generator
+    '''
+    for attr in vars(module).itervalues():
+        if inspect.isclass(attr) and issubclass(attr, Model) and \
+           attr.__module__ == module.__name__:
+            yield attr
+
+def reload_model_modules(domain, path):
+    '''Re-import the loaded model modules of a domain which changed on disk
+
+    Modules whose file was removed are dropped from C{sys.modules}. Modules
+    which were never loaded are left alone.
+
+    @param domain: Name of the domain
+    @type domain: string
+    @param path: Domain folder
+    @type path: string
+
+    @return: List of (old module, new module) tuples, new module being None
+             for removed modules
+    @rtype: list
+    '''
+    prefix = '%s.' % _rootobjects_module_name(domain)
+    changes = list()
+
+    for modname, module in sys.modules.items():
+        if not modname.startswith(prefix) or modname not in MODULE_STATS:
+            continue
+
+        module_name = modname[len(prefix):]
+        module_path = os.path.join(path, '%s.py' % module_name)
+
+        if not os.path.isfile(module_path):
+            logger.info('Model module %s was removed' % modname)
+            del sys.modules[modname]
+            del MODULE_STATS[modname]
+            changes.append((module, None))
+            continue
+
+        if _file_stats(module_path) == MODULE_STATS[modname]:
+            continue
+
+        logger.info('Reloading model module %s' % modname)
+        del sys.modules[modname]
+        try:
+            new_module = load_model_module(domain, module_name, module_path)
+        except:
+            # Keep using the old module
+            sys.modules[modname] = module
+            raise
+        changes.append((module, new_module))
+
+    return changes
+
+def module_rootobject_types(module):
+    '''Find all root object types defined in a module
+
+    @return: Generator yielding all L{RootObjectModel} subtypes found
+    @rtype: generator
+    '''
+    for attrname in dir(module):
+        attr = getattr(module, attrname)
+        if inspect.isclass(attr) and \
+           issubclass(attr, RootObjectModel) and \
+           attr.__module__ == module.__name__: # Get around imports
+            logger.info('Found RootObjectModel \'%s\'' % attr.__name__)
+            yield attr
+
 def find_rootobject_types(path, domain):
     '''Find all root object types defined in any module in a given path
 
@@ -62,11 +261,7 @@ def find_rootobject_types(path, domain):
     '''
     logger.info('Looking up RootObjectModel definitions in %s' % path)
 
-    pymodel_module_name = 'pymodel.%s._rootobjects' % domain
-    if pymodel_module_name not in sys.modules:
-        logger.debug('Creating fake %s module' % pymodel_module_name)
-        mod = new.module(pymodel_module_name)
-        sys.modules[pymodel_module_name] = mod
+    pymodel_module_name = _rootobjects_module_name(domain)
 
     def find_modules():
         '''Find all module files in a given path
@@ -87,20 +282,321 @@ def find_rootobject_types(path, domain):
         @rtype: generator
         '''
         for module_name, module_path in find_modules():
-            logger.debug('Loading %s' % module_path)
             modname = '%s.%s' % (pymodel_module_name, module_name)
             if modname not in sys.modules:
-                yield imp.load_source(modname, module_path)
+                yield load_model_module(domain, module_name, module_path)
             #assert modname not in sys.modules, '%s already loaded' % modname
 
     for module in load_modules():
-        for attrname in dir(module):
-            attr = getattr(module, attrname)
-            if inspect.isclass(attr) and \
-               issubclass(attr, RootObjectModel) and \
-               attr.__module__ == module.__name__: # Get around imports
-                logger.info('Found RootObjectModel \'%s\'' % attr.__name__)
-                yield attr
+        for type_ in module_rootobject_types(module):
+            yield type_
+
+
+class ModelWatcher(threading.Thread):
+    '''Thread reloading changed model modules periodically
+
+    Every interval seconds, L{pymodel.reload_domain} is called for the
+    watched domains.
+    '''
+    def __init__(self, domains=None, interval=2.0, callback=None):
+        '''Initialize a new model watcher
+
+        @param domains: Names of the domains to watch, or None to watch all
+                        initialized domains
+        @type domains: list
+        @param interval: Number of seconds between checks
+        @type interval: float
+        @param callback: Function called with the domain name and the names
+                         of the reloaded modules after a domain was reloaded
+        @type callback: callable
+        '''
+        threading.Thread.__init__(self, name='pymodel-model-watcher')
+        self.daemon = True
+
+        self.domains = domains
+        self.interval = interval
+        self.callback = callback
+        self._stopped = threading.Event()
+
+    def check(self):
+        '''Reload changed modules of the watched domains once'''
+        import pymodel
+
+        for domain in self.domains or pymodel.DOMAIN_PATHS.keys():
+            try:
+                reloaded = pymodel.reload_domain(domain)
+                if reloaded and self.callback:
+                    self.callback(domain, reloaded)
+            except Exception: #pylint: disable-msg=W0703
+                logger.exception('Unable to reload domain %s' % domain)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        '''Stop watching'''
+        self._stopped.set()
+
+
+def default_manifest_path(path):
+    '''Get the default manifest path of a domain folder
+
+    Manifests are stored in L{MANIFEST_CACHE_DIR}, named after the folder
+    name and a hash of its absolute path.
+    '''
+    import hashlib
+
+    path = os.path.abspath(path)
+    return os.path.join(MANIFEST_CACHE_DIR, '%s-%s%s' % (
+        os.path.basename(path), hashlib.md5(path).hexdigest()[:12],
+        MANIFEST_FILENAME))
+
+class DomainManifest(object):
+    '''Persistent cache of the root object types defined in a domain folder
+
+    For every module file, the manifest records the modification time and
+    size of the file and the root object types it defines. Only modules
+    which are new or changed since the manifest was written need to be
+    imported to find the types of a domain. When the modification time of
+    the folder itself did not change, the folder isn't even listed.
+
+    The manifest is stored as a JSON file, by default in
+    L{MANIFEST_CACHE_DIR} (see L{default_manifest_path}), so domain folders
+    can be read-only and are left untouched. Failing to read or write it is
+    not an error, the folder is scanned as if there was no manifest.
+    '''
+    def __init__(self, path, manifest_path=None):
+        '''Initialize a new manifest
+
+        @param path: Domain folder
+        @type path: string
+        @param manifest_path: Path of the manifest file
+        @type manifest_path: string
+        '''
+        self.path = path
+        self.manifest_path = manifest_path or default_manifest_path(path)
+
+        self.directory_mtime = None
+        self.modules = dict()
+        self.dirty = False
+
+        self.load()
+
+    def load(self):
+        '''Read the manifest file, if any'''
+        import json
+
+        try:
+            fd = open(self.manifest_path)
+            try:
+                data = json.load(fd)
+            finally:
+                fd.close()
+        except (IOError, OSError, ValueError), e:
+            logger.debug('Unable to read manifest %s: %s' % (
+                self.manifest_path, e))
+            return
+
+        if data.get('version') != MANIFEST_VERSION:
+            logger.info('Ignoring manifest %s, unknown version' % \
+                        self.manifest_path)
+            return
+
+        self.directory_mtime = data['directory_mtime']
+        self.modules = data['modules']
+
+    def save(self):
+        '''Write the manifest file if it changed since it was read'''
+        import json
+
+        if not self.dirty:
+            return
+
+        def write():
+            data = {
+                'version': MANIFEST_VERSION,
+                'directory_mtime': self.directory_mtime,
+                'modules': self.modules,
+            }
+
+            fd = open(self.manifest_path, 'w')
+            try:
+                json.dump(data, fd)
+            finally:
+                fd.close()
+
+        # The file is rewritten in place: replacing it would change the
+        # modification time of the folder it's stored in. Readers of a
+        # partially written manifest ignore it.
+        try:
+            directory = os.path.dirname(self.manifest_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            created = not os.path.exists(self.manifest_path)
+            write()
+
+            # Creating the manifest changed the modification time of the
+            # folder, record the new one unless other files showed up
+            if created and os.path.dirname(os.path.abspath(
+                    self.manifest_path)) == os.path.abspath(self.path):
+                directory_mtime = os.stat(self.path).st_mtime
+                modules = set(filename for filename in
+                              os.listdir(self.path) if
+                              filename.endswith('.py'))
+                if modules == set(self.modules):
+                    self.directory_mtime = directory_mtime
+                    write()
+        except (IOError, OSError), e:
+            logger.info('Unable to write manifest %s: %s' % (
+                self.manifest_path, e))
+            return
+
+        self.dirty = False
+
+    def _list_modules(self):
+        directory_mtime = os.stat(self.path).st_mtime
+        if directory_mtime == self.directory_mtime:
+            return self.modules.keys()
+
+        logger.debug('Listing %s' % self.path)
+        filenames = [filename for filename in os.listdir(self.path) if
+                     filename.endswith('.py') and
+                     os.path.isfile(os.path.join(self.path, filename))]
+
+        for filename in set(self.modules).difference(filenames):
+            del self.modules[filename]
+
+        self.directory_mtime = directory_mtime
+        self.dirty = True
+
+        return filenames
+
+    def scan(self, domain):
+        '''Find all root object types defined in the domain folder
+
+        Modules which did not change since the manifest was written are not
+        imported.
+
+        @param domain: Name of the domain
+        @type domain: string
+
+        @return: List of (type name, module name, module path, entry) tuples,
+                 entry being the manifest information of the type: a dict
+                 containing its 'name' and 'type_name' (the
+                 PYMODEL_TYPE_NAME attribute of the type, if any)
+        @rtype: list
+        '''
+        logger.info('Looking up RootObjectModel definitions in %s' % \
+                    self.path)
+
+        found = list()
+
+        for filename in self._list_modules():
+            module_path = os.path.join(self.path, filename)
+            module_name = filename[:-3]
+
+            try:
+                stat = os.stat(module_path)
+            except OSError:
+                self.modules.pop(filename, None)
+                self.dirty = True
+                continue
+
+            entry = self.modules.get(filename)
+            if entry is None or entry['mtime'] != stat.st_mtime or \
+               entry['size'] != stat.st_size:
+                module = load_model_module(domain, module_name, module_path)
+                entry = self.modules[filename] = {
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size,
+                    'types': [{
+                        'name': type_.__name__,
+                        'type_name': getattr(type_, 'PYMODEL_TYPE_NAME',
+                                             None),
+                    } for type_ in module_rootobject_types(module)],
+                }
+                self.dirty = True
+
+            for type_info in entry['types']:
+                found.append((type_info['name'], module_name, module_path,
+                              type_info))
+
+        return found
+
+
+class LazyRootObjectType(object):
+    '''Placeholder for a root object type whose module is not imported yet'''
+    def __init__(self, domain, name, module_name, module_path, type_name=None):
+        self.domain = domain
+        self.name = name
+        self.module_name = module_name
+        self.module_path = module_path
+        self.type_name = type_name
+
+    def resolve(self):
+        '''Import the module defining the type and return the type'''
+        logger.info('Loading root object type %s' % self.name)
+        module = load_model_module(self.domain, self.module_name,
+                                   self.module_path)
+
+        type_ = getattr(module, self.name, None)
+        if not inspect.isclass(type_) or \
+           not issubclass(type_, RootObjectModel):
+            raise RuntimeError('Root object type %s not found in %s' % (
+                self.name, self.module_path))
+
+        return type_
+
+    def __repr__(self):
+        return '<LazyRootObjectType %s.%s>' % (self.domain, self.name)
+
+
+class RootObjectTypes(dict):
+    '''Dictionary of root object types by name
+
+    Values can be L{LazyRootObjectType} placeholders, these are replaced by
+    the actual type when they are looked up.
+    '''
+    def __getitem__(self, name):
+        type_ = dict.__getitem__(self, name)
+        if isinstance(type_, LazyRootObjectType):
+            type_ = type_.resolve()
+            dict.__setitem__(self, name, type_)
+        return type_
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def iteritems(self):
+        for name in self.keys():
+            yield name, self[name]
+
+    def itervalues(self):
+        for name in self.keys():
+            yield self[name]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def is_loaded(self, name):
+        '''Check whether a type is loaded, without loading it'''
+        return not isinstance(dict.__getitem__(self, name),
+                              LazyRootObjectType)
+
+    def placeholder(self, name):
+        '''Get the placeholder of a type which isn't loaded yet, or None'''
+        type_ = dict.__getitem__(self, name)
+        if isinstance(type_, LazyRootObjectType):
+            return type_
+        return None
 
 
 def compare_content(a, b):
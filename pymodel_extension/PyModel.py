@@ -37,66 +37,176 @@
 import os, sys
 
 from pymonkey import q
+import pymodel
 from pymodel import init
 
 import pymodel.utils
+import pymodel.aio
 
-from pymodel.serializers import ThriftSerializer
-from pymodel.serializers import YamlSerializer
-from pymodel.serializers import XMLSerializer
-from pymodel.serializers import ThriftBase64Serializer
+# Serializers are looked up on use, so only those used get imported
+from pymodel.serializers import SERIALIZERS
 
 from pymodel import ROOTOBJECT_TYPES
 
 class Domain(object):
     pass
 
+class LazyDomain(Domain):
+    '''Domain which only looks up its root object types on first use
+
+    The root object types are found using the domain manifest (see
+    L{pymodel.utils.DomainManifest}), so model modules are only imported
+    when one of their types is actually used through an accessor.
+    '''
+    def __init__(self, domainname, specpath):
+        self._domainname = domainname
+        self._specpath = specpath
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+
+        try:
+            init(self._specpath, self._domainname, lazy=True)
+        except:
+            self._loaded = False
+            raise
+
+        self._createAccessors()
+
+    def _createAccessors(self):
+        for name in [name for name in self.__dict__ if
+                     not name.startswith('_')]:
+            delattr(self, name)
+
+        types = ROOTOBJECT_TYPES[self._domainname]
+        for typename in types.keys():
+            placeholder = types.placeholder(typename)
+            if placeholder is None:
+                name = getattr(types[typename], 'PYMODEL_TYPE_NAME',
+                               typename.lower())
+            else:
+                name = placeholder.type_name or typename.lower()
+            setattr(self, name, LazyPyModelAccessor(self._domainname,
+                                                    typename))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or self._loaded:
+            raise AttributeError(name)
+
+        self._load()
+        return getattr(self, name)
+
+    def __dir__(self):
+        self._load()
+        return sorted(name for name in self.__dict__ if
+                      not name.startswith('_'))
+
 class Model(object):
     pass
 
 class PyModelAccessor(object):
     
-    def __init__(self, rootobject_type):
+    def __init__(self, rootobject_type, executor=None):
         '''Initialize a new pymodel root object accessor
+
+        @param executor: Executor running the asynchronous serialization
+                         methods, defaults to the one of pymodel.aio
         '''
         self._ROOTOBJECTTYPE = rootobject_type    
+        self._executor = executor
     
     def getEmptyModelObject(self, *args, **kwargs):
         return self._ROOTOBJECTTYPE(*args, **kwargs)
 
     #serializing methods
     def object2XML(self, data):
-        return self._serialize(XMLSerializer, data)
+        return self._serialize(SERIALIZERS['xml'], data)
     
     def object2YAML(self, data):
-        return self._serialize(YamlSerializer, data)
+        return self._serialize(SERIALIZERS['yaml'], data)
+
+    def object2JSON(self, data):
+        return self._serialize(SERIALIZERS['json'], data)
      
     def object2ThriftByteStr(self, data):
-        return self._serialize(ThriftSerializer, data)
+        return self._serialize(SERIALIZERS['thrift'], data)
     
     def object2ThriftBase64Str(self, data):        
-        return self._serialize(ThriftBase64Serializer, data)
+        return self._serialize(SERIALIZERS['thriftbase64'], data)
     
     #deserializing methods
     def XML2object(self, data):
-        return self._deserializer(XMLSerializer, data)
+        return self._deserializer(SERIALIZERS['xml'], data)
     
     def YAML2object(self, data):
-        return self._deserializer(YamlSerializer, data)
+        return self._deserializer(SERIALIZERS['yaml'], data)
+
+    def JSON2object(self, data):
+        return self._deserializer(SERIALIZERS['json'], data)
     
     def thriftByteStr2object(self, data):
-        return self._deserializer(ThriftSerializer, data)
+        return self._deserializer(SERIALIZERS['thrift'], data)
     
     def thriftBase64Str2object(self, data):
-        return self._deserializer(ThriftBase64Serializer, data)
+        return self._deserializer(SERIALIZERS['thriftbase64'], data)
     
     def _serialize(self, serializer, data):
         return data.serialize(serializer)
     
     def _deserializer(self, serializer, data):
         return self._ROOTOBJECTTYPE.deserialize(serializer, data)
+
+    #asynchronous methods, these return trollius futures or coroutines
+    def object2ThriftByteStrAsync(self, data):
+        return self.serializeAsync(SERIALIZERS['thrift'], data)
+
+    def thriftByteStr2objectAsync(self, data):
+        return self.deserializeAsync(SERIALIZERS['thrift'], data)
+
+    def serializeAsync(self, serializer, data):
+        return pymodel.aio.serialize(serializer, data, self._executor)
+
+    def deserializeAsync(self, serializer, data):
+        return pymodel.aio.deserialize(self._ROOTOBJECTTYPE, serializer, data,
+                                       self._executor)
+
+    def writeObject(self, writer, data, serializer=None):
+        return pymodel.aio.write_object(writer,
+                                        serializer or SERIALIZERS['thrift'],
+                                        data, self._executor)
+
+    def readObject(self, reader, serializer=None):
+        return pymodel.aio.read_object(reader, self._ROOTOBJECTTYPE,
+                                       serializer or SERIALIZERS['thrift'],
+                                       self._executor)
     
 
+class LazyPyModelAccessor(PyModelAccessor):
+    '''Accessor looking up its root object type in ROOTOBJECT_TYPES on use,
+    so the module defining the type is only imported when required'''
+
+    def __init__(self, domainname, typename, executor=None, types=None):
+        '''Initialize a new lazy accessor
+
+        @param types: Registry to look the type up in, defaults to the one
+                      of the domain in ROOTOBJECT_TYPES
+        @type types: L{pymodel.utils.RootObjectTypes}
+        '''
+        self._domainname = domainname
+        self._typename = typename
+        self._executor = executor
+        self._types = types
+
+    @property
+    def _ROOTOBJECTTYPE(self):
+        types = self._types
+        if types is None:
+            types = ROOTOBJECT_TYPES[self._domainname]
+        return types[self._typename]
+
 
 class PyModel(object):
 
@@ -106,43 +216,87 @@ class PyModel(object):
         self.__dict__ = self.__shared_state
         
         # Keep track of domains
-        self._domains = {}
+        if not hasattr(self, '_domains'):
+            self._domains = {}
         
         if not hasattr(self, 'initialized'):
             self.__initialize()
             setattr(self, 'initialized', True)
             
-    def importDomain(self, domainname, specpath):
-
-        domain = Domain()      
-        
-        init(specpath, domainname)
-                 
-        from pymodel import ROOTOBJECT_TYPES as types
-        for type in types[domainname].itervalues():
-            name = getattr(type, 'PYMODEL_TYPE_NAME', type.__name__.lower())
-            setattr(domain, name, PyModelAccessor(type))
+    def importDomain(self, domainname, specpath, lazy=True):
+        '''
+        Registers a domain. Unless lazy is False, its root object types are
+        only looked up when the domain is first used. Importing a domain
+        again from the same path keeps the registered domain.
+        '''
+        domain = self._domains.get(domainname)
+        if domain is None or domain._specpath != specpath:
+            domain = LazyDomain(domainname, specpath)
+        if not lazy:
+            domain._load()
             
         setattr(self, domainname, domain)
         self._domains[domainname] = domain
         
+    def reloadDomain(self, domainname):
+        '''
+        Re-imports the changed model modules of a loaded domain, see
+        pymodel.reload_domain. Returns the names of the reloaded modules.
+        '''
+        domain = self._domains[domainname]
+        if not domain._loaded:
+            return []
+
+        reloaded = pymodel.reload_domain(domainname)
+        if reloaded:
+            domain._createAccessors()
+        return reloaded
+
+    def watchDomains(self, interval=2.0):
+        '''
+        Starts a thread reloading changed model modules of the loaded
+        domains every interval seconds. Returns the watcher thread, call its
+        stop method to stop watching.
+        '''
+        def reloaded(domainname, modules):
+            # Domains initialized using pymodel.init have no accessors
+            domain = self._domains.get(domainname)
+            if domain is not None and domain._loaded:
+                domain._createAccessors()
+
+        watcher = pymodel.utils.ModelWatcher(interval=interval,
+                                             callback=reloaded)
+        watcher.start()
+        return watcher
+
     def listDomains(self):
         '''
-        Returns the list of imported domain names
+        Returns the list of imported domain names, without loading them
         '''
         return self._domains.keys()
     
     def getModel(self, path):
-        import pymodel.utils
+        '''
+        Returns accessors for the root object types of all domains in path.
+        The types are found using the domain manifests, model modules are
+        only imported when one of their types is used.
+        '''
         model = Model()
         for domain in q.system.fs.listDirsInDir(path):
             domain_name = q.system.fs.getBaseName(domain)
-            types = list(pymodel.utils.find_rootobject_types(domain, domain_name))
+            manifest = pymodel.utils.DomainManifest(domain)
+            found = manifest.scan(domain_name)
+            manifest.save()
+
+            types = pymodel.utils.RootObjectTypes()
             domain_obj = Domain()
             setattr(model, domain_name, domain_obj)
-            for type_ in types:
-                name = type_.__name__
-                setattr(domain_obj, name, PyModelAccessor(type_))
+            for name, module_name, module_path, info in found:
+                types[name] = pymodel.utils.LazyRootObjectType(
+                    domain_name, name, module_name, module_path,
+                    info['type_name'])
+                setattr(domain_obj, name, LazyPyModelAccessor(
+                    domain_name, name, types=types))
         return model
                         
     def __initialize(self):        